@@ -0,0 +1,274 @@
+# benchmarks.py
+"""
+Micro-benchmarks for game logic, DB helpers and bet handlers.
+
+Results are written as JSON; pass --baseline to compare a run against a saved
+result file and flag regressions. Exits with status 1 when any benchmark is
+slower than the baseline by more than --threshold.
+
+Usage:
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from loadtest import RecordingRequest, UpdateFactory
+
+GAMES = ["slots", "blackjack", "dice", "basketball", "darts"]
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Point the bot at a scratch database before main is imported"""
+    os.environ["CASINO_DB"] = args.db
+    os.environ["DEMO_MODE"] = "false"
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    os.environ.setdefault("LOG_TO_FILE", "false")
+    os.environ.setdefault("SLOW_UPDATE_MS", "1000000")
+
+def summarize(samples: List[float], iterations: int) -> dict:
+    """Per-operation timings in microseconds from per-round totals"""
+    per_op = sorted(sample / iterations * 1e6 for sample in samples)
+    return {
+        "unit": "us",
+        "median": round(statistics.median(per_op), 3),
+        "best": round(per_op[0], 3),
+        "p99": round(per_op[min(len(per_op) - 1, int(round(0.99 * (len(per_op) - 1))))], 3),
+        "rounds": len(per_op),
+        "iterations": iterations,
+    }
+
+def bench_sync(func: Callable[[], object], rounds: int, min_round_time: float = 0.02) -> dict:
+    """Time a pure function, calibrating iterations so each round takes min_round_time"""
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        if time.perf_counter() - started >= min_round_time:
+            break
+        iterations *= 2
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples, iterations)
+
+async def bench_async(factory: Callable[[], object], rounds: int, warmup: int = 3) -> dict:
+    """Time one awaited call per round; DB and handler calls are too slow to batch"""
+    for _ in range(warmup):
+        await factory()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await factory()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples, 1)
+
+# --- Seed Data ---
+
+def seed_database(main, users: int, sessions: int, rng: random.Random) -> List[int]:
+    """Fill the scratch database with users, referrals and game history; returns user ids"""
+    user_ids = [200000 + i for i in range(users)]
+    now = datetime.now()
+    with sqlite3.connect(main.DB_PATH) as db:
+        # One in five users was referred by one of the first 5% of users
+        referrers = user_ids[:max(1, users // 20)]
+        db.executemany(
+            "INSERT INTO users (user_id, username, balance, total_wagered, games_played, referral_code, referred_by) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(
+                user_id, f"user{user_id}", rng.randint(0, 5000 * main.MICRO),
+                rng.randint(0, 50000 * main.MICRO), rng.randint(0, 2000), f"REF{user_id:X}",
+                f"REF{rng.choice(referrers):X}" if user_id not in referrers and rng.random() < 0.2 else None,
+            ) for user_id in user_ids],
+        )
+        db.execute("""
+            INSERT INTO referrals (referrer_id, referee_id, referral_code, status)
+            SELECT r.user_id, u.user_id, u.referred_by, 'active'
+            FROM users u JOIN users r ON r.referral_code = u.referred_by
+        """)
+        rows = []
+        for _ in range(sessions):
+            bet = rng.choice([1, 5, 10, 25, 50, 100]) * main.MICRO
+            win = bet * rng.choice([0, 0, 0, 1, 4, 6, 20]) // 2
+            rows.append((
+                rng.choice(user_ids), rng.choice(GAMES), bet, win, win - bet,
+                "win" if win > bet else "loss",
+                (now - timedelta(seconds=rng.randint(0, 90 * 86400))).isoformat(),
+            ))
+        db.executemany(
+            "INSERT INTO game_sessions (user_id, game_type, bet_amount, win_amount, net_result, result, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (main.to_micros(1000000), user_ids[-1]))
+    return user_ids
+
+# --- Suites ---
+
+def run_logic_suite(main, rounds: int) -> Dict[str, dict]:
+    reels = main.generate_slot_reels()
+    hand = main.generate_blackjack_hand() + ["A"]
+    return {
+        "logic.generate_slot_reels": bench_sync(main.generate_slot_reels, rounds),
+        "logic.calculate_slots_win": bench_sync(lambda: main.calculate_slots_win(reels, 10 * main.MICRO), rounds),
+        "logic.calculate_hand_value": bench_sync(lambda: main.calculate_hand_value(hand), rounds),
+        "logic.roll_dice": bench_sync(main.roll_dice, rounds),
+        "logic.shoot_basketball": bench_sync(lambda: main.shoot_basketball("three_pointer"), rounds),
+        "logic.throw_dart": bench_sync(lambda: main.throw_dart("triple_20"), rounds),
+    }
+
+async def run_db_suite(main, user_ids: List[int], rounds: int, rng: random.Random) -> Dict[str, dict]:
+    player = user_ids[-1]  # Funded so every deduction succeeds
+    with sqlite3.connect(main.DB_PATH) as db:
+        referee = db.execute("SELECT user_id FROM users WHERE referred_by IS NOT NULL LIMIT 1").fetchone()[0]
+        db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (main.to_micros(1000000), referee))
+    return {
+        "db.get_user": await bench_async(lambda: main.get_user(rng.choice(user_ids)), rounds),
+        "db.deduct_balance": await bench_async(lambda: main.deduct_balance(player, main.MICRO), rounds),
+        "db.settle_bet": await bench_async(
+            lambda: main.place_bet(player, "slots", main.MICRO, main.MICRO // 2, "loss"), rounds),
+        "db.settle_bet_referred": await bench_async(
+            lambda: main.place_bet(referee, "slots", main.MICRO, main.MICRO // 2, "loss"), rounds),
+    }
+
+async def run_handler_suite(main, user_ids: List[int], rounds: int) -> Dict[str, dict]:
+    from telegram.ext import CallbackContext
+
+    application = main.build_application(request=RecordingRequest())
+    await application.initialize()
+    updates = UpdateFactory(application.bot)
+    player = user_ids[-1]
+
+    def call(handler, data: str):
+        update = updates.build(player, data)
+        return handler(update, CallbackContext.from_update(update, application))
+
+    try:
+        return {
+            "handler.handle_slots_bet": await bench_async(lambda: call(main.handle_slots_bet, "slots_bet_1"), rounds),
+            "handler.handle_blackjack_bet": await bench_async(
+                lambda: call(main.handle_blackjack_bet, "blackjack_bet_1"), rounds),
+            "handler.handle_dice_play": await bench_async(
+                lambda: call(main.handle_dice_play, "dice_play_high_1"), rounds),
+            "handler.handle_basketball_shoot": await bench_async(
+                lambda: call(main.handle_basketball_shoot, "basketball_shoot_jump_shot_1"), rounds),
+            "handler.handle_darts_throw": await bench_async(
+                lambda: call(main.handle_darts_throw, "darts_throw_triple_20_1"), rounds),
+        }
+    finally:
+        await application.shutdown()
+
+async def run_benchmarks(args: argparse.Namespace) -> dict:
+    import main
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    await main.init_db()
+    started = time.perf_counter()
+    user_ids = seed_database(main, args.users, args.sessions, rng)
+    seed_seconds = time.perf_counter() - started
+    await main.load_referral_graph()
+
+    results: Dict[str, dict] = {}
+    if "logic" in args.suites:
+        results.update(run_logic_suite(main, args.rounds))
+    if "db" in args.suites:
+        results.update(await run_db_suite(main, user_ids, args.db_rounds, rng))
+    if "handlers" in args.suites:
+        results.update(await run_handler_suite(main, user_ids, args.db_rounds))
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed_users": args.users,
+            "seed_sessions": args.sessions,
+            "seed_seconds": round(seed_seconds, 2),
+        },
+        "benchmarks": results,
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+# --- Reporting ---
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Print median changes against the baseline; returns names of regressed benchmarks"""
+    regressions = []
+    print(f"\n{'benchmark':<40}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in current["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before:
+            print(f"{name:<40}{'-':>12}{result['median']:>12}{'new':>10}")
+            continue
+        change = (result["median"] - before["median"]) / before["median"] if before["median"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{before['median']:>12}{result['median']:>12}{change:>+10.1%}{flag}")
+    return regressions
+
+def print_results(results: dict) -> None:
+    meta = results["meta"]
+    print(f"Seeded {meta['seed_users']} users / {meta['seed_sessions']} sessions in {meta['seed_seconds']}s")
+    print(f"\n{'benchmark':<40}{'median us':>12}{'best us':>12}{'p99 us':>12}")
+    for name, result in results["benchmarks"].items():
+        print(f"{name:<40}{result['median']:>12}{result['best']:>12}{result['p99']:>12}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Casino bot micro-benchmarks")
+    parser.add_argument("--suites", default="logic,db,handlers", help="comma-separated: logic,db,handlers")
+    parser.add_argument("--users", type=int, default=10000, help="seeded users")
+    parser.add_argument("--sessions", type=int, default=100000, help="seeded game sessions")
+    parser.add_argument("--rounds", type=int, default=30, help="rounds per game logic benchmark")
+    parser.add_argument("--db-rounds", type=int, default=200, help="calls per DB/handler benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default=None, help="database file (default: fresh temporary file)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed median slowdown, 0.15 = 15%%")
+    args = parser.parse_args(argv)
+    args.suites = set(args.suites.split(","))
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="casino-bench-"), "casino.db")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_environment(args)
+    results = asyncio.run(run_benchmarks(args))
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
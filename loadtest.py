@@ -0,0 +1,396 @@
+# loadtest.py
+"""
+Offline load test for the casino bot.
+
+Drives synthetic Telegram updates through the real handler stack with a
+recording Bot API stub and a local fake CryptoBot server, then reports
+throughput, latency percentiles and database contention.
+
+Usage: python loadtest.py --users 50 --rounds 20
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+import dataclasses
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.request import BaseRequest
+
+# Valid-looking LTC address accepted by validate_crypto_address
+TEST_LTC_ADDRESS = "LdP8Qox1VAhCzLJNqrr74YovaWYyNBUWvL"
+TEST_LTC_RATE = "85.00"
+
+# Flow name -> steps; "/x" is a command, "text:x" a message, anything else callback data.
+# "{invoice}" is replaced with the user's latest invoice on the fake CryptoBot server.
+FLOWS: Dict[str, List[str]] = {
+    "start": ["/start"],
+    "games": ["mini_app_centre", "game_slots", "game_dice", "games"],
+    "slots": ["game_slots", "slots_bet_1", "slots_bet_5", "slots_bet_1"],
+    "dice": ["game_dice", "dice_bet_5", "dice_play_high_5", "dice_play_seven_1"],
+    "deposit": ["deposit", "deposit_LTC", "text:25", "check_payment_{invoice}"],
+    "withdraw": ["withdraw", "withdraw_LTC", "text:5", f"text:{TEST_LTC_ADDRESS}"],
+}
+FLOW_WEIGHTS = {"start": 1, "games": 2, "slots": 6, "dice": 4, "deposit": 1, "withdraw": 1}
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Point the bot at the scratch database and fake CryptoBot before main is imported"""
+    os.environ["CASINO_DB"] = args.db
+    os.environ["CRYPTOBOT_API_URL"] = f"http://127.0.0.1:{args.cryptobot_port}/api"
+    os.environ["CRYPTOBOT_API_TOKEN"] = "loadtest"
+    os.environ["DEMO_MODE"] = "false"
+    os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_TO_FILE", "false")
+    os.environ.setdefault("SLOW_UPDATE_MS", "1000000")
+
+def step_label(flow: str, step: str) -> str:
+    """Group steps by action, dropping bet amounts, predictions and invoice ids"""
+    if step.startswith("/"):
+        return f"{flow}{step}"
+    if step.startswith("text:"):
+        return f"{flow}/text"
+    parts = [part for part in step.split("_") if not part.isdigit() and part != "{invoice}"]
+    return f"{flow}/{step if len(parts) == len(step.split('_')) else '_'.join(parts[:2])}"
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+# --- Fake CryptoBot ---
+
+class FakeCryptoBot:
+    """Minimal pay.crypt.bot API; invoices are reported paid on the first status check."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.invoices: Dict[int, dict] = {}
+        self.latest_invoice: Dict[int, int] = {}
+        self._invoice_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, port: int) -> None:
+        app = web.Application()
+        app.router.add_get("/api/getExchangeRates", self.get_exchange_rates)
+        app.router.add_post("/api/createInvoice", self.create_invoice)
+        app.router.add_get("/api/getInvoices", self.get_invoices)
+        app.router.add_post("/api/transfer", self.transfer)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _respond(self, method: str, result) -> web.Response:
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_exchange_rates(self, request: web.Request) -> web.Response:
+        return await self._respond("getExchangeRates", [
+            {"is_valid": True, "source": "LTC", "target": "USD", "rate": TEST_LTC_RATE},
+        ])
+
+    async def create_invoice(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        invoice_id = next(self._invoice_ids)
+        invoice = {
+            "invoice_id": invoice_id,
+            "status": "active",
+            "asset": data["asset"],
+            "amount": data["amount"],
+            "hidden_message": data.get("hidden_message", ""),
+            "bot_invoice_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+        }
+        self.invoices[invoice_id] = invoice
+        if invoice["hidden_message"].isdigit():
+            self.latest_invoice[int(invoice["hidden_message"])] = invoice_id
+        return await self._respond("createInvoice", invoice)
+
+    async def get_invoices(self, request: web.Request) -> web.Response:
+        items = []
+        for invoice_id in request.query.get("invoice_ids", "").split(","):
+            invoice = self.invoices.get(int(invoice_id)) if invoice_id.isdigit() else None
+            if invoice:
+                invoice["status"] = "paid"
+                items.append(invoice)
+        return await self._respond("getInvoices", {"items": items})
+
+    async def transfer(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        return await self._respond("transfer", {"transfer_id": next(self._invoice_ids), "status": "completed", **data})
+
+# --- Stub Bot API ---
+
+class RecordingRequest(BaseRequest):
+    """Bot API transport that records outbound calls and answers like Telegram."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint: str, params: dict):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Axis Casino", "username": "AxisCasinoBot"}
+        if endpoint.startswith(("send", "edit")):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+class UpdateFactory:
+    """Builds synthetic Updates bound to a bot so replies go through its transport."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def build(self, user_id: int, step: str) -> Update:
+        """Update for a command ("/x"), text message ("text:x") or callback button press"""
+        update_id = next(self._ids)
+        if step.startswith("/"):
+            data = {"update_id": update_id, "message": self._message(user_id, step)}
+        elif step.startswith("text:"):
+            data = {"update_id": update_id, "message": self._message(user_id, step[5:])}
+        else:
+            data = {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": step,
+                    "message": self._message(user_id, "menu"),
+                },
+            }
+        return Update.de_json(data, self.bot)
+
+# --- Load Generator ---
+
+class LoadTest:
+    """Virtual users replaying weighted flows against an in-process Application."""
+
+    def __init__(self, main, args: argparse.Namespace, cryptobot: FakeCryptoBot):
+        self.main = main
+        self.args = args
+        self.cryptobot = cryptobot
+        self.request = RecordingRequest(args.telegram_latency_ms / 1000)
+        self.application = main.build_application(request=self.request)
+        main.bot_application = self.application  # notifications go through the recording request too
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.updates = UpdateFactory(self.application.bot)
+
+    async def send(self, user_id: int, step: str, label: str) -> None:
+        step = step.replace("{invoice}", str(self.cryptobot.latest_invoice.get(user_id, 0)))
+        update = self.updates.build(user_id, step)
+        started = time.perf_counter()
+        try:
+            await self.application.process_update(update)
+        except Exception as e:
+            self.errors[f"{label}: {type(e).__name__}"] += 1
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def seed_users(self) -> None:
+        """Register every virtual user through /start and fund their balances"""
+        user_ids = self.user_ids()
+        for user_id in user_ids:
+            await self.send(user_id, "/start", "seed")
+        for user_id in user_ids:
+            await self.main.update_balance(user_id, self.main.to_micros(self.args.balance), "adjustment", "loadtest")
+        self.latencies.pop("seed", None)
+
+    def user_ids(self) -> List[int]:
+        return [100000 + i for i in range(self.args.users)]
+
+    async def virtual_user(self, user_id: int, rng: random.Random) -> None:
+        names = list(FLOW_WEIGHTS)
+        weights = [FLOW_WEIGHTS[name] for name in names]
+        for _ in range(self.args.rounds):
+            flow = rng.choices(names, weights)[0]
+            for step in FLOWS[flow]:
+                await self.send(user_id, step, step_label(flow, step))
+                if self.args.think_ms:
+                    await asyncio.sleep(rng.uniform(0, self.args.think_ms / 1000))
+
+    async def run(self) -> dict:
+        await self.main.init_db()
+        await self.main.load_referral_graph()
+        if not self.args.rate_limits:
+            # Measure the handler stack, not the tap throttle
+            self.main.config = dataclasses.replace(self.main.config, bet_rate_per_second=0.0,
+                                                   callback_rate_per_second=0.0, global_bet_rate_per_second=0.0)
+        await self.application.initialize()
+        try:
+            await self.seed_users()
+            db_before = self.main.DB_OPERATION_SECONDS.totals()
+            commit_before = self.main.DB_COMMIT_SECONDS.totals()
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self.virtual_user(user_id, random.Random(self.args.seed + user_id))
+                for user_id in self.user_ids()
+            ))
+            elapsed = time.perf_counter() - started
+        finally:
+            await self.main.flush_game_rollups()
+            await self.application.shutdown()
+        return self.report(elapsed, db_before, commit_before)
+
+    def report(self, elapsed: float, db_before: dict, commit_before: dict) -> dict:
+        all_latencies = [value for values in self.latencies.values() for value in values]
+
+        def stats(values: List[float]) -> dict:
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+            }
+
+        def histogram_delta(after: dict, before: dict) -> dict:
+            delta = {}
+            for labels, (count, total) in after.items():
+                prev_count, prev_total = before.get(labels, (0, 0.0))
+                if count > prev_count:
+                    delta[labels[0]] = {
+                        "count": count - prev_count,
+                        "mean_ms": round((total - prev_total) / (count - prev_count) * 1000, 2),
+                    }
+            return delta
+
+        return {
+            "users": self.args.users,
+            "rounds": self.args.rounds,
+            "updates": len(all_latencies),
+            "elapsed_s": round(elapsed, 2),
+            "throughput_ups": round(len(all_latencies) / elapsed, 1) if elapsed else 0.0,
+            "latency": stats(all_latencies),
+            "steps": {label: stats(values) for label, values in sorted(self.latencies.items())},
+            "db_operations": histogram_delta(self.main.DB_OPERATION_SECONDS.totals(), db_before),
+            "db_commits": histogram_delta(self.main.DB_COMMIT_SECONDS.totals(), commit_before),
+            "db_locked_errors": lock_counter.count,
+            "rate_limited": int(sum(self.main.RATE_LIMITED_TOTAL._values.values())),
+            "handler_errors": dict(self.errors),
+            "telegram_calls": dict(self.request.calls),
+            "cryptobot_calls": dict(self.cryptobot.calls),
+        }
+
+class _LockCounter(logging.Handler):
+    """Counts logged 'database is locked' failures"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if "locked" in record.getMessage():
+            self.count += 1
+
+lock_counter = _LockCounter()
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['users']} users x {report['rounds']} rounds: {report['updates']} updates "
+          f"in {report['elapsed_s']}s -> {report['throughput_ups']} updates/s")
+    latency = report["latency"]
+    print(f"Latency p50 {latency['p50_ms']}ms  p99 {latency['p99_ms']}ms  max {latency['max_ms']}ms\n")
+    print(f"{'step':<36}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for label, step in report["steps"].items():
+        print(f"{label:<36}{step['count']:>8}{step['p50_ms']:>10}{step['p99_ms']:>10}")
+    print(f"\n{'db operation':<36}{'count':>8}{'mean ms':>10}")
+    for name, op in sorted(report["db_operations"].items()):
+        print(f"{name:<36}{op['count']:>8}{op['mean_ms']:>10}")
+    for name, op in sorted(report["db_commits"].items()):
+        print(f"{'commit ' + name:<36}{op['count']:>8}{op['mean_ms']:>10}")
+    print(f"\nDatabase locked errors: {report['db_locked_errors']}")
+    print(f"Rate-limited taps: {report['rate_limited']}")
+    if report["handler_errors"]:
+        print(f"Handler errors: {report['handler_errors']}")
+    print(f"Telegram calls: {report['telegram_calls']}")
+    print(f"CryptoBot calls: {report['cryptobot_calls']}")
+
+async def run(args: argparse.Namespace) -> dict:
+    import main
+
+    logging.getLogger().addHandler(lock_counter)
+
+    cryptobot = FakeCryptoBot(args.cryptobot_latency_ms / 1000)
+    await cryptobot.start(args.cryptobot_port)
+    try:
+        return await LoadTest(main, args, cryptobot).run()
+    finally:
+        await cryptobot.stop()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test for the casino bot")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--rounds", type=int, default=20, help="flows per user")
+    parser.add_argument("--balance", type=float, default=10000.0, help="starting balance per user")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="max random pause between steps")
+    parser.add_argument("--telegram-latency-ms", type=float, default=0.0, help="simulated Bot API latency")
+    parser.add_argument("--cryptobot-latency-ms", type=float, default=0.0, help="simulated CryptoBot latency")
+    parser.add_argument("--cryptobot-port", type=int, default=8765)
+    parser.add_argument("--db", default=None, help="database file (default: fresh temporary file)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate-limits", action="store_true", help="keep the default tap rate limits")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args(argv)
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="casino-loadtest-"), "casino.db")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_environment(args)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
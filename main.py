@@ -6,9 +6,25 @@ Clean and maintainable casino bot with essential features
 
 import os
 import time
+import json
+import gzip
+import copy
+import queue
+import threading
+import shutil
+import atexit
+import io
+import html
+import bisect
+import pstats
+import cProfile
+import contextvars
+import math
 import random
 import asyncio
+import functools
 import logging
+import logging.handlers
 import hashlib
 import uuid
 import re
@@ -16,32 +32,158 @@ import hmac
 import sqlite3
 import aiosqlite
 import aiohttp
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+import dataclasses
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from aiohttp import web
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application, ApplicationBuilder, CommandHandler,
-    CallbackQueryHandler, ContextTypes, MessageHandler, filters, ConversationHandler
+    CallbackQueryHandler, ContextTypes, MessageHandler, filters, ConversationHandler,
+    BasePersistence, PersistenceInput, ApplicationHandlerStop
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('casino_bot.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
-
 # --- Configuration ---
 load_dotenv()
 
+# --- Logging ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_TO_FILE = os.environ.get("LOG_TO_FILE", "true").lower() == "true"
+LOG_FILE_PATH = os.environ.get("LOG_FILE_PATH", "casino_bot.log")
+LOG_MAX_SIZE = int(os.environ.get("LOG_MAX_SIZE", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()  # text or json
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "httpx=WARNING")  # per-logger levels: "casino.rates=DEBUG,httpx=WARNING"
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")  # keep 1 in N records below WARNING: "casino.rates=100"
+
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line, including any `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Let through 1 of every `every` records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._seen = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        self._seen += 1
+        return (self._seen - 1) % self.every == 0
+
+class _LoopSafeQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the listener thread, resolving only the message on the caller."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """Compress a rotated log file"""
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def _parse_logger_settings(spec: str) -> Dict[str, str]:
+    """Parse 'name=value,name=value' settings"""
+    settings = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip():
+            settings[name.strip()] = value.strip()
+    return settings
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_log_queue: Optional[queue.SimpleQueue] = None
+
+def setup_logging() -> None:
+    """
+    Route all logging through a queue so file and console I/O happen on a
+    background thread instead of the event loop.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+    
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if LOG_TO_FILE:
+        log_dir = os.path.dirname(LOG_FILE_PATH)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE_PATH, maxBytes=LOG_MAX_SIZE, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.namer = lambda name: f"{name}.gz"
+        file_handler.rotator = _gzip_rotator
+        handlers.append(file_handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    global _log_queue
+    _log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(_LoopSafeQueueHandler(_log_queue))
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    
+    for name, level in _parse_logger_settings(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+    for name, every in _parse_logger_settings(LOG_SAMPLING).items():
+        if every.isdigit():
+            logging.getLogger(name).addFilter(SamplingFilter(int(every)))
+    
+    _log_listener = logging.handlers.QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the logging thread"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+setup_logging()
+logger = logging.getLogger(__name__)
+# Dedicated loggers for high-frequency paths so they can be tuned or sampled independently
+rates_logger = logging.getLogger("casino.rates")
+payments_logger = logging.getLogger("casino.payments")
+referrals_logger = logging.getLogger("casino.referrals")
+
 # Owner and Admin Configuration
 OWNER_USER_ID = int(os.environ.get("OWNER_USER_ID", "0"))
 ADMIN_USER_IDS = list(map(int, os.environ.get("ADMIN_USER_IDS", "").split(","))) if os.environ.get("ADMIN_USER_IDS") else []
@@ -54,28 +196,91 @@ def is_admin(user_id: int) -> bool:
     """Check if user is an admin/owner"""
     return user_id in ADMIN_USER_IDS or is_owner(user_id)
 
+# --- Money ---
+# USD amounts are integer micro-dollars everywhere: in the database, in settlement and
+# in limits. Crypto quantities are integers in the asset's smallest unit (1e-8 for LTC).
+# Decimal is only used to convert at the edges (user input, CryptoBot, exchange rates).
+
+MICRO = 1_000_000
+CRYPTO_UNITS = 100_000_000
+BPS = 10_000  # Basis points per whole, for percentage fees and commissions
+
+def to_micros(amount) -> int:
+    """Convert a dollar amount (str, int, float or Decimal) to micro-dollars"""
+    try:
+        micros = (Decimal(str(amount)) * MICRO).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return int(micros)
+
+def parse_usd_input(text: str) -> int:
+    """Micro-dollars from user input such as "$1,250.50"; raises ValueError"""
+    return to_micros(text.strip().replace('$', '').replace(',', ''))
+
+def micros_to_usd(micros: int) -> float:
+    """Dollars as float, for metrics and other non-accounting outputs"""
+    return micros / MICRO
+
+def format_money(micros: int) -> str:
+    """Micro-dollars as '$1,234.56', rounded half up to the cent"""
+    cents = (abs(micros) + 5_000) // 10_000
+    sign = "-" if micros < 0 and cents else ""
+    return f"{sign}${cents // 100:,}.{cents % 100:02d}"
+
+def usd_callback_arg(micros: int) -> str:
+    """Dollar amount for callback data, e.g. "25" or "2.5"; parsed back with to_micros"""
+    return format(Decimal(micros) / MICRO, "f")
+
+def apply_bps(micros: int, bps: int) -> int:
+    """`bps` basis points of an amount, rounded half up"""
+    return (micros * bps + BPS // 2) // BPS
+
+def usd_to_crypto_units(micros: int, rate: float) -> int:
+    """Crypto base units worth `micros` at `rate` USD per coin"""
+    units = Decimal(micros) * CRYPTO_UNITS / (Decimal(str(rate)) * MICRO)
+    return int(units.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def crypto_units_to_micros(units: int, rate: float) -> int:
+    """Micro-dollars worth `units` crypto base units at `rate` USD per coin"""
+    micros = Decimal(units) * Decimal(str(rate)) * MICRO / CRYPTO_UNITS
+    return int(micros.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def parse_crypto_amount(value) -> int:
+    """Crypto base units from an API decimal string such as "0.12345678" """
+    return int((Decimal(str(value)) * CRYPTO_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def format_crypto(units: int) -> str:
+    """Crypto base units as a fixed 8-decimal string, as CryptoBot expects"""
+    return f"{Decimal(units) / CRYPTO_UNITS:.8f}"
+
 # Bot Configuration
 load_dotenv("env.litecoin")
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 DB_PATH = os.environ.get("CASINO_DB", "casino.db")
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL").upper()  # persists in the DB file once set
+DB_JOURNAL_MODES = {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"}
 DEMO_MODE = os.environ.get("DEMO_MODE", "false").lower() == "true"
 BOT_VERSION = "2.1.0"
 
 # CryptoBot configuration
 CRYPTOBOT_API_TOKEN = os.environ.get("CRYPTOBOT_API_TOKEN")
+CRYPTOBOT_API_URL = os.environ.get("CRYPTOBOT_API_URL", "https://pay.crypt.bot/api").rstrip("/")
 CRYPTOBOT_USD_ASSET = os.environ.get("CRYPTOBOT_USD_ASSET", "LTC")
 CRYPTOBOT_WEBHOOK_SECRET = os.environ.get("CRYPTOBOT_WEBHOOK_SECRET")
 
 # Deployment configuration
 PORT = int(os.environ.get("PORT", "8001"))
 
-# Withdrawal limits
-MIN_WITHDRAWAL_USD = float(os.environ.get("MIN_WITHDRAWAL_USD", "1.00"))
-MAX_WITHDRAWAL_USD = float(os.environ.get("MAX_WITHDRAWAL_USD", "10000.00"))
-MAX_WITHDRAWAL_USD_DAILY = float(os.environ.get("MAX_WITHDRAWAL_USD_DAILY", "10000.00"))
-WITHDRAWAL_FEE_PERCENT = 0.02  # 2%
-MIN_WITHDRAWAL_FEE = 1.0
+# Withdrawal limits (micro-dollars)
+MIN_WITHDRAWAL_USD = to_micros(os.environ.get("MIN_WITHDRAWAL_USD", "1.00"))
+MAX_WITHDRAWAL_USD = to_micros(os.environ.get("MAX_WITHDRAWAL_USD", "10000.00"))
+MAX_WITHDRAWAL_USD_DAILY = to_micros(os.environ.get("MAX_WITHDRAWAL_USD_DAILY", "10000.00"))
+WITHDRAWAL_FEE_BPS = 200  # 2%
+HOUSE_OPENING_BALANCE = to_micros("10000.00")
+MIN_WITHDRAWAL_FEE = to_micros("1.00")
+MIN_DEPOSIT_USD = to_micros("1.00")
+MAX_DEPOSIT_USD = to_micros("10000.00")
 WITHDRAWAL_COOLDOWN_SECONDS = int(os.environ.get("WITHDRAWAL_COOLDOWN_SECONDS", "300"))
 
 if not BOT_TOKEN:
@@ -90,11 +295,331 @@ CRYPTO_ADDRESS_PATTERNS = {
     'LTC': r'^[LM3][a-km-zA-HJ-NP-Z1-9]{26,33}$|^ltc1[qpzry9x8gf2tvdw0s3jn54khce6mua7l]{39,59}$',
 }
 
-# --- Helper Functions ---
-async def format_usd(amount: float) -> str:
-    """Format USD amount for display"""
-    return f"${amount:.2f}"
+# --- Metrics ---
+# In-process metrics exposed in Prometheus text format on /metrics.
+# Each metric guards its values with a lock: logging filters and executor threads record
+# from outside the event loop, and an unguarded read-modify-write could lose updates.
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    """Render a label set as {name="value",...}"""
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonically increasing value per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in values]
+
+class Gauge(Counter):
+    """Value that can go up and down, optionally computed at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def collect(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {float(self._function())}"]
+            except Exception:
+                return []
+        return super().collect()
+
+class Histogram:
+    """Bucketed distribution of observed values per label set."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label set -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _snapshot(self) -> List[Tuple[tuple, list]]:
+        with self._lock:
+            return [(labels, list(series)) for labels, series in self._series.items()]
+
+    def totals(self) -> Dict[tuple, Tuple[int, float]]:
+        """(count, sum) of observations per label set"""
+        return {labels: (sum(series[:-1]), series[-1]) for labels, series in self._snapshot()}
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, series in self._snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Holds all metrics and renders the text exposition format."""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), function=None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+BETS_TOTAL = metrics.counter("casino_bets_total", "Settled bets", ("game",))
+WAGERED_USD_TOTAL = metrics.counter("casino_wagered_usd_total", "Amount wagered in USD", ("game",))
+PAID_OUT_USD_TOTAL = metrics.counter("casino_paid_out_usd_total", "Amount paid out to players in USD", ("game",))
+SETTLEMENT_FAILURES_TOTAL = metrics.counter("casino_settlement_failures_total", "Bets rolled back by a settlement error", ("game",))
+SETTLEMENT_SECONDS = metrics.histogram("casino_settlement_seconds", "Bet handler latency from tap to result", ("game",))
+DB_OPERATION_SECONDS = metrics.histogram("casino_db_operation_seconds", "Latency of database helpers", ("operation",))
+DB_COMMIT_SECONDS = metrics.histogram("casino_db_commit_seconds", "Latency of database commits", ("operation",))
+CRYPTOBOT_REQUEST_SECONDS = metrics.histogram("casino_cryptobot_request_seconds", "CryptoBot API call latency", ("method",))
+CRYPTOBOT_ERRORS_TOTAL = metrics.counter("casino_cryptobot_errors_total", "Failed CryptoBot API calls", ("method",))
+WEBHOOK_REQUESTS_TOTAL = metrics.counter("casino_webhook_requests_total", "CryptoBot webhook requests", ("status",))
+LOG_ERRORS_TOTAL = metrics.counter("casino_log_errors_total", "Records logged at ERROR or above", ("logger",))
+RECONCILIATION_MISMATCHES = metrics.gauge("casino_reconciliation_mismatches",
+                                            "Mismatches found by the last reconciliation run", ("check",))
+RECONCILIATION_SECONDS = metrics.histogram("casino_reconciliation_seconds", "Reconciliation run duration",
+                                           ("mode",), buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 1800))
+UPTIME_SECONDS = metrics.gauge("casino_uptime_seconds", "Seconds since process start",
+                               function=lambda: time.time() - start_time)
+
+def observe_latency(histogram: Histogram, *labels: str):
+    """Decorator recording how long an async function takes"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+def instrument_cryptobot(method: str):
+    """Decorator timing a CryptoBot API helper and counting failed results"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            try:
+                with trace_span(f"cryptobot.{method}"):
+                    result = await func(*args, **kwargs)
+                return result
+            finally:
+                CRYPTOBOT_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+                if not result or (isinstance(result, dict) and not result.get("ok")):
+                    CRYPTOBOT_ERRORS_TOTAL.inc(method)
+        return wrapper
+    return decorator
+
+async def commit_timed(db: aiosqlite.Connection, operation: str) -> None:
+    """Commit and record commit latency"""
+    started = time.perf_counter()
+    await db.commit()
+    DB_COMMIT_SECONDS.observe(time.perf_counter() - started, operation)
+
+class _ErrorCountingFilter(logging.Filter):
+    """Count error records per logger without filtering anything out."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            LOG_ERRORS_TOTAL.inc(record.name)
+        return True
+
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(_ErrorCountingFilter())
+
+# --- Tracing & Profiling ---
+# Nested span timings per Telegram update. Spans follow the asyncio context, so
+# every DB helper or API call awaited while handling an update lands in its tree.
+
+SLOW_UPDATE_MS = float(os.environ.get("SLOW_UPDATE_MS", "500"))
+SLOW_TRACE_HISTORY = 20
+
+tracing_logger = logging.getLogger("casino.tracing")
+
+@dataclass
+class Span:
+    """One timed operation and the operations nested inside it."""
+    name: str
+    started: float
+    duration: float = 0.0
+    closed: bool = False
+    children: List["Span"] = field(default_factory=list)
+
+    def breakdown(self, depth: int = 0) -> List[str]:
+        lines = [f"{'  ' * depth}{self.name} {self.duration * 1000:.1f}ms"]
+        for child in self.children:
+            lines.extend(child.breakdown(depth + 1))
+        return lines
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+# Most recent slow traces as (finished_at, breakdown lines), shown in the admin panel
+recent_slow_traces: Deque[Tuple[str, List[str]]] = deque(maxlen=SLOW_TRACE_HISTORY)
+
+@contextmanager
+def trace_span(name: str):
+    """Time a block as a child of the current span, or as a new root trace"""
+    parent = _current_span.get()
+    if parent is not None and parent.closed:
+        parent = None  # Background task outliving the update that spawned it
+    span = Span(name, time.perf_counter())
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        span.duration = time.perf_counter() - span.started
+        span.closed = True
+        _current_span.reset(token)
+        if parent is not None:
+            parent.children.append(span)
+        else:
+            _finish_trace(span)
+
+def _finish_trace(root: Span) -> None:
+    """Log root traces slower than SLOW_UPDATE_MS with their breakdown"""
+    if root.duration * 1000 < SLOW_UPDATE_MS:
+        return
+    lines = root.breakdown()
+    recent_slow_traces.append((datetime.now().strftime("%H:%M:%S"), lines))
+    tracing_logger.warning("Slow %s took %.1fms:\n%s", root.name, root.duration * 1000, "\n".join(lines))
+
+def traced(name: Optional[str] = None):
+    """Decorator wrapping an async function in a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with trace_span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def describe_update(update: object) -> str:
+    """Short span name for an incoming update"""
+    if isinstance(update, Update):
+        if update.callback_query and update.callback_query.data:
+            return f"callback:{update.callback_query.data}"
+        if update.message and update.message.text:
+            text = update.message.text
+            return f"command:{text.split()[0]}" if text.startswith("/") else "message:text"
+    return f"update:{type(update).__name__}"
+
+class TracedApplication(Application):
+    """Application that opens a root span around the processing of each update."""
+
+    async def process_update(self, update: object) -> None:
+        if isinstance(update, Update) and update.effective_user:
+            touch_activity(update.effective_user.id)
+        with trace_span(describe_update(update)):
+            await super().process_update(update)
+
+class TracedHTTPXRequest(HTTPXRequest):
+    """Bot API transport that records each Telegram call as a span."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with trace_span(f"telegram.{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
+
+# Opt-in cProfile session toggled from the admin panel
+_profiler: Optional[cProfile.Profile] = None
+PROFILER_REPORT_LINES = 25
+
+def profiler_running() -> bool:
+    return _profiler is not None
+
+def start_profiler() -> None:
+    """Start profiling everything running on the event loop thread"""
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+        tracing_logger.warning("Profiler started")
+
+def stop_profiler() -> str:
+    """Stop profiling and return the top functions by cumulative time"""
+    global _profiler
+    if _profiler is None:
+        return ""
+    profiler, _profiler = _profiler, None
+    profiler.disable()
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILER_REPORT_LINES)
+    report = output.getvalue()
+    tracing_logger.warning("Profiler stopped:\n%s", report)
+    return report
 
+# --- Helper Functions ---
 def validate_crypto_address(address: str, asset: str) -> bool:
     """Validate cryptocurrency address format"""
     pattern = CRYPTO_ADDRESS_PATTERNS.get(asset)
@@ -102,14 +627,14 @@ def validate_crypto_address(address: str, asset: str) -> bool:
         return False
     return bool(re.match(pattern, address))
 
-def calculate_withdrawal_fee(amount: float) -> float:
-    """Calculate withdrawal fee"""
-    fee = amount * WITHDRAWAL_FEE_PERCENT
-    return max(fee, MIN_WITHDRAWAL_FEE)
+def calculate_withdrawal_fee(amount: int, vip_level: int = 0) -> int:
+    """Calculate withdrawal fee in micro-dollars; VIP tiers pay a reduced rate"""
+    return max(apply_bps(amount, vip_tier(vip_level).withdrawal_fee_bps), MIN_WITHDRAWAL_FEE)
 
 
 
-async def create_crypto_invoice(asset: str, amount: float, user_id: int, payload: dict = None) -> dict:
+@instrument_cryptobot("createInvoice")
+async def create_crypto_invoice(asset: str, amount: int, user_id: int, payload: dict = None) -> dict:
     """Create a crypto invoice using CryptoBot API for native mini app experience."""
     if not CRYPTOBOT_API_TOKEN:
         return {"ok": False, "error": "CryptoBot API token not configured"}
@@ -122,13 +647,13 @@ async def create_crypto_invoice(asset: str, amount: float, user_id: int, payload
         
         # Get USD amount for description
         usd_rate = await get_crypto_usd_rate(asset)
-        usd_amount = amount * usd_rate if usd_rate > 0 else amount
+        usd_amount = crypto_units_to_micros(amount, usd_rate) if usd_rate > 0 else 0
         
         # createPayment API data structure (different from createInvoice)
         data = {
             'asset': asset,
-            'amount': f"{amount:.8f}",
-            'description': f'Casino deposit - ${usd_amount:.2f} USD',
+            'amount': format_crypto(amount),
+            'description': f'Casino deposit - {format_money(usd_amount)} USD',
             'hidden_message': str(user_id),  # Used to identify user in webhook
             'expires_in': 3600,  # 1 hour expiration
             'allow_comments': False,
@@ -139,12 +664,12 @@ async def create_crypto_invoice(asset: str, amount: float, user_id: int, payload
             data.update(payload)
         
         async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-            async with session.post('https://pay.crypt.bot/api/createInvoice', 
+            async with session.post(f'{CRYPTOBOT_API_URL}/createInvoice', 
                                   headers=headers, json=data) as response:
                 if response.status == 200:
                     result = await response.json()
                     if result.get('ok'):
-                        logger.info(f"CryptoBot invoice created successfully: {result.get('result', {}).get('invoice_id')}")
+                        payments_logger.info("CryptoBot invoice created successfully: %s", result.get('result', {}).get('invoice_id'))
                         return result
                     else:
                         logger.error(f"CryptoBot API returned error: {result}")
@@ -200,30 +725,36 @@ async def get_user_withdrawals(user_id: int, limit: int = 10) -> list:
         logger.error(f"Error getting user withdrawals: {e}")
         return []
 
-async def check_withdrawal_limits(user_id: int, amount_usd: float) -> dict:
-    """Check if withdrawal is within limits"""
+async def check_withdrawal_limits(user_id: int, amount_usd: int) -> dict:
+    """Check if withdrawal (micro-dollars) is within limits"""
     try:
+        if config.maintenance_mode:
+            return {"allowed": False, "reason": "Withdrawals are paused for maintenance"}
+        
+        if user_id in _active_claims:
+            return {"allowed": False, "reason": "Finish the wagering on your active bonuses before withdrawing"}
+        
         # Check minimum amount
         if amount_usd < MIN_WITHDRAWAL_USD:
-            return {"allowed": False, "reason": f"Minimum withdrawal is ${MIN_WITHDRAWAL_USD:.2f}"}
+            return {"allowed": False, "reason": f"Minimum withdrawal is {format_money(MIN_WITHDRAWAL_USD)}"}
         
         # Check maximum amount
         if amount_usd > MAX_WITHDRAWAL_USD:
-            return {"allowed": False, "reason": f"Maximum withdrawal is ${MAX_WITHDRAWAL_USD:.2f}"}
+            return {"allowed": False, "reason": f"Maximum withdrawal is {format_money(MAX_WITHDRAWAL_USD)}"}
         
         async with aiosqlite.connect(DB_PATH) as db:
             # Check daily limit
             today = datetime.now().date()
             cursor = await db.execute("""
-                SELECT COALESCE(SUM(amount * rate_usd), 0) 
+                SELECT COALESCE(SUM(amount_usd), 0) 
                 FROM withdrawals 
                 WHERE user_id = ? AND DATE(created_at) = ? AND status != 'failed'
             """, (user_id, today))
-            daily_total = (await cursor.fetchone())[0] or 0.0
+            daily_total = (await cursor.fetchone())[0] or 0
             
-            if daily_total + amount_usd > MAX_WITHDRAWAL_USD_DAILY:
-                remaining = MAX_WITHDRAWAL_USD_DAILY - daily_total
-                return {"allowed": False, "reason": f"Daily limit exceeded. Remaining: ${remaining:.2f}"}
+            if daily_total + amount_usd > config.max_withdrawal_daily:
+                remaining = config.max_withdrawal_daily - daily_total
+                return {"allowed": False, "reason": f"Daily limit exceeded. Remaining: {format_money(remaining)}"}
             
             # Check cooldown
             cursor = await db.execute("""
@@ -246,18 +777,21 @@ async def check_withdrawal_limits(user_id: int, amount_usd: float) -> dict:
         logger.error(f"Error checking withdrawal limits: {e}")
         return {"allowed": False, "reason": "Error checking limits"}
 
-async def log_withdrawal(user_id: int, asset: str, amount: float, address: str, fee: float, net_amount: float) -> int:
-    """Log withdrawal attempt to database"""
+async def log_withdrawal(user_id: int, asset: str, address: str, amount_usd: int, fee_usd: int, rate_usd: float) -> int:
+    """Log withdrawal attempt to database; USD amounts in micro-dollars"""
     try:
-        rate_usd = await get_crypto_usd_rate(asset)
-        amount_usd = amount * rate_usd
+        net_amount_usd = amount_usd - fee_usd
+        amount = usd_to_crypto_units(amount_usd, rate_usd)
+        fee = usd_to_crypto_units(fee_usd, rate_usd)
         
         async with aiosqlite.connect(DB_PATH) as db:
             cursor = await db.execute("""
                 INSERT INTO withdrawals 
-                (user_id, asset, amount, address, fee, net_amount, rate_usd, amount_usd, status, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)
-            """, (user_id, asset, amount, address, fee, net_amount, rate_usd, amount_usd, datetime.now().isoformat()))
+                (user_id, asset, amount, amount_usd, address, fee, fee_usd, net_amount, net_amount_usd,
+                 rate_usd, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)
+            """, (user_id, asset, amount, amount_usd, address, fee, fee_usd, amount - fee, net_amount_usd,
+                  rate_usd, datetime.now().isoformat()))
             await db.commit()
             return cursor.lastrowid
             
@@ -281,18 +815,19 @@ async def update_withdrawal_status(withdrawal_id: int, status: str, transaction_
         logger.error(f"Error updating withdrawal status: {e}")
         return False
 
-async def send_crypto(address: str, amount: float, comment: str, asset: str = 'LTC') -> dict:
+@instrument_cryptobot("transfer")
+async def send_crypto(address: str, amount: int, comment: str, asset: str = 'LTC') -> dict:
     """Send crypto using CryptoBot API (or simulate for demo)"""
     try:
         if DEMO_MODE:
             # Demo mode - simulate successful transaction
             fake_hash = hashlib.sha256(f"{address}{amount}{time.time()}".encode()).hexdigest()
-            logger.info(f"DEMO: Simulated crypto send: {amount} {asset} to {address}")
+            payments_logger.info("DEMO: Simulated crypto send: %s %s to %s", format_crypto(amount), asset, address)
             return {
                 "ok": True,
                 "result": {
                     "transaction_hash": fake_hash,
-                    "amount": amount,
+                    "amount": format_crypto(amount),
                     "asset": asset,
                     "status": "completed"
                 }
@@ -309,23 +844,23 @@ async def send_crypto(address: str, amount: float, comment: str, asset: str = 'L
         data = {
             'user_id': address,  # In CryptoBot, this might be user ID
             'asset': asset,
-            'amount': f"{amount:.8f}",
+            'amount': format_crypto(amount),
             'spend_id': str(uuid.uuid4()),
             'comment': comment
         }
         
         async with aiohttp.ClientSession() as session:
-            async with session.post('https://pay.crypt.bot/api/transfer', 
+            async with session.post(f'{CRYPTOBOT_API_URL}/transfer', 
                                   headers=headers, json=data) as response:
                 result = await response.json()
-                logger.info(f"CryptoBot transfer result: {result}")
+                payments_logger.info("CryptoBot transfer result: %s", result)
                 return result
                 
     except Exception as e:
         logger.error(f"Error sending crypto: {e}")
         return {"ok": False, "error": str(e)}
 
-async def update_withdrawal_limits(user_id: int, amount_usd: float) -> bool:
+async def update_withdrawal_limits(user_id: int, amount_usd: int) -> bool:
     """Update user's withdrawal limits after successful withdrawal"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
@@ -344,7 +879,26 @@ async def update_withdrawal_limits(user_id: int, amount_usd: float) -> bool:
 
 # --- CryptoBot Real-Time Rate Fetch ---
 
+# asset -> (price, fetched_at) of the last successful fetch, reported by the readiness probe
+_last_rates: Dict[str, Tuple[float, float]] = {}
+
+def get_rate_age(asset: str) -> Optional[float]:
+    """Seconds since the rate for `asset` was last fetched, or None if never fetched"""
+    last = _last_rates.get(asset)
+    return time.time() - last[1] if last else None
+
 async def get_crypto_usd_rate(asset: str) -> float:
+    """
+    Get the live USD price of 1 unit of `asset`; deposits and withdrawals are priced with it.
+    Returns 0.0 if the rate cannot be fetched.
+    """
+    price = await fetch_crypto_usd_rate(asset)
+    if price > 0:
+        _last_rates[asset] = (price, time.time())
+    return price
+
+@instrument_cryptobot("getExchangeRates")
+async def fetch_crypto_usd_rate(asset: str) -> float:
     """
     Fetch the real-time USD/crypto rate for the given asset from CryptoBot API.
     Returns the price of 1 unit of the asset in USD, or 0.0 on error.
@@ -352,10 +906,10 @@ async def get_crypto_usd_rate(asset: str) -> float:
     """
     # Check if API token is configured
     if not CRYPTOBOT_API_TOKEN:
-        logger.error("CRYPTOBOT_API_TOKEN not configured - unable to fetch live rates")
+        rates_logger.error("CRYPTOBOT_API_TOKEN not configured - unable to fetch live rates")
         return 0.0
     
-    url = "https://pay.crypt.bot/api/getExchangeRates"
+    url = f"{CRYPTOBOT_API_URL}/getExchangeRates"
     max_retries = 3
     
     headers = {
@@ -374,60 +928,70 @@ async def get_crypto_usd_rate(asset: str) -> float:
                                 if rate.get("source") == asset and rate.get("target") == "USD":
                                     price = float(rate.get("rate", 0))
                                     if price > 0:
-                                        logger.info(f"CryptoBot API: {asset}/USD rate = ${price:.6f}")
+                                        rates_logger.debug("CryptoBot API: %s/USD rate = $%.6f", asset, price)
                                         return price
-                            logger.warning(f"CryptoBot API: No rate found for {asset}/USD in response")
-                            rate_pairs = [f"{r.get('source')}/{r.get('target')}" for r in rates]
-                            logger.debug(f"Available rates: {rate_pairs}")
+                            rates_logger.warning("CryptoBot API: No rate found for %s/USD in response", asset)
+                            if rates_logger.isEnabledFor(logging.DEBUG):
+                                rate_pairs = [f"{r.get('source')}/{r.get('target')}" for r in rates]
+                                rates_logger.debug("Available rates: %s", rate_pairs)
                         else:
                             error_msg = data.get("error", {}).get("name", "Unknown API error")
-                            logger.error(f"CryptoBot API error: {error_msg} (attempt {attempt + 1}/{max_retries})")
+                            rates_logger.error("CryptoBot API error: %s (attempt %s/%s)", error_msg, attempt + 1, max_retries)
                     elif resp.status == 401:
-                        logger.error(f"CryptoBot API: Invalid API token (HTTP 401)")
+                        rates_logger.error("CryptoBot API: Invalid API token (HTTP 401)")
                         return 0.0  # Don't retry on auth errors
                     elif resp.status == 403:
-                        logger.error(f"CryptoBot API: Access forbidden (HTTP 403)")
+                        rates_logger.error("CryptoBot API: Access forbidden (HTTP 403)")
                         return 0.0  # Don't retry on permission errors
                     else:
-                        logger.error(f"CryptoBot API error: HTTP {resp.status} (attempt {attempt + 1}/{max_retries})")
+                        rates_logger.error("CryptoBot API error: HTTP %s (attempt %s/%s)", resp.status, attempt + 1, max_retries)
                         
         except asyncio.TimeoutError:
-            logger.error(f"CryptoBot API timeout (attempt {attempt + 1}/{max_retries})")
+            rates_logger.error("CryptoBot API timeout (attempt %s/%s)", attempt + 1, max_retries)
         except aiohttp.ClientError as e:
-            logger.error(f"Network error fetching CryptoBot rate for {asset} (attempt {attempt + 1}/{max_retries}): {e}")
+            rates_logger.error("Network error fetching CryptoBot rate for %s (attempt %s/%s): %s", asset, attempt + 1, max_retries, e)
         except Exception as e:
-            logger.error(f"Unexpected error fetching CryptoBot rate for {asset} (attempt {attempt + 1}/{max_retries}): {e}")
+            rates_logger.error("Unexpected error fetching CryptoBot rate for %s (attempt %s/%s): %s", asset, attempt + 1, max_retries, e)
             
         # Wait before retry (except on last attempt)
         if attempt < max_retries - 1:
             await asyncio.sleep(1)
     
-    logger.error(f"Failed to get live rate for {asset} after {max_retries} attempts")
+    rates_logger.error("Failed to get live rate for %s after %s attempts", asset, max_retries)
     return 0.0
 
 async def get_ltc_usd_rate() -> float:
     """Get current LTC to USD rate"""
     return await get_crypto_usd_rate('LTC')
 
-async def format_usd(amount: float) -> str:
-    """Format a float amount as USD string."""
-    return f"${amount:,.2f} USD"
+def format_usd(amount: int) -> str:
+    """Format a micro-dollar amount as USD string."""
+    return f"{format_money(amount)} USD"
 
-async def format_crypto_usd(crypto_amount: float, asset: str) -> str:
-    """Format crypto amount with USD equivalent"""
+async def format_crypto_usd(crypto_amount: int, asset: str) -> str:
+    """Format crypto base units with USD equivalent"""
     if crypto_amount == 0:
         return f"$0.00 USD (0.00000000 {asset})"
     rate = await get_crypto_usd_rate(asset)
     if rate == 0.0:
-        return f"{crypto_amount:.8f} {asset} (Rate unavailable)"
-    usd = crypto_amount * rate
-    return f"${usd:.2f} USD ({crypto_amount:.8f} {asset})"
+        return f"{format_crypto(crypto_amount)} {asset} (Rate unavailable)"
+    usd = crypto_units_to_micros(crypto_amount, rate)
+    return f"{format_money(usd)} USD ({format_crypto(crypto_amount)} {asset})"
 
 # --- Database Operations ---
 async def init_db():
     """Initialize the database with required tables"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
+            # WAL lets readers (balance screens, readiness probes) proceed while a bet is being
+            # written; DELETE restores SQLite's default rollback journal
+            journal_mode = DB_JOURNAL_MODE
+            if journal_mode not in DB_JOURNAL_MODES:
+                logger.warning(f"Invalid DB_JOURNAL_MODE {journal_mode!r}, using WAL")
+                journal_mode = "WAL"
+            cursor = await db.execute(f"PRAGMA journal_mode={journal_mode}")
+            logger.info(f"SQLite journal mode: {(await cursor.fetchone())[0]}")
+            
             # Enhanced Users table with comprehensive tracking
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -435,23 +999,23 @@ async def init_db():
                     username TEXT NOT NULL,
                     first_name TEXT,
                     last_name TEXT,
-                    balance REAL DEFAULT 0.0,
+                    balance INTEGER DEFAULT 0,
                     games_played INTEGER DEFAULT 0,
-                    total_wagered REAL DEFAULT 0.0,
-                    total_won REAL DEFAULT 0.0,
-                    total_deposited REAL DEFAULT 0.0,
-                    total_withdrawn REAL DEFAULT 0.0,
+                    total_wagered INTEGER DEFAULT 0,
+                    total_won INTEGER DEFAULT 0,
+                    total_deposited INTEGER DEFAULT 0,
+                    total_withdrawn INTEGER DEFAULT 0,
                     win_streak INTEGER DEFAULT 0,
                     max_win_streak INTEGER DEFAULT 0,
                     loss_streak INTEGER DEFAULT 0,
                     max_loss_streak INTEGER DEFAULT 0,
-                    biggest_win REAL DEFAULT 0.0,
-                    biggest_loss REAL DEFAULT 0.0,
+                    biggest_win INTEGER DEFAULT 0,
+                    biggest_loss INTEGER DEFAULT 0,
                     vip_level INTEGER DEFAULT 0,
                     loyalty_points REAL DEFAULT 0.0,
                     referral_code TEXT DEFAULT NULL,
                     referred_by TEXT DEFAULT NULL,
-                    referral_earnings REAL DEFAULT 0.0,
+                    referral_earnings INTEGER DEFAULT 0,
                     referral_count INTEGER DEFAULT 0,
                     last_weekly_bonus TEXT DEFAULT NULL,
                     is_banned BOOLEAN DEFAULT FALSE,
@@ -459,7 +1023,8 @@ async def init_db():
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_game_at TIMESTAMP DEFAULT NULL,
-                    timezone TEXT DEFAULT 'UTC'
+                    timezone TEXT DEFAULT 'UTC',
+                    ledger_seq INTEGER DEFAULT 0  -- ledger entries posted for this user
                 )
             """)
             
@@ -470,9 +1035,9 @@ async def init_db():
                     user_id INTEGER NOT NULL,
                     game_type TEXT NOT NULL,
                     game_variant TEXT DEFAULT NULL,
-                    bet_amount REAL NOT NULL,
-                    win_amount REAL DEFAULT 0.0,
-                    net_result REAL DEFAULT 0.0,
+                    bet_amount INTEGER NOT NULL,
+                    win_amount INTEGER DEFAULT 0,
+                    net_result INTEGER DEFAULT 0,
                     multiplier REAL DEFAULT 0.0,
                     game_data TEXT DEFAULT NULL,  -- JSON data for game specifics
                     result TEXT,
@@ -494,15 +1059,15 @@ async def init_db():
                     user_id INTEGER NOT NULL,
                     type TEXT NOT NULL,  -- deposit, withdrawal, bet, win, bonus, refund, etc.
                     subtype TEXT DEFAULT NULL,  -- crypto_deposit, bank_deposit, game_win, referral_bonus, etc.
-                    amount REAL NOT NULL,
+                    amount INTEGER NOT NULL,
                     currency TEXT DEFAULT 'USD',
                     crypto_asset TEXT DEFAULT NULL,
-                    crypto_amount REAL DEFAULT NULL,
+                    crypto_amount INTEGER DEFAULT NULL,
                     exchange_rate REAL DEFAULT NULL,
-                    fee_amount REAL DEFAULT 0.0,
-                    net_amount REAL DEFAULT NULL,
-                    balance_before REAL DEFAULT 0.0,
-                    balance_after REAL DEFAULT 0.0,
+                    fee_amount INTEGER DEFAULT 0,
+                    net_amount INTEGER DEFAULT NULL,
+                    balance_before INTEGER DEFAULT 0,
+                    balance_after INTEGER DEFAULT 0,
                     reference_id TEXT DEFAULT NULL,  -- external transaction ID
                     game_session_id INTEGER DEFAULT NULL,
                     status TEXT DEFAULT 'completed',  -- pending, completed, failed, cancelled
@@ -525,13 +1090,13 @@ async def init_db():
                     withdrawal_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     asset TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    amount_usd REAL NOT NULL,
+                    amount INTEGER NOT NULL,
+                    amount_usd INTEGER NOT NULL,
                     address TEXT NOT NULL,
-                    fee REAL NOT NULL,
-                    fee_usd REAL NOT NULL,
-                    net_amount REAL NOT NULL,
-                    net_amount_usd REAL NOT NULL,
+                    fee INTEGER NOT NULL,
+                    fee_usd INTEGER NOT NULL,
+                    net_amount INTEGER NOT NULL,
+                    net_amount_usd INTEGER NOT NULL,
                     rate_usd REAL NOT NULL,
                     status TEXT DEFAULT 'pending',
                     transaction_hash TEXT DEFAULT '',
@@ -555,8 +1120,8 @@ async def init_db():
                     deposit_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     asset TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    amount_usd REAL NOT NULL,
+                    amount INTEGER NOT NULL,
+                    amount_usd INTEGER NOT NULL,
                     rate_usd REAL NOT NULL,
                     payment_method TEXT NOT NULL,  -- crypto, bank_transfer, etc.
                     payment_address TEXT DEFAULT NULL,
@@ -566,7 +1131,7 @@ async def init_db():
                     required_confirmations INTEGER DEFAULT 6,
                     status TEXT DEFAULT 'pending',  -- pending, confirming, completed, failed, expired
                     expires_at TIMESTAMP DEFAULT NULL,
-                    bonus_applied REAL DEFAULT 0.0,
+                    bonus_applied INTEGER DEFAULT 0,
                     bonus_type TEXT DEFAULT NULL,
                     metadata TEXT DEFAULT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -580,16 +1145,16 @@ async def init_db():
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS house_balance (
                     id INTEGER PRIMARY KEY,
-                    balance REAL DEFAULT 10000.0,
-                    total_player_losses REAL DEFAULT 0.0,
-                    total_player_wins REAL DEFAULT 0.0,
-                    total_deposits REAL DEFAULT 0.0,
-                    total_withdrawals REAL DEFAULT 0.0,
-                    total_fees_collected REAL DEFAULT 0.0,
-                    total_bonuses_paid REAL DEFAULT 0.0,
+                    balance INTEGER DEFAULT 10000000000,
+                    total_player_losses INTEGER DEFAULT 0,
+                    total_player_wins INTEGER DEFAULT 0,
+                    total_deposits INTEGER DEFAULT 0,
+                    total_withdrawals INTEGER DEFAULT 0,
+                    total_fees_collected INTEGER DEFAULT 0,
+                    total_bonuses_paid INTEGER DEFAULT 0,
                     games_played_today INTEGER DEFAULT 0,
-                    revenue_today REAL DEFAULT 0.0,
-                    profit_today REAL DEFAULT 0.0,
+                    revenue_today INTEGER DEFAULT 0,
+                    profit_today INTEGER DEFAULT 0,
                     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_daily_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
@@ -603,7 +1168,7 @@ async def init_db():
                     achievement_id TEXT NOT NULL,
                     achievement_name TEXT NOT NULL,
                     description TEXT DEFAULT NULL,
-                    reward_amount REAL DEFAULT 0.0,
+                    reward_amount INTEGER DEFAULT 0,
                     unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     progress_data TEXT DEFAULT NULL,  -- JSON for tracking progress
                     FOREIGN KEY (user_id) REFERENCES users (user_id),
@@ -618,10 +1183,10 @@ async def init_db():
                     referrer_id INTEGER NOT NULL,
                     referee_id INTEGER NOT NULL,
                     referral_code TEXT NOT NULL,
-                    bonus_paid_referrer REAL DEFAULT 0.0,
-                    bonus_paid_referee REAL DEFAULT 0.0,
-                    total_referee_wagered REAL DEFAULT 0.0,
-                    commission_earned REAL DEFAULT 0.0,
+                    bonus_paid_referrer INTEGER DEFAULT 0,
+                    bonus_paid_referee INTEGER DEFAULT 0,
+                    total_referee_wagered INTEGER DEFAULT 0,
+                    commission_earned INTEGER DEFAULT 0,
                     status TEXT DEFAULT 'pending',  -- pending, active, inactive
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     activated_at TIMESTAMP DEFAULT NULL,
@@ -638,7 +1203,7 @@ async def init_db():
                     admin_user_id INTEGER NOT NULL,
                     action_type TEXT NOT NULL,  -- ban_user, adjust_balance, approve_withdrawal, etc.
                     target_user_id INTEGER DEFAULT NULL,
-                    amount REAL DEFAULT NULL,
+                    amount INTEGER DEFAULT NULL,
                     old_value TEXT DEFAULT NULL,
                     new_value TEXT DEFAULT NULL,
                     reason TEXT DEFAULT NULL,
@@ -663,6 +1228,17 @@ async def init_db():
                 )
             """)
             
+            # PTB persistence: user_data/chat_data/bot_data as JSON, one row per entry
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS bot_persistence (
+                    kind TEXT NOT NULL,  -- user, chat, bot, conversation:<name>
+                    key TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (kind, key)
+                ) WITHOUT ROWID
+            """)
+            
             # User sessions table for tracking logins and activity
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS user_sessions (
@@ -691,28 +1267,51 @@ async def init_db():
                     date DATE NOT NULL,
                     total_sessions INTEGER DEFAULT 0,
                     total_players INTEGER DEFAULT 0,
-                    total_wagered REAL DEFAULT 0.0,
-                    total_won REAL DEFAULT 0.0,
-                    house_profit REAL DEFAULT 0.0,
+                    total_wagered INTEGER DEFAULT 0,
+                    total_won INTEGER DEFAULT 0,
+                    house_profit INTEGER DEFAULT 0,
                     rtp REAL DEFAULT 0.0,
-                    avg_bet REAL DEFAULT 0.0,
-                    max_win REAL DEFAULT 0.0,
+                    avg_bet INTEGER DEFAULT 0,
+                    max_win INTEGER DEFAULT 0,
                     jackpots_hit INTEGER DEFAULT 0,
+                    players_sketch BLOB DEFAULT NULL,  -- HyperLogLog registers behind total_players
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     UNIQUE(game_type, date)
                 )
             """)
             
+            # Referral commissions staged per referee until the next batched payout
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS referral_accruals (
+                    referee_id INTEGER PRIMARY KEY,
+                    referrer_id INTEGER NOT NULL,
+                    pending INTEGER DEFAULT 0,  -- commission owed to the referrer
+                    losses INTEGER DEFAULT 0,  -- referee losses behind it
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Leaderboard snapshots for daily and weekly boards
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS leaderboard_scores (
+                    board TEXT NOT NULL,
+                    period TEXT NOT NULL,  -- ISO date or ISO week
+                    user_id INTEGER NOT NULL,
+                    score INTEGER NOT NULL,
+                    PRIMARY KEY (board, period, user_id)
+                )
+            """)
+            
             # Bonus campaigns table
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS bonus_campaigns (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     name TEXT NOT NULL,
                     type TEXT NOT NULL,  -- deposit_bonus, free_spins, cashback, etc.
-                    amount REAL DEFAULT 0.0,
+                    amount INTEGER DEFAULT 0,
                     percentage REAL DEFAULT 0.0,
-                    min_deposit REAL DEFAULT 0.0,
-                    max_bonus REAL DEFAULT 0.0,
+                    min_deposit INTEGER DEFAULT 0,
+                    max_bonus INTEGER DEFAULT 0,
                     wagering_requirement REAL DEFAULT 0.0,
                     valid_games TEXT DEFAULT NULL,  -- JSON array of game types
                     is_active BOOLEAN DEFAULT TRUE,
@@ -720,6 +1319,7 @@ async def init_db():
                     end_date TIMESTAMP DEFAULT NULL,
                     usage_limit INTEGER DEFAULT NULL,
                     usage_count INTEGER DEFAULT 0,
+                    spins INTEGER DEFAULT 0,  -- free_spins: spins granted, each staking `amount`
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
@@ -730,9 +1330,10 @@ async def init_db():
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     campaign_id INTEGER NOT NULL,
-                    amount REAL NOT NULL,
-                    wagering_requirement REAL DEFAULT 0.0,
-                    wagered_amount REAL DEFAULT 0.0,
+                    amount INTEGER NOT NULL,
+                    remaining_amount INTEGER DEFAULT NULL,  -- bonus not yet lost; NULL = amount
+                    wagering_requirement INTEGER DEFAULT 0,
+                    wagered_amount INTEGER DEFAULT 0,
                     status TEXT DEFAULT 'active',  -- active, completed, expired, cancelled
                     claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     completed_at TIMESTAMP DEFAULT NULL,
@@ -742,10 +1343,125 @@ async def init_db():
                 )
             """)
             
+            # Cashback earned on settled losses, staged until the next cashback payout
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS cashback_accruals (
+                    campaign_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    amount INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (campaign_id, user_id)
+                ) WITHOUT ROWID
+            """)
+            
+            # Broadcasts table (admin announcements and promotions)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message TEXT NOT NULL,
+                    created_by INTEGER DEFAULT NULL,  -- admin user_id
+                    status TEXT DEFAULT 'pending',  -- pending, running, completed, cancelled
+                    last_user_id INTEGER DEFAULT 0,  -- keyset checkpoint for resume
+                    total_sent INTEGER DEFAULT 0,
+                    total_failed INTEGER DEFAULT 0,
+                    total_blocked INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP DEFAULT NULL,
+                    completed_at TIMESTAMP DEFAULT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Append-only double-entry ledger: the legs of each transaction sum to zero
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS ledger_transactions (
+                    txn_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,  -- bet, win, deposit, withdrawal, bonus, referral_commission, opening_balance
+                    reference TEXT DEFAULT NULL,  -- game type, invoice id, withdrawal id, ...
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS ledger_entries (
+                    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    txn_id INTEGER NOT NULL,
+                    account TEXT NOT NULL,  -- user, house, cryptobot, opening
+                    user_id INTEGER DEFAULT NULL,  -- set on user legs
+                    amount INTEGER NOT NULL,  -- signed micro-dollars, positive credits the account
+                    balance_after INTEGER DEFAULT NULL,  -- user legs only
+                    FOREIGN KEY (txn_id) REFERENCES ledger_transactions (txn_id)
+                )
+            """)
+            
+            # Periodic per-user balances so verification reads a snapshot plus a short tail
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS balance_snapshots (
+                    user_id INTEGER NOT NULL,
+                    entry_id INTEGER NOT NULL,  -- last ledger entry included in balance
+                    balance INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, entry_id)
+                )
+            """)
+            
+            # Reconciliation watermarks and the house counters expected up to them
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS reconciliation_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    last_session_id INTEGER DEFAULT 0,
+                    last_txn_id INTEGER DEFAULT 0,
+                    player_losses INTEGER DEFAULT 0,
+                    player_wins INTEGER DEFAULT 0,
+                    deposits INTEGER DEFAULT 0,
+                    withdrawals INTEGER DEFAULT 0,
+                    promotions INTEGER DEFAULT 0,  -- bonus and referral credits, not booked in house_balance
+                    house_drift TEXT DEFAULT '{}',  -- drift seen by the previous run (JSON)
+                    reported_drift TEXT DEFAULT '{}',  -- drift last reported to admins (JSON)
+                    last_full_at TIMESTAMP DEFAULT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS reconciliation_reports (
+                    report_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    mode TEXT NOT NULL,  -- incremental, full
+                    sessions_checked INTEGER DEFAULT 0,
+                    transactions_checked INTEGER DEFAULT 0,
+                    users_checked INTEGER DEFAULT 0,
+                    mismatches TEXT DEFAULT '{}',  -- JSON
+                    duration_ms REAL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            for table in ("ledger_transactions", "ledger_entries"):
+                for action in ("UPDATE", "DELETE"):
+                    await db.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS {table}_no_{action.lower()}
+                        BEFORE {action} ON {table}
+                        BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END
+                    """)
+            
+            # Convert databases created before money moved to integer units
+            await migrate_money_to_integer_units(db)
+            await open_ledger(db)
+            await add_missing_column(db, "game_statistics", "players_sketch", "BLOB DEFAULT NULL")
+            await add_missing_column(db, "bonus_campaigns", "spins", "INTEGER DEFAULT 0")
+            await add_missing_column(db, "user_bonus_claims", "remaining_amount", "INTEGER DEFAULT NULL")
+            await add_missing_column(db, "reconciliation_state", "promotions", "INTEGER DEFAULT 0")
+            
             # Create indexes for better performance
             await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)")
+            try:
+                await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)")
+            except sqlite3.IntegrityError:
+                # Duplicate codes from before the index existed; keep lookups indexed until they are fixed
+                logger.error("Duplicate users.referral_code values found - creating a non-unique index")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_game_sessions_user_id ON game_sessions(user_id)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_game_sessions_game_type ON game_sessions(game_type)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_game_sessions_created_at ON game_sessions(created_at)")
@@ -758,11 +1474,26 @@ async def init_db():
             await db.execute("CREATE INDEX IF NOT EXISTS idx_deposits_status ON deposits(status)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer_id ON referrals(referrer_id)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referee_id ON referrals(referee_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_referral_accruals_referrer_id ON referral_accruals(referrer_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id, started_at)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_started_at ON user_sessions(started_at)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_bonus_claims_user_id ON user_bonus_claims(user_id, campaign_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_bonus_claims_expires ON user_bonus_claims(status, expires_at)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_entries_user_id ON ledger_entries(user_id, entry_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_entries_txn_id ON ledger_entries(txn_id)")
+            # Admin screens: top-N users and keyset pages over rollups and the ledger
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_total_wagered ON users(total_wagered)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_game_statistics_date ON game_statistics(date)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_transactions_kind ON ledger_transactions(kind, txn_id)")
+            
+            await db.execute("INSERT OR IGNORE INTO reconciliation_state (id) VALUES (1)")
             
             # Initialize house balance if it doesn't exist
             await db.execute("""
-                INSERT OR IGNORE INTO house_balance (id, balance) VALUES (1, 10000.0)
-            """)
+                INSERT OR IGNORE INTO house_balance (id, balance) VALUES (1, ?)
+            """, (HOUSE_OPENING_BALANCE,))
             
             # Initialize default system configuration
             system_configs = [
@@ -775,17 +1506,33 @@ async def init_db():
                 ('welcome_bonus_amount', '10.0', 'number', 'Welcome bonus amount in USD'),
                 ('daily_bonus_amount', '5.0', 'number', 'Daily bonus amount in USD'),
                 ('referral_bonus_amount', '25.0', 'number', 'Referral bonus amount in USD'),
-                ('max_withdrawal_daily', '10000.0', 'number', 'Maximum daily withdrawal in USD'),
+                ('max_withdrawal_daily', str(micros_to_usd(MAX_WITHDRAWAL_USD_DAILY)), 'number', 'Maximum daily withdrawal in USD'),
                 ('kyc_required_amount', '1000.0', 'number', 'Amount requiring KYC verification'),
                 ('support_email', 'support@casino.com', 'string', 'Support email address'),
-                ('bot_version', '2.1.0', 'string', 'Current bot version')
+                ('bot_version', '2.1.0', 'string', 'Current bot version'),
+                ('bet_rate_per_second', '2.0', 'number', 'Bets per second per player and game (0 = unlimited)'),
+                ('bet_burst', '5.0', 'number', 'Bets a player may fire back to back per game'),
+                ('callback_rate_per_second', '5.0', 'number', 'Other button taps per second per player (0 = unlimited)'),
+                ('callback_burst', '15.0', 'number', 'Other button taps a player may fire back to back'),
+                ('global_bet_rate_per_second', '200.0', 'number', 'Bets per second across all players (0 = unlimited)'),
+                ('config_version', '0', 'number', 'Bumped on every change; the bot reloads settings when it moves')
             ]
             
-            for config in system_configs:
+            for entry in system_configs:
                 await db.execute("""
                     INSERT OR IGNORE INTO system_config (key, value, data_type, description)
                     VALUES (?, ?, ?, ?)
-                """, config)
+                """, entry)
+            
+            # Any edit to a setting bumps config_version so running bots reload their snapshot
+            for event in ("INSERT", "UPDATE OF value"):
+                await db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS system_config_{event.split()[0].lower()}_version
+                    AFTER {event} ON system_config WHEN NEW.key != 'config_version'
+                    BEGIN
+                        UPDATE system_config SET value = CAST(value AS INTEGER) + 1 WHERE key = 'config_version';
+                    END
+                """)
             
             await db.commit()
             
@@ -809,9 +1556,9 @@ async def migrate_database():
             if table_exists:
                 # Check each column individually to avoid duplicates
                 columns_to_add = [
-                    ('amount_usd', 'REAL DEFAULT 0.0'),
-                    ('fee_usd', 'REAL DEFAULT 0.0'),
-                    ('net_amount_usd', 'REAL DEFAULT 0.0'),
+                    ('amount_usd', 'INTEGER DEFAULT 0'),
+                    ('fee_usd', 'INTEGER DEFAULT 0'),
+                    ('net_amount_usd', 'INTEGER DEFAULT 0'),
                     ('rate_usd', 'REAL DEFAULT 0.0'),
                     ('processed_at', 'TEXT DEFAULT NULL'),
                     ('confirmed_at', 'TEXT DEFAULT NULL'),
@@ -837,12 +1584,12 @@ async def migrate_database():
                 # Check each column individually to avoid duplicates
                 columns_to_add = [
                     ('crypto_asset', 'TEXT DEFAULT NULL'),
-                    ('crypto_amount', 'REAL DEFAULT NULL'),
+                    ('crypto_amount', 'INTEGER DEFAULT NULL'),
                     ('exchange_rate', 'REAL DEFAULT NULL'),
-                    ('fee_amount', 'REAL DEFAULT 0.0'),
-                    ('net_amount', 'REAL DEFAULT NULL'),
-                    ('balance_before', 'REAL DEFAULT 0.0'),
-                    ('balance_after', 'REAL DEFAULT 0.0'),
+                    ('fee_amount', 'INTEGER DEFAULT 0'),
+                    ('net_amount', 'INTEGER DEFAULT NULL'),
+                    ('balance_before', 'INTEGER DEFAULT 0'),
+                    ('balance_after', 'INTEGER DEFAULT 0'),
                     ('reference_id', 'TEXT DEFAULT NULL'),
                     ('game_session_id', 'INTEGER DEFAULT NULL'),
                     ('payment_method', 'TEXT DEFAULT NULL'),
@@ -867,6 +1614,479 @@ async def migrate_database():
         logger.error(f"Error during database migration: {e}")
         raise
 
+# Integer money columns per table: USD amounts in micro-dollars, crypto in base units
+MONEY_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "users": ("balance", "total_wagered", "total_won", "total_deposited", "total_withdrawn",
+              "biggest_win", "biggest_loss", "referral_earnings"),
+    "game_sessions": ("bet_amount", "win_amount", "net_result"),
+    "transactions": ("amount", "fee_amount", "net_amount", "balance_before", "balance_after"),
+    "withdrawals": ("amount_usd", "fee_usd", "net_amount_usd"),
+    "deposits": ("amount_usd", "bonus_applied"),
+    "house_balance": ("balance", "total_player_losses", "total_player_wins", "total_deposits",
+                      "total_withdrawals", "total_fees_collected", "total_bonuses_paid",
+                      "revenue_today", "profit_today"),
+    "user_achievements": ("reward_amount",),
+    "referrals": ("bonus_paid_referrer", "bonus_paid_referee", "total_referee_wagered", "commission_earned"),
+    "admin_actions": ("amount",),
+    "game_statistics": ("total_wagered", "total_won", "house_profit", "avg_bet", "max_win"),
+    "bonus_campaigns": ("amount", "min_deposit", "max_bonus"),
+    "user_bonus_claims": ("amount", "wagering_requirement", "wagered_amount"),
+}
+CRYPTO_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "withdrawals": ("amount", "fee", "net_amount"),
+    "deposits": ("amount",),
+    "transactions": ("crypto_amount",),
+}
+MONEY_SCHEMA_VERSION = 1  # PRAGMA user_version once money columns are integers
+
+def _integer_column_sql(table_sql: str, column: str, factor: int) -> str:
+    """Rewrite one REAL column definition in a CREATE TABLE statement as INTEGER"""
+    def convert(match):
+        default = match.group(3)
+        if default is not None and default.upper() != "NULL":
+            default = str(to_micros(default) * factor // MICRO)
+        return f"{match.group(1)}INTEGER{match.group(2)}" + (f" DEFAULT {default}" if default is not None else "")
+    return re.sub(rf"(\b{column}\s+)REAL((?:\s+NOT NULL)?)(?:\s+DEFAULT\s+(-?[\d.]+|NULL))?",
+                  convert, table_sql, count=1, flags=re.IGNORECASE)
+
+async def migrate_money_to_integer_units(db: aiosqlite.Connection) -> None:
+    """
+    Rebuild tables whose money columns are still REAL, scaling stored dollars to
+    micro-dollars and crypto amounts to base units. SQLite cannot change a column
+    type in place, so each affected table is copied into a new definition.
+    """
+    cursor = await db.execute("PRAGMA user_version")
+    if (await cursor.fetchone())[0] >= MONEY_SCHEMA_VERSION:
+        return
+    
+    await db.commit()
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        for table in MONEY_COLUMNS.keys() | CRYPTO_COLUMNS.keys():
+            cursor = await db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+            row = await cursor.fetchone()
+            if not row:
+                continue
+            cursor = await db.execute(f"PRAGMA table_info({table})")
+            column_types = {info[1]: (info[2] or "").upper() for info in await cursor.fetchall()}
+            factors = {column: MICRO for column in MONEY_COLUMNS.get(table, ())}
+            factors.update({column: CRYPTO_UNITS for column in CRYPTO_COLUMNS.get(table, ())})
+            factors = {column: factor for column, factor in factors.items() if column_types.get(column) == "REAL"}
+            if not factors:
+                continue
+            
+            table_sql = row[0]
+            for column, factor in factors.items():
+                table_sql = _integer_column_sql(table_sql, column, factor)
+            table_sql = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?[\"`]?{table}[\"`]?",
+                               f"CREATE TABLE {table}__migrated", table_sql, count=1, flags=re.IGNORECASE)
+            columns = list(column_types)
+            select = ", ".join(
+                f"CAST(ROUND({column} * {factors[column]}) AS INTEGER)" if column in factors else column
+                for column in columns
+            )
+            await db.execute(table_sql)
+            await db.execute(f"INSERT INTO {table}__migrated ({', '.join(columns)}) SELECT {select} FROM {table}")
+            await db.execute(f"DROP TABLE {table}")
+            await db.execute(f"ALTER TABLE {table}__migrated RENAME TO {table}")
+            logger.info("Converted money columns of %s to integer units: %s", table, ", ".join(factors))
+        
+        await db.execute(f"PRAGMA user_version = {MONEY_SCHEMA_VERSION}")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+# --- Runtime Config ---
+# system_config is loaded into an immutable RuntimeConfig snapshot. Hot paths read attributes of
+# the module-level `config` without locks or queries; a refresh builds a new snapshot and swaps
+# the reference. Triggers bump config_version on every edit, so the refresher polls one row.
+
+CONFIG_REFRESH_SECONDS = int(os.environ.get("CONFIG_REFRESH_SECONDS", "10"))
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    """
+    Typed view of system_config; int settings are USD amounts in micro-dollars. Only settings
+    some code path reads belong here; other system_config rows are ignored.
+    """
+    maintenance_mode: bool = False
+    min_bet_amount: int = to_micros("0.50")
+    max_bet_amount: int = to_micros("1000.0")
+    max_withdrawal_daily: int = MAX_WITHDRAWAL_USD_DAILY
+    bet_rate_per_second: float = 2.0  # per player and game
+    bet_burst: float = 5.0
+    callback_rate_per_second: float = 5.0  # per player, non-bet buttons
+    callback_burst: float = 15.0
+    global_bet_rate_per_second: float = 200.0  # all players together
+    version: int = field(default=0, metadata={"internal": True})  # config_version it was loaded at
+
+config = RuntimeConfig()
+_config_task: Optional[asyncio.Task] = None
+
+CONFIG_FIELDS = {
+    spec.name: spec for spec in dataclasses.fields(RuntimeConfig) if not spec.metadata.get("internal")
+}
+
+# Settings an operator can pin from the environment; when the variable is set it wins over system_config
+CONFIG_ENV_OVERRIDES = {
+    "max_withdrawal_daily": "MAX_WITHDRAWAL_USD_DAILY",
+}
+
+def env_pinned(key: str) -> Optional[str]:
+    """Environment variable pinning a setting, or None when system_config controls it"""
+    name = CONFIG_ENV_OVERRIDES.get(key)
+    return name if name and name in os.environ else None
+
+def parse_config_value(key: str, value: str):
+    """Typed value of a system_config entry; raises ValueError"""
+    kind = type(CONFIG_FIELDS[key].default)
+    if kind is bool:
+        normalized = value.strip().lower()
+        if normalized not in ("true", "false", "1", "0", "yes", "no", "on", "off"):
+            raise ValueError(f"expected true or false, got {value!r}")
+        return normalized in ("true", "1", "yes", "on")
+    if kind is int:
+        micros = to_micros(value.strip().replace('$', '').replace(',', ''))
+        if micros < 0:
+            raise ValueError("amount must not be negative")
+        return micros
+    if kind is float:
+        return float(value)
+    return value
+
+def format_config_value(key: str, value) -> str:
+    """Display form of a typed setting"""
+    kind = type(CONFIG_FIELDS[key].default)
+    if kind is bool:
+        return "true" if value else "false"
+    if kind is int:
+        return format_money(value)
+    return str(value)
+
+async def load_config(db) -> RuntimeConfig:
+    """Build a snapshot from system_config; invalid entries keep their defaults"""
+    cursor = await db.execute("SELECT key, value FROM system_config")
+    values = dict(await cursor.fetchall())
+    settings = {}
+    for key in CONFIG_FIELDS:
+        if key in values and not env_pinned(key):
+            try:
+                settings[key] = parse_config_value(key, values[key])
+            except ValueError as e:
+                logger.warning(f"Ignoring system_config {key}={values[key]!r}: {e}")
+    return RuntimeConfig(**settings, version=int(values.get("config_version") or 0))
+
+async def refresh_config(force: bool = False) -> bool:
+    """Reload the snapshot when config_version changed; returns True when it was replaced"""
+    global config
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            if not force:
+                cursor = await db.execute("SELECT value FROM system_config WHERE key = 'config_version'")
+                row = await cursor.fetchone()
+                if row is None or int(row[0]) == config.version:
+                    return False
+            snapshot = await load_config(db)
+    except Exception as e:
+        logger.error(f"Error loading runtime config: {e}")
+        return False
+    config = snapshot
+    logger.info(f"Runtime config loaded (version {snapshot.version})")
+    return True
+
+async def set_config_value(key: str, value: str, updated_by: int) -> Optional[str]:
+    """Validate and store an admin edit, then reload; returns an error message or None"""
+    if key not in CONFIG_FIELDS:
+        return f"Unknown setting: {key}"
+    if env_pinned(key):
+        return f"{key} is set by {env_pinned(key)} in the environment"
+    try:
+        typed = parse_config_value(key, value)
+    except ValueError as e:
+        return f"Invalid value for {key}: {e}"
+    if isinstance(typed, bool):
+        value = "true" if typed else "false"
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("""
+                INSERT INTO system_config (key, value, updated_by, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value, updated_by = excluded.updated_by, updated_at = excluded.updated_at
+            """, (key, value, updated_by, datetime.now().isoformat()))
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error updating system_config {key}: {e}")
+        return "Could not save the setting."
+    await refresh_config(force=True)
+    logger.info(f"system_config {key} set to {value!r} by {updated_by}")
+    return None
+
+def check_bet_allowed(bet_amount: int) -> Optional[str]:
+    """Reason the current config refuses a bet, or None"""
+    if config.maintenance_mode:
+        return "🔧 The casino is under maintenance. Please try again later."
+    if bet_amount < config.min_bet_amount:
+        return f"❌ Minimum bet is {format_money(config.min_bet_amount)}."
+    if bet_amount > config.max_bet_amount:
+        return f"❌ Maximum bet is {format_money(config.max_bet_amount)}."
+    return None
+
+async def config_refresh_loop():
+    """Pick up config edits made elsewhere every CONFIG_REFRESH_SECONDS"""
+    while True:
+        await asyncio.sleep(CONFIG_REFRESH_SECONDS)
+        await refresh_config()
+
+def start_config_refresh() -> None:
+    """Launch the background config refresher"""
+    global _config_task
+    if _config_task is None and CONFIG_REFRESH_SECONDS > 0:
+        _config_task = asyncio.create_task(config_refresh_loop())
+
+async def config_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /config [key value] (admin only)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    if len(context.args) < 2:
+        lines = [f"{key} = {format_config_value(key, getattr(config, key))}" for key in CONFIG_FIELDS]
+        await update.message.reply_text(
+            f"<b>Runtime config</b> (version {config.version})\n\n<pre>{html.escape(chr(10).join(lines))}</pre>\n"
+            "Usage: /config &lt;key&gt; &lt;value&gt;",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    key, value = context.args[0], " ".join(context.args[1:])
+    error = await set_config_value(key, value, update.effective_user.id)
+    if error:
+        await update.message.reply_text(f"❌ {error}")
+    else:
+        await update.message.reply_text(f"✅ {key} = {format_config_value(key, getattr(config, key))} (version {config.version})")
+
+# --- Rate Limiting ---
+# Callback taps pass through token buckets before the router: one per (user, game) for bets,
+# one per user for other buttons, and one shared by all bets. Rates come from the runtime
+# config. A throttled tap is answered and dropped without touching the database. Buckets live
+# in an insertion-ordered dict used as an LRU; evicting the oldest is safe because an idle
+# bucket would have refilled anyway.
+
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+# Callback prefixes that settle a bet, by game
+BET_ACTIONS = {
+    "slots_bet_": "slots",
+    "blackjack_bet_": "blackjack",
+    "dice_play_": "dice",
+    "basketball_shoot_": "basketball",
+    "darts_throw_": "darts",
+}
+
+RATE_LIMITED_TOTAL = metrics.counter("casino_rate_limited_total", "Callback taps dropped by rate limiting",
+                                     ("scope", "action"))
+
+class TokenBuckets:
+    """Token buckets by key, bounded to max_buckets by evicting the least recently used"""
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[tuple, Tuple[float, float]] = {}  # key -> (tokens, monotonic time)
+
+    def take(self, key: tuple, rate: float, burst: float, now: float) -> bool:
+        """Spend one token; False when the bucket is empty. A rate of 0 disables the limit"""
+        if rate <= 0:
+            return True
+        state = self._buckets.pop(key, None)
+        tokens = burst if state is None else min(burst, state[0] + (now - state[1]) * rate)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > self.max_buckets:
+            del self._buckets[next(iter(self._buckets))]
+        return allowed
+
+    def refund(self, key: tuple, burst: float) -> None:
+        """Give back a token spent by take"""
+        state = self._buckets.get(key)
+        if state is not None:
+            self._buckets[key] = (min(burst, state[0] + 1), state[1])
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+_rate_buckets = TokenBuckets(RATE_LIMIT_MAX_BUCKETS)
+_global_bet_bucket = TokenBuckets(1)
+
+RATE_LIMIT_BUCKETS = metrics.gauge("casino_rate_limit_buckets", "Token buckets held in memory",
+                                   function=lambda: len(_rate_buckets))
+
+def callback_action(data: str) -> Optional[str]:
+    """Game whose bet this callback settles, or None for other buttons"""
+    for prefix, game in BET_ACTIONS.items():
+        if data.startswith(prefix):
+            return game
+    return None
+
+def check_rate_limit(user_id: int, data: str) -> Optional[str]:
+    """Scope that throttles this tap ("user" or "global"), or None when it may proceed"""
+    now = time.monotonic()
+    game = callback_action(data)
+    if game is None:
+        allowed = _rate_buckets.take((user_id, ""), config.callback_rate_per_second, config.callback_burst, now)
+        return None if allowed else "user"
+    if not _rate_buckets.take((user_id, game), config.bet_rate_per_second, config.bet_burst, now):
+        return "user"
+    if not _global_bet_bucket.take((), config.global_bet_rate_per_second,
+                                   max(1.0, config.global_bet_rate_per_second), now):
+        # The player was not too fast, so the tap must not use up their own budget
+        _rate_buckets.refund((user_id, game), config.bet_burst)
+        return "global"
+    return None
+
+async def rate_limit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Group -1 gate in front of every callback handler"""
+    query = update.callback_query
+    scope = check_rate_limit(query.from_user.id, query.data or "")
+    if scope is None:
+        return
+    RATE_LIMITED_TOTAL.inc(scope, callback_action(query.data or "") or "other")
+    try:
+        await query.answer("⏳ Too fast - please wait a moment." if scope == "user" else "⏳ The casino is busy - try again in a second.")
+    except TelegramError:
+        pass
+    raise ApplicationHandlerStop
+
+# --- Ledger ---
+
+LEDGER_SNAPSHOT_EVERY = int(os.environ.get("LEDGER_SNAPSHOT_EVERY", "50"))  # entries per user between snapshots
+
+# Account on the other side of a user's entry, by transaction kind
+LEDGER_CONTRA_ACCOUNTS = {
+    "bet": "house",
+    "win": "house",
+    "game": "house",
+    "bonus": "house",
+    "referral_commission": "house",
+    "deposit": "cryptobot",
+    "withdrawal": "cryptobot",
+}
+
+async def add_missing_column(db, table: str, column: str, definition: str) -> None:
+    """ALTER TABLE ... ADD COLUMN unless the column already exists"""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in await cursor.fetchall()]:
+        logger.info(f"Adding column {column} to {table} table...")
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+async def open_ledger(db) -> None:
+    """Add the ledger columns to older databases and post opening balances for users without history"""
+    await add_missing_column(db, "users", "ledger_seq", "INTEGER DEFAULT 0")
+    
+    cursor = await db.execute("""
+        SELECT COUNT(*), COALESCE(SUM(balance), 0) FROM users WHERE ledger_seq = 0 AND balance != 0
+    """)
+    count, total = await cursor.fetchone()
+    if not count:
+        return
+    
+    now = datetime.now().isoformat()
+    cursor = await db.execute("""
+        INSERT INTO ledger_transactions (kind, created_at) VALUES ('opening_balance', ?)
+    """, (now,))
+    txn_id = cursor.lastrowid
+    await db.execute("""
+        INSERT INTO ledger_entries (txn_id, account, user_id, amount, balance_after)
+        SELECT ?, 'user', user_id, balance, balance FROM users WHERE ledger_seq = 0 AND balance != 0
+    """, (txn_id,))
+    await db.execute("""
+        INSERT INTO ledger_entries (txn_id, account, amount) VALUES (?, 'opening', ?)
+    """, (txn_id, -total))
+    await db.execute("""
+        INSERT INTO balance_snapshots (user_id, entry_id, balance, created_at)
+        SELECT user_id, entry_id, balance_after, ? FROM ledger_entries WHERE txn_id = ? AND account = 'user'
+    """, (now, txn_id))
+    await db.execute("UPDATE users SET ledger_seq = 1 WHERE ledger_seq = 0 AND balance != 0")
+    logger.info(f"Ledger opened for {count} existing balances totalling {format_money(total)}")
+
+async def post_ledger(db, user_id: int, amount: int, kind: str, reference: Optional[str] = None) -> Optional[int]:
+    """Apply a signed micro-dollar amount to a user's balance and append its ledger legs.
+    
+    Runs inside the caller's transaction; the caller commits. Returns the new balance,
+    or None when the user does not exist or a debit would overdraw the balance.
+    """
+    now = datetime.now().isoformat()
+    cursor = await db.execute("""
+        UPDATE users 
+        SET balance = balance + ?, ledger_seq = ledger_seq + 1
+        WHERE user_id = ? AND (? >= 0 OR balance + ? >= 0)
+        RETURNING balance, ledger_seq
+    """, (amount, user_id, amount, amount))
+    rows = await cursor.fetchall()
+    if not rows:
+        return None
+    balance, seq = rows[0]
+    await append_ledger_legs(db, user_id, amount, kind, reference, balance, seq, now)
+    return balance
+
+async def append_ledger_legs(db, user_id: int, amount: int, kind: str, reference: Optional[str],
+                             balance: int, seq: int, now: str) -> None:
+    """Record a balance change the caller already applied (with ledger_seq bumped to `seq`)"""
+    cursor = await db.execute("""
+        INSERT INTO ledger_transactions (kind, reference, created_at) VALUES (?, ?, ?)
+    """, (kind, reference, now))
+    txn_id = cursor.lastrowid
+    cursor = await db.execute("""
+        INSERT INTO ledger_entries (txn_id, account, user_id, amount, balance_after)
+        VALUES (?, 'user', ?, ?, ?)
+    """, (txn_id, user_id, amount, balance))
+    entry_id = cursor.lastrowid
+    await db.execute("""
+        INSERT INTO ledger_entries (txn_id, account, amount) VALUES (?, ?, ?)
+    """, (txn_id, LEDGER_CONTRA_ACCOUNTS.get(kind, "adjustment"), -amount))
+    
+    if seq % LEDGER_SNAPSHOT_EVERY == 0:
+        await db.execute("""
+            INSERT INTO balance_snapshots (user_id, entry_id, balance, created_at) VALUES (?, ?, ?, ?)
+        """, (user_id, entry_id, balance, now))
+
+async def ledger_balance(db, user_id: int) -> int:
+    """Rebuild a user's balance from the latest snapshot plus the ledger tail after it"""
+    cursor = await db.execute("""
+        SELECT entry_id, balance FROM balance_snapshots 
+        WHERE user_id = ? ORDER BY entry_id DESC LIMIT 1
+    """, (user_id,))
+    snapshot = await cursor.fetchone()
+    last_entry, balance = snapshot if snapshot else (0, 0)
+    
+    cursor = await db.execute("""
+        SELECT COALESCE(SUM(amount), 0) FROM ledger_entries WHERE user_id = ? AND entry_id > ?
+    """, (user_id, last_entry))
+    return balance + (await cursor.fetchone())[0]
+
+async def get_ledger_balance(user_id: int) -> Optional[int]:
+    """Balance the ledger explains for a user, or None on error"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            return await ledger_balance(db, user_id)
+            
+    except Exception as e:
+        logger.error(f"Error reading ledger balance for user {user_id}: {e}")
+        return None
+
+async def verify_user_balance(user_id: int) -> dict:
+    """Compare users.balance with the balance the ledger explains"""
+    user = await get_user(user_id)
+    ledger_balance = await get_ledger_balance(user_id)
+    balance = user['balance'] if user else None
+    return {
+        'user_id': user_id,
+        'balance': balance,
+        'ledger_balance': ledger_balance,
+        'ok': balance is not None and balance == ledger_balance,
+    }
+
+@traced()
+@observe_latency(DB_OPERATION_SECONDS, "get_user")
 async def get_user(user_id: int) -> dict:
     """Get user data from database"""
     try:
@@ -884,6 +2104,8 @@ async def get_user(user_id: int) -> dict:
         logger.error(f"Error getting user {user_id}: {e}")
         return None
 
+@traced()
+@observe_latency(DB_OPERATION_SECONDS, "create_user")
 async def create_user(user_id: int, username: str) -> dict:
     """Create a new user in the database"""
     try:
@@ -891,17 +2113,17 @@ async def create_user(user_id: int, username: str) -> dict:
             await db.execute("""
                 INSERT OR REPLACE INTO users 
                 (user_id, username, balance, games_played, total_wagered, created_at, last_active)
-                VALUES (?, ?, 0.0, 0, 0.0, ?, ?)
+                VALUES (?, ?, 0, 0, 0, ?, ?)
             """, (user_id, username, datetime.now().isoformat(), datetime.now().isoformat()))
-            await db.commit()
+            await commit_timed(db, "create_user")
             
             return {
                 'user_id': user_id,
                 'username': username,
-                'balance': 0.0,
+                'balance': 0,
                 'games_played': 0,
-                'total_wagered': 0.0,
-                'total_withdrawn': 0.0,
+                'total_wagered': 0,
+                'total_withdrawn': 0,
                 'created_at': datetime.now().isoformat(),
                 'last_active': datetime.now().isoformat()
             }
@@ -910,573 +2132,3116 @@ async def create_user(user_id: int, username: str) -> dict:
         logger.error(f"Error creating user {user_id}: {e}")
         return None
 
-async def update_balance(user_id: int, amount: float) -> bool:
-    """Update user balance"""
+@traced()
+@observe_latency(DB_OPERATION_SECONDS, "update_balance")
+async def update_balance(user_id: int, amount: int, kind: str = "adjustment", reference: Optional[str] = None) -> bool:
+    """Add micro-dollars to user balance, recorded in the ledger as `kind`"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("""
-                UPDATE users 
-                SET balance = balance + ?, last_active = ?
-                WHERE user_id = ?
-            """, (amount, datetime.now().isoformat(), user_id))
-            await db.commit()
+            if await post_ledger(db, user_id, amount, kind, reference) is None:
+                return False
+            await commit_timed(db, "update_balance")
             return True
             
     except Exception as e:
         logger.error(f"Error updating balance for user {user_id}: {e}")
         return False
 
-async def deduct_balance(user_id: int, amount: float) -> bool:
-    """Deduct amount from user balance"""
+@traced()
+@observe_latency(DB_OPERATION_SECONDS, "deduct_balance")
+async def deduct_balance(user_id: int, amount: int, kind: str = "bet", reference: Optional[str] = None) -> bool:
+    """Deduct micro-dollars from user balance; fails without writing if it would overdraw"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Check current balance first
-            cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-            row = await cursor.fetchone()
-            if not row or row[0] < amount:
+            if await post_ledger(db, user_id, -amount, kind, reference) is None:
                 return False
-            
-            await db.execute("""
-                UPDATE users 
-                SET balance = balance - ?, last_active = ?
-                WHERE user_id = ?
-            """, (amount, datetime.now().isoformat(), user_id))
-            await db.commit()
+            await commit_timed(db, "deduct_balance")
             return True
             
     except Exception as e:
         logger.error(f"Error deducting balance for user {user_id}: {e}")
         return False
 
-def calculate_withdrawal_fee(amount: float) -> float:
-    """Calculate withdrawal fee"""
-    fee = amount * WITHDRAWAL_FEE_PERCENT  # WITHDRAWAL_FEE_PERCENT is already a decimal (0.02 = 2%)
-    return max(fee, MIN_WITHDRAWAL_FEE)
-
-def validate_crypto_address(address: str, asset: str) -> bool:
-    """Validate cryptocurrency address format"""
-    import re
-    pattern = CRYPTO_ADDRESS_PATTERNS.get(asset)
-    if not pattern:
-        return True  # Allow unknown assets
-    return bool(re.match(pattern, address))
-
-async def log_game_session(user_id: int, game_type: str, bet_amount: float, win_amount: float, result: str):
-    """Log a game session to the database"""
+async def settle_bet(db, user_id: int, game_type: str, bet_amount: int, win_amount: int, result: str) -> Optional[int]:
+    """
+    Settle a played bet in one BEGIN IMMEDIATE transaction: the stake debit and the payout
+    with their ledger legs, the session row, player stats and VIP progress, referral
+    commission, cashback, bonus wagering and the house totals (amounts in micro-dollars).
+    
+    Returns the new balance, or None without writing anything when the stake would overdraw
+    the balance. Any other failure rolls the whole bet back and propagates.
+    """
+    now = datetime.now().isoformat()
+    await db.execute("BEGIN IMMEDIATE")
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("""
-                INSERT INTO game_sessions (user_id, game_type, bet_amount, win_amount, result, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_id, game_type, bet_amount, win_amount, result, datetime.now().isoformat()))
-            
-            # Update user stats
-            await db.execute("""
-                UPDATE users 
-                SET games_played = games_played + 1,
-                    total_wagered = total_wagered + ?,
-                    last_active = ?
-                WHERE user_id = ?
-            """, (bet_amount, datetime.now().isoformat(), user_id))
-            
-            await db.commit()
-        
-        # Process referral commission if player lost
+        balance = await post_ledger(db, user_id, -bet_amount, "bet", game_type)
+        if balance is None:
+            await db.rollback()
+            return None
+        if win_amount > 0:
+            balance = await post_ledger(db, user_id, win_amount, "win", game_type)
+        
+        await db.execute("""
+            INSERT INTO game_sessions (user_id, game_type, bet_amount, win_amount, net_result, result, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, game_type, bet_amount, win_amount, win_amount - bet_amount, result, now))
+        
+        # Stats and VIP progress commit with the money or not at all; crossing the next VIP
+        # threshold promotes in the same transaction
+        cursor = await db.execute(PLAYER_STATS_UPDATE, {
+            'bet': bet_amount, 'win': win_amount, 'now': now, 'user_id': user_id
+        })
+        player = await cursor.fetchone()
+        await cursor.close()
+        if player is None:
+            raise LookupError(f"no stats row for user {user_id}")
+        new_vip_level = await apply_vip_progress(db, user_id, player[0], player[1])
+        
+        accrued = None
         if win_amount < bet_amount:
-            loss_amount = bet_amount - win_amount
-            await process_referral_commission(user_id, loss_amount)
+            if user_id in _referrer_of:
+                accrued = await accrue_referral_commission(db, user_id, bet_amount - win_amount)
+            await accrue_cashback(db, user_id, game_type, bet_amount - win_amount)
+        
+        # Bonus wagering and losses, only for players holding active claims
+        completed_claims = await advance_bonus_wagering(db, user_id, game_type, bet_amount, win_amount)
+        
+        await db.execute("""
+            UPDATE house_balance 
+            SET balance = balance + ?,
+                total_player_losses = total_player_losses + ?,
+                total_player_wins = total_player_wins + ?,
+                last_updated = ?
+            WHERE id = 1
+        """, (bet_amount - win_amount, bet_amount, win_amount, now))
+        await commit_timed(db, "settle_bet")
+    except BaseException:
+        await db.rollback()
+        raise
+    
+    emit("bet_settled", user_id=user_id, game_type=game_type, bet_amount=bet_amount,
+         win_amount=win_amount, total_wagered=player[0], win_streak=player[2])
+    if new_vip_level is not None:
+        emit("vip_upgrade", user_id=user_id, old_level=player[1], new_level=new_vip_level)
+    if completed_claims:
+        close_claims(user_id, completed_claims)
+        emit("bonus_completed", user_id=user_id, claim_ids=completed_claims)
+    record_game_rollup(game_type, user_id, bet_amount, win_amount)
+    record_leaderboards(user_id, bet_amount, win_amount)
+    BETS_TOTAL.inc(game_type)
+    WAGERED_USD_TOTAL.inc(game_type, amount=micros_to_usd(bet_amount))
+    PAID_OUT_USD_TOTAL.inc(game_type, amount=micros_to_usd(win_amount))
+    if accrued:
+        record_referral_commission(user_id, *accrued, bet_amount - win_amount)
+    return balance
+
+@traced()
+@observe_latency(DB_OPERATION_SECONDS, "settle_bet")
+async def place_bet(user_id: int, game_type: str, bet_amount: int, win_amount: int, result: str) -> Optional[int]:
+    """Settle a bet on its own connection; returns the new balance, or None if it was not placed"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            return await settle_bet(db, user_id, game_type, bet_amount, win_amount, result)
             
     except Exception as e:
-        logger.error(f"Error logging game session: {e}")
+        SETTLEMENT_FAILURES_TOTAL.inc(game_type)
+        logger.error(f"Bet rolled back: {game_type} {format_money(bet_amount)} for user {user_id}: {e}")
+        return None
 
-# --- House Balance System ---
+# --- Events ---
+# In-process publish/subscribe. Writers emit after their transaction commits. Plain functions
+# run inline (keep them to in-memory work); coroutine subscribers run as background tasks so
+# notifications never delay the caller.
 
-async def get_house_balance() -> dict:
-    """Get current house balance data"""
+_event_subscribers: Dict[str, List[Callable]] = {}
+_event_tasks: set = set()
+
+def subscribe(event: str, handler: Callable) -> None:
+    """Call handler(**payload) for every emitted `event`"""
+    _event_subscribers.setdefault(event, []).append(handler)
+
+def emit(event: str, **payload) -> None:
+    """Deliver an event to its subscribers"""
+    for handler in _event_subscribers.get(event, ()):
+        try:
+            result = handler(**payload)
+        except Exception as e:
+            logger.error(f"Error in {event} subscriber {handler.__name__}: {e}")
+            continue
+        if asyncio.iscoroutine(result):
+            task = asyncio.create_task(_await_subscriber(event, handler.__name__, result))
+            _event_tasks.add(task)
+            task.add_done_callback(_event_tasks.discard)
+
+async def _await_subscriber(event: str, name: str, result) -> None:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("""
-                SELECT * FROM house_balance WHERE id = 1
-            """)
-            result = await cursor.fetchone()
-            
-            if result:
-                return dict(result)
-            else:
-                # Initialize if not exists
-                await db.execute("""
-                    INSERT INTO house_balance (id, balance) VALUES (1, 10000.0)
-                """)
-                await db.commit()
-                return {
-                    'id': 1,
-                    'balance': 10000.0,
-                    'total_player_losses': 0.0,
-                    'total_player_wins': 0.0,
-                    'total_deposits': 0.0,
-                    'total_withdrawals': 0.0,
-                    'last_updated': datetime.now().isoformat()
-                }
-                
+        await result
     except Exception as e:
-        logger.error(f"Error getting house balance: {e}")
-        return {
-            'balance': 10000.0,
-            'total_player_losses': 0.0,
-            'total_player_wins': 0.0,
-            'total_deposits': 0.0,
-            'total_withdrawals': 0.0
-        }
+        logger.error(f"Error in {event} subscriber {name}: {e}")
+
+# --- VIP Tiers ---
+# Tiers follow lifetime total_wagered. Settlement already gets the player's stored vip_level
+# back from PLAYER_STATS_UPDATE, so it compares the new total with that tier's next threshold
+# and only evaluates tiers when it is crossed. Upgrades are written in the settlement
+# transaction and emitted as vip_upgrade.
+
+@dataclass(frozen=True)
+class VipTier:
+    level: int
+    name: str
+    required: int  # lifetime wagered, micro-dollars
+    withdrawal_fee_bps: int
+
+def _vip_tier_from_env(level: int, name: str, required: str, withdrawal_fee_bps: int) -> VipTier:
+    """Tier with its threshold and fee from VIP_<NAME>_REQUIRED (USD) and VIP_<NAME>_FEE_BPS"""
+    prefix = f"VIP_{name.upper()}"
+    return VipTier(level, name, to_micros(os.environ.get(f"{prefix}_REQUIRED", required)),
+                   int(os.environ.get(f"{prefix}_FEE_BPS", str(withdrawal_fee_bps))))
+
+VIP_TIERS = [
+    VipTier(0, "Bronze", 0, int(os.environ.get("VIP_BRONZE_FEE_BPS", str(WITHDRAWAL_FEE_BPS)))),
+    _vip_tier_from_env(1, "Silver", "1000", 150),
+    _vip_tier_from_env(2, "Gold", "5000", 100),
+    _vip_tier_from_env(3, "Diamond", "10000", 50),
+]
+
+def vip_tier(level: int) -> VipTier:
+    return VIP_TIERS[min(max(level or 0, 0), len(VIP_TIERS) - 1)]
+
+def vip_level_for(total_wagered: int) -> int:
+    """Highest tier whose requirement total_wagered meets"""
+    return bisect.bisect_right([tier.required for tier in VIP_TIERS], total_wagered) - 1
+
+def vip_next_threshold(level: int) -> float:
+    """Wagered amount that reaches the tier above `level` (infinite at the top)"""
+    return VIP_TIERS[level + 1].required if level + 1 < len(VIP_TIERS) else math.inf
+
+async def apply_vip_progress(db, user_id: int, total_wagered: int, vip_level: int) -> Optional[int]:
+    """Promote the player inside the caller's transaction if they crossed their next threshold"""
+    if total_wagered < vip_next_threshold(vip_level):
+        return None
+    new_level = vip_level_for(total_wagered)
+    if new_level <= vip_level:
+        return None
+    await db.execute("UPDATE users SET vip_level = ? WHERE user_id = ?", (new_level, user_id))
+    return new_level
+
+async def notify_vip_upgrade(user_id: int, old_level: int, new_level: int) -> None:
+    """vip_upgrade subscriber: tell the player about their new tier and perks"""
+    tier = vip_tier(new_level)
+    text = (f"🎉 <b>VIP {tier.name}!</b>\n\n"
+            f"You've wagered {format_money(tier.required)} and reached VIP {tier.name}.\n"
+            f"💸 Withdrawal fee is now {tier.withdrawal_fee_bps / 100:.1f}%.")
+    if new_level + 1 < len(VIP_TIERS):
+        upcoming = vip_tier(new_level + 1)
+        text += f"\n\nNext: VIP {upcoming.name} at {format_money(upcoming.required)} wagered."
+    await notify_user(user_id, text)
+    logger.info(f"User {user_id} upgraded from VIP {vip_tier(old_level).name} to {tier.name}")
+
+subscribe("vip_upgrade", notify_vip_upgrade)
+
+# --- Player Stats ---
+# Per-player totals, streaks and records on users are updated in the settlement write with
+# O(1) arithmetic on the row's current values. A bet wins when it pays more than the stake and
+# loses when it pays less; a push leaves both streaks alone.
+
+PLAYER_STATS_UPDATE = """
+    UPDATE users 
+    SET games_played = games_played + 1,
+        total_wagered = total_wagered + :bet,
+        total_won = total_won + :win,
+        win_streak = CASE WHEN :win > :bet THEN win_streak + 1 WHEN :win < :bet THEN 0 ELSE win_streak END,
+        max_win_streak = CASE WHEN :win > :bet THEN MAX(max_win_streak, win_streak + 1) ELSE max_win_streak END,
+        loss_streak = CASE WHEN :win < :bet THEN loss_streak + 1 WHEN :win > :bet THEN 0 ELSE loss_streak END,
+        max_loss_streak = CASE WHEN :win < :bet THEN MAX(max_loss_streak, loss_streak + 1) ELSE max_loss_streak END,
+        biggest_win = CASE WHEN :win > :bet THEN MAX(biggest_win, :win) ELSE biggest_win END,
+        biggest_loss = CASE WHEN :win < :bet THEN MAX(biggest_loss, :bet - :win) ELSE biggest_loss END,
+        last_game_at = :now
+    WHERE user_id = :user_id
+    RETURNING total_wagered, vip_level, win_streak
+"""
 
-async def update_house_balance_on_game(bet_amount: float, win_amount: float) -> bool:
-    """Update house balance based on game outcome"""
+@dataclass
+class PlayerStats:
+    """The PLAYER_STATS_UPDATE columns rebuilt in memory during a backfill"""
+    games_played: int = 0
+    total_wagered: int = 0
+    total_won: int = 0
+    win_streak: int = 0
+    max_win_streak: int = 0
+    loss_streak: int = 0
+    max_loss_streak: int = 0
+    biggest_win: int = 0
+    biggest_loss: int = 0
+    last_game_at: Optional[str] = None
+    
+    def add(self, bet_amount: int, win_amount: int, played_at: str) -> None:
+        self.games_played += 1
+        self.total_wagered += bet_amount
+        self.total_won += win_amount
+        if win_amount > bet_amount:
+            self.win_streak += 1
+            self.loss_streak = 0
+            self.max_win_streak = max(self.max_win_streak, self.win_streak)
+            self.biggest_win = max(self.biggest_win, win_amount)
+        elif win_amount < bet_amount:
+            self.loss_streak += 1
+            self.win_streak = 0
+            self.max_loss_streak = max(self.max_loss_streak, self.loss_streak)
+            self.biggest_loss = max(self.biggest_loss, bet_amount - win_amount)
+        self.last_game_at = played_at
+
+async def backfill_player_stats() -> int:
+    """
+    Recompute every player's stats from game_sessions in one streaming pass ordered by
+    session_id. Sessions settled while the pass runs are folded in under a write lock before
+    the results are stored. Returns the number of players updated.
+    """
+    stats: Dict[int, PlayerStats] = {}
+    
+    async def stream(db, last_id: int) -> int:
+        while True:
+            cursor = await db.execute("""
+                SELECT session_id, user_id, bet_amount, win_amount, created_at FROM game_sessions
+                WHERE session_id > ? ORDER BY session_id LIMIT ?
+            """, (last_id, ROLLUP_BATCH_SIZE))
+            rows = await cursor.fetchall()
+            if not rows:
+                return last_id
+            for _, user_id, bet_amount, win_amount, created_at in rows:
+                player = stats.get(user_id)
+                if player is None:
+                    player = stats[user_id] = PlayerStats()
+                player.add(bet_amount or 0, win_amount or 0, created_at)
+            last_id = rows[-1][0]
+    
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Calculate house profit/loss
-            house_change = bet_amount - win_amount  # Positive = house wins, Negative = house loses
-            
-            await db.execute("""
-                UPDATE house_balance 
-                SET balance = balance + ?,
-                    total_player_losses = total_player_losses + ?,
-                    total_player_wins = total_player_wins + ?,
-                    last_updated = ?
-                WHERE id = 1
-            """, (house_change, bet_amount, win_amount, datetime.now().isoformat()))
-            
+            last_id = await stream(db, 0)
+            await db.execute("BEGIN IMMEDIATE")
+            await stream(db, last_id)
+            columns = [spec.name for spec in dataclasses.fields(PlayerStats)]
+            await db.executemany(
+                f"UPDATE users SET {', '.join(f'{column} = ?' for column in columns)}, "
+                f"vip_level = MAX(vip_level, ?) WHERE user_id = ?",
+                [(*dataclasses.astuple(player), vip_level_for(player.total_wagered), user_id)
+                 for user_id, player in stats.items()]
+            )
             await db.commit()
-            logger.debug(f"House balance updated: {house_change:+.2f} (bet: {bet_amount}, win: {win_amount})")
-            return True
-            
+        logger.info(f"Player stats backfilled for {len(stats)} players")
+        return len(stats)
     except Exception as e:
-        logger.error(f"Error updating house balance on game: {e}")
-        return False
+        logger.error(f"Error backfilling player stats: {e}")
+        return 0
 
-async def update_house_balance_on_deposit(amount: float) -> bool:
-    """Update house balance when user deposits (house gains funds)"""
-    try:
+async def backfill_player_stats_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /backfill_player_stats (admin only)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    await update.message.reply_text("⏳ Recomputing player stats from game history...")
+    players = await backfill_player_stats()
+    await update.message.reply_text(f"✅ Player stats rebuilt for {players} players.")
+
+# --- Game Statistics Rollups ---
+# Settled bets are summed in memory per (game, day) and flushed into game_statistics with an
+# upsert, so analytics read one row per game per day instead of scanning game_sessions.
+# Distinct players per row are estimated with a HyperLogLog sketch stored next to the totals.
+
+ROLLUP_FLUSH_SECONDS = int(os.environ.get("ROLLUP_FLUSH_SECONDS", "30"))
+ROLLUP_BATCH_SIZE = 5000  # game_sessions rows per read during backfill
+JACKPOT_MULTIPLIER = 10  # wins of at least this many times the bet count as jackpots
+
+class PlayerSketch:
+    """HyperLogLog distinct counter over user ids: 1 KB of registers, about 3% error"""
+    P = 10
+    M = 1 << P
+    ALPHA = 0.7213 / (1 + 1.079 / M)
+
+    def __init__(self, registers: Optional[bytes] = None):
+        self.registers = bytearray(registers) if registers and len(registers) == self.M else bytearray(self.M)
+
+    def add(self, user_id: int) -> None:
+        hashed = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.P)
+        rank = (64 - self.P) - (hashed & ((1 << (64 - self.P)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, registers: Optional[bytes]) -> None:
+        if registers and len(registers) == self.M:
+            self.registers = bytearray(map(max, self.registers, registers))
+
+    def estimate(self) -> int:
+        zeros = self.registers.count(0)
+        if zeros == self.M:
+            return 0
+        raw = self.ALPHA * self.M * self.M / sum(2.0 ** -rank for rank in self.registers)
+        if raw <= 2.5 * self.M and zeros:
+            return round(self.M * math.log(self.M / zeros))  # linear counting for small sets
+        return round(raw)
+
+@dataclass
+class GameRollup:
+    """Totals for one game on one day that have not been flushed yet"""
+    sessions: int = 0
+    wagered: int = 0
+    won: int = 0
+    max_win: int = 0
+    jackpots: int = 0
+
+    def add(self, bet_amount: int, win_amount: int) -> None:
+        self.sessions += 1
+        self.wagered += bet_amount
+        self.won += win_amount
+        self.max_win = max(self.max_win, win_amount)
+        if bet_amount > 0 and win_amount >= bet_amount * JACKPOT_MULTIPLIER:
+            self.jackpots += 1
+
+    def merge(self, other: "GameRollup") -> None:
+        self.sessions += other.sessions
+        self.wagered += other.wagered
+        self.won += other.won
+        self.max_win = max(self.max_win, other.max_win)
+        self.jackpots += other.jackpots
+
+# Unflushed totals and the day's player sketches, keyed by (game_type, date)
+_pending_rollups: Dict[Tuple[str, str], GameRollup] = {}
+_player_sketches: Dict[Tuple[str, str], PlayerSketch] = {}
+_loaded_sketches: set = set()  # keys whose stored sketch has been merged into memory
+_rollup_lock = asyncio.Lock()
+_rollup_task: Optional[asyncio.Task] = None
+
+def record_game_rollup(game_type: str, user_id: int, bet_amount: int, win_amount: int) -> None:
+    """Add a settled bet to today's in-memory rollup"""
+    key = (game_type, datetime.now().date().isoformat())
+    rollup = _pending_rollups.get(key)
+    if rollup is None:
+        rollup = _pending_rollups[key] = GameRollup()
+    rollup.add(bet_amount, win_amount)
+    sketch = _player_sketches.get(key)
+    if sketch is None:
+        sketch = _player_sketches[key] = PlayerSketch()
+    sketch.add(user_id)
+
+def _rollup_row(key: Tuple[str, str], rollup: GameRollup, sketch: PlayerSketch) -> tuple:
+    """Parameters for GAME_STATISTICS_UPSERT"""
+    rtp = 100.0 * rollup.won / rollup.wagered if rollup.wagered else 0.0
+    avg_bet = rollup.wagered // rollup.sessions if rollup.sessions else 0
+    return (key[0], key[1], rollup.sessions, sketch.estimate(), rollup.wagered, rollup.won,
+            rollup.wagered - rollup.won, rtp, avg_bet, rollup.max_win, rollup.jackpots, bytes(sketch.registers))
+
+GAME_STATISTICS_COLUMNS = """
+    (game_type, date, total_sessions, total_players, total_wagered, total_won, house_profit,
+     rtp, avg_bet, max_win, jackpots_hit, players_sketch)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Adds flushed totals to the stored row; the sketch is merged in memory before the write
+GAME_STATISTICS_UPSERT = f"""
+    INSERT INTO game_statistics {GAME_STATISTICS_COLUMNS}
+    ON CONFLICT(game_type, date) DO UPDATE SET
+        total_sessions = total_sessions + excluded.total_sessions,
+        total_players = excluded.total_players,
+        total_wagered = total_wagered + excluded.total_wagered,
+        total_won = total_won + excluded.total_won,
+        house_profit = house_profit + excluded.house_profit,
+        rtp = CASE WHEN total_wagered + excluded.total_wagered > 0
+                   THEN 100.0 * (total_won + excluded.total_won) / (total_wagered + excluded.total_wagered)
+                   ELSE 0 END,
+        avg_bet = (total_wagered + excluded.total_wagered) / (total_sessions + excluded.total_sessions),
+        max_win = MAX(max_win, excluded.max_win),
+        jackpots_hit = jackpots_hit + excluded.jackpots_hit,
+        players_sketch = excluded.players_sketch
+"""
+
+# Replaces a stored row with totals rebuilt from game_sessions
+GAME_STATISTICS_REPLACE = f"""
+    INSERT INTO game_statistics {GAME_STATISTICS_COLUMNS}
+    ON CONFLICT(game_type, date) DO UPDATE SET
+        total_sessions = excluded.total_sessions, total_players = excluded.total_players,
+        total_wagered = excluded.total_wagered, total_won = excluded.total_won,
+        house_profit = excluded.house_profit, rtp = excluded.rtp, avg_bet = excluded.avg_bet,
+        max_win = excluded.max_win, jackpots_hit = excluded.jackpots_hit,
+        players_sketch = excluded.players_sketch
+"""
+
+async def flush_game_rollups() -> int:
+    """Write pending rollups to game_statistics; returns the number of rows upserted"""
+    async with _rollup_lock:
+        if not _pending_rollups:
+            return 0
+        pending = dict(_pending_rollups)
+        _pending_rollups.clear()
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                for key in pending:
+                    if key not in _loaded_sketches:
+                        cursor = await db.execute("""
+                            SELECT players_sketch FROM game_statistics WHERE game_type = ? AND date = ?
+                        """, key)
+                        row = await cursor.fetchone()
+                        _player_sketches[key].merge(row[0] if row else None)
+                        _loaded_sketches.add(key)
+                await db.executemany(GAME_STATISTICS_UPSERT, [
+                    _rollup_row(key, rollup, _player_sketches[key]) for key, rollup in pending.items()
+                ])
+                await commit_timed(db, "flush_game_rollups")
+        except Exception as e:
+            logger.error(f"Error flushing game statistics: {e}")
+            # Keep the totals for the next flush
+            for key, rollup in pending.items():
+                _pending_rollups.setdefault(key, GameRollup()).merge(rollup)
+            return 0
+        
+        # Past days are complete once flushed; only today's sketches stay in memory
+        today = datetime.now().date().isoformat()
+        for key in [key for key in _player_sketches if key[1] < today and key not in _pending_rollups]:
+            _player_sketches.pop(key, None)
+            _loaded_sketches.discard(key)
+        return len(pending)
+
+async def backfill_game_statistics(days: Optional[int] = None) -> int:
+    """
+    Rebuild game_statistics rows for days before today from game_sessions.
+    Sessions are streamed with keyset pagination on session_id; today's row stays with the
+    live rollup. Returns the number of rows written.
+    """
+    today = datetime.now().date()
+    since = (today - timedelta(days=days)).isoformat() if days else ""
+    totals: Dict[Tuple[str, str], GameRollup] = {}
+    sketches: Dict[Tuple[str, str], PlayerSketch] = {}
+    await flush_game_rollups()
+    try:
         async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("""
-                UPDATE house_balance 
-                SET balance = balance + ?,
-                    total_deposits = total_deposits + ?,
-                    last_updated = ?
-                WHERE id = 1
-            """, (amount, amount, datetime.now().isoformat()))
+            last_id = 0
+            while True:
+                cursor = await db.execute("""
+                    SELECT session_id, user_id, game_type, substr(created_at, 1, 10), bet_amount, win_amount
+                    FROM game_sessions
+                    WHERE session_id > ? AND created_at >= ? AND created_at < ?
+                    ORDER BY session_id LIMIT ?
+                """, (last_id, since, today.isoformat(), ROLLUP_BATCH_SIZE))
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+                for session_id, user_id, game_type, day, bet_amount, win_amount in rows:
+                    key = (game_type, day)
+                    if key not in totals:
+                        totals[key] = GameRollup()
+                        sketches[key] = PlayerSketch()
+                    totals[key].add(bet_amount or 0, win_amount or 0)
+                    sketches[key].add(user_id)
+                last_id = rows[-1][0]
             
+            await db.executemany(GAME_STATISTICS_REPLACE, [
+                _rollup_row(key, rollup, sketches[key]) for key, rollup in totals.items()
+            ])
             await db.commit()
-            logger.debug(f"House balance increased by deposit: +{amount:.2f}")
-            return True
-            
+        logger.info(f"Game statistics backfilled: {len(totals)} game-days since {since or 'the first session'}")
+        return len(totals)
     except Exception as e:
-        logger.error(f"Error updating house balance on deposit: {e}")
-        return False
+        logger.error(f"Error backfilling game statistics: {e}")
+        return 0
 
-async def update_house_balance_on_withdrawal(amount: float) -> bool:
-    """Update house balance when user withdraws (house loses funds)"""
+async def rollup_flush_loop():
+    """Flush game statistics every ROLLUP_FLUSH_SECONDS"""
+    while True:
+        await asyncio.sleep(ROLLUP_FLUSH_SECONDS)
+        await flush_game_rollups()
+
+def start_rollups() -> None:
+    """Launch the background rollup flusher"""
+    global _rollup_task
+    if _rollup_task is None:
+        _rollup_task = asyncio.create_task(rollup_flush_loop())
+
+async def backfill_stats_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /backfill_stats [days] (admin only)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    if context.args and not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /backfill_stats [days]\n\nWithout days, all history is rebuilt.")
+        return
+    days = int(context.args[0]) if context.args else None
+    
+    await update.message.reply_text(f"⏳ Rebuilding game statistics for {f'the last {days} days' if days else 'all history'}...")
+    rows = await backfill_game_statistics(days)
+    await update.message.reply_text(f"✅ Game statistics rebuilt: {rows} game-day rows written.")
+
+# --- Activity Tracking ---
+# Every update touches its user's session in memory; a gap longer than SESSION_IDLE_SECONDS
+# starts a new session. Touches are coalesced and written by a periodic flush (user_sessions
+# rows plus users.last_active), so bets and balance changes no longer rewrite last_active.
+
+SESSION_IDLE_SECONDS = int(os.environ.get("SESSION_IDLE_SECONDS", "1800"))
+ACTIVITY_FLUSH_SECONDS = int(os.environ.get("ACTIVITY_FLUSH_SECONDS", "30"))
+
+@dataclass
+class ActivitySession:
+    started_at: datetime
+    last_activity: datetime
+    actions: int = 0
+    session_id: Optional[int] = None  # set once the row has been inserted
+    ended: bool = False
+    dirty: bool = False
+
+_open_sessions: Dict[int, ActivitySession] = {}
+_dirty_sessions: List[Tuple[int, ActivitySession]] = []  # touched or closed since the last flush
+_activity_task: Optional[asyncio.Task] = None
+
+def _mark_dirty(user_id: int, session: ActivitySession) -> None:
+    if not session.dirty:
+        session.dirty = True
+        _dirty_sessions.append((user_id, session))
+
+def touch_activity(user_id: int) -> None:
+    """Count one action for the user, opening a new session after an idle gap"""
+    now = datetime.now()
+    session = _open_sessions.get(user_id)
+    if session and (now - session.last_activity).total_seconds() > SESSION_IDLE_SECONDS:
+        session.ended = True
+        _mark_dirty(user_id, session)
+        session = None
+    if session is None:
+        session = _open_sessions[user_id] = ActivitySession(now, now)
+    session.last_activity = now
+    session.actions += 1
+    _mark_dirty(user_id, session)
+
+async def flush_activity(close_all: bool = False) -> int:
+    """Write touched sessions and last_active; returns the number of sessions written"""
+    now = datetime.now()
+    for user_id, session in list(_open_sessions.items()):
+        if close_all or (now - session.last_activity).total_seconds() > SESSION_IDLE_SECONDS:
+            session.ended = True
+            _mark_dirty(user_id, session)
+    if not _dirty_sessions:
+        return 0
+    
+    dirty = _dirty_sessions[:]
+    _dirty_sessions.clear()
+    for user_id, session in dirty:
+        session.dirty = False
+        if session.ended and _open_sessions.get(user_id) is session:
+            del _open_sessions[user_id]
+    
+    inserted = []
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("""
-                UPDATE house_balance 
-                SET balance = balance - ?,
-                    total_withdrawals = total_withdrawals + ?,
-                    last_updated = ?
-                WHERE id = 1
-            """, (amount, amount, datetime.now().isoformat()))
-            
-            await db.commit()
-            logger.debug(f"House balance decreased by withdrawal: -{amount:.2f}")
-            return True
-            
+            updates, last_active = [], {}
+            for user_id, session in dirty:
+                values = (session.last_activity.isoformat(), session.actions,
+                          int((session.last_activity - session.started_at).total_seconds()),
+                          session.last_activity.isoformat() if session.ended else None)
+                if session.session_id is None:
+                    cursor = await db.execute("""
+                        INSERT INTO user_sessions (user_id, platform, started_at, last_activity,
+                                                   actions_count, session_duration, ended_at)
+                        VALUES (?, 'telegram', ?, ?, ?, ?, ?)
+                    """, (user_id, session.started_at.isoformat()) + values)
+                    session.session_id = cursor.lastrowid
+                    inserted.append(session)
+                else:
+                    updates.append(values + (session.session_id,))
+                last_active[user_id] = max(last_active.get(user_id, ""), values[0])
+            await db.executemany("""
+                UPDATE user_sessions SET last_activity = ?, actions_count = ?, session_duration = ?, ended_at = ?
+                WHERE session_id = ?
+            """, updates)
+            await db.executemany("""
+                UPDATE users SET last_active = ? WHERE user_id = ? AND (last_active IS NULL OR last_active < ?)
+            """, [(stamp, user_id, stamp) for user_id, stamp in last_active.items()])
+            await commit_timed(db, "flush_activity")
+        return len(dirty)
     except Exception as e:
-        logger.error(f"Error updating house balance on withdrawal: {e}")
-        return False
+        logger.error(f"Error saving activity: {e}")
+        for session in inserted:
+            session.session_id = None  # rolled back
+        for user_id, session in dirty:
+            _mark_dirty(user_id, session)  # retried with the next flush
+        return 0
 
-async def get_house_profit_loss() -> dict:
-    """Calculate house profit/loss statistics"""
+async def activity_flush_loop():
+    """Flush activity every ACTIVITY_FLUSH_SECONDS"""
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_SECONDS)
+        await flush_activity()
+
+def start_activity_tracking() -> None:
+    """Launch the background activity writer"""
+    global _activity_task
+    if _activity_task is None:
+        _activity_task = asyncio.create_task(activity_flush_loop())
+
+async def get_activity_stats(days: int = 7) -> dict:
+    """Daily active users and sessions over a period, plus D1/D7 retention of recent signups"""
     try:
-        house_data = await get_house_balance()
-        
-        total_in = house_data.get('total_deposits', 0.0)
-        total_out = house_data.get('total_withdrawals', 0.0) + house_data.get('total_player_wins', 0.0)
-        total_received = house_data.get('total_player_losses', 0.0)
-        
-        net_profit = total_received + total_in - total_out
-        house_edge = (total_received / (total_received + house_data.get('total_player_wins', 0.001))) * 100 if (total_received + house_data.get('total_player_wins', 0)) > 0 else 0
-        
-        return {
-            'current_balance': house_data.get('balance', 0.0),
-            'total_deposits': total_in,
-            'total_withdrawals': house_data.get('total_withdrawals', 0.0),
-            'total_player_losses': total_received,
-            'total_player_wins': house_data.get('total_player_wins', 0.0),
-            'net_profit': net_profit,
-            'house_edge_percent': house_edge
-        }
-        
+        today = datetime.now().date()
+        since = (today - timedelta(days=days - 1)).isoformat()
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                SELECT DATE(started_at) AS day, COUNT(DISTINCT user_id), COUNT(*)
+                FROM user_sessions WHERE started_at >= ?
+                GROUP BY day ORDER BY day
+            """, (since,))
+            daily = {day: {'users': users, 'sessions': sessions} for day, users, sessions in await cursor.fetchall()}
+            
+            retention = {}
+            for offset in (1, 7):
+                # Signups whose day N has fully passed, within the same-length window before it
+                end = (today - timedelta(days=offset)).isoformat()
+                start = (today - timedelta(days=offset + days)).isoformat()
+                cursor = await db.execute("""
+                    SELECT COUNT(*), COALESCE(SUM(EXISTS (
+                        SELECT 1 FROM user_sessions s
+                        WHERE s.user_id = u.user_id
+                          AND s.started_at >= DATE(u.created_at, ?) AND s.started_at < DATE(u.created_at, ?)
+                    )), 0)
+                    FROM users u WHERE u.created_at >= ? AND u.created_at < ?
+                """, (f"+{offset} days", f"+{offset + 1} days", start, end))
+                cohort, returned = await cursor.fetchone()
+                retention[offset] = 100.0 * returned / cohort if cohort else None
+        return {'daily': daily, 'retention': retention}
     except Exception as e:
-        logger.error(f"Error calculating house profit/loss: {e}")
-        return {
-            'current_balance': 0.0,
-            'total_deposits': 0.0,
-            'total_withdrawals': 0.0,
-            'total_player_losses': 0.0,
-            'total_player_wins': 0.0,
-            'net_profit': 0.0,
-            'house_edge_percent': 0.0
-        }
+        logger.error(f"Error getting activity stats: {e}")
+        return {'daily': {}, 'retention': {}}
+
+# --- Admin Analytics ---
+# Admin screens read game_statistics rollups and indexed columns only; game_sessions is never
+# scanned here. Lists page with keyset cursors carried in the callback data.
+
+ADMIN_PAGE_SIZE = 10
+ADMIN_TOP_N = 5
+ADMIN_CHART_WIDTH = 12
+
+# Ledger filters for the transactions screen: callback code -> button label
+TRANSACTION_FILTERS = {
+    "all": "All",
+    "deposit": "Deposits",
+    "withdrawal": "Withdrawals",
+    "bet": "Bets",
+    "win": "Wins",
+    "bonus": "Bonuses",
+    "referral_commission": "Commissions",
+}
 
-async def update_balance_with_house(user_id: int, bet_amount: float, win_amount: float) -> bool:
-    """Update user balance and house balance for game outcomes"""
+# User list orderings: callback code -> (indexed column, button label)
+USER_SORTS = {
+    "balance": ("balance", "Balance"),
+    "wagered": ("total_wagered", "Wagered"),
+    "active": ("last_active", "Last Active"),
+}
+
+def text_bar(value: float, maximum: float, width: int = ADMIN_CHART_WIDTH) -> str:
+    """Horizontal bar for monospace charts"""
+    if maximum <= 0 or value <= 0:
+        return ""
+    return "█" * max(1, round(width * value / maximum))
+
+async def get_game_analytics(days: int) -> dict:
+    """
+    Per-game and per-day totals for the last `days` days (today included).
+    Stored rollups are combined with bets that have not been flushed yet.
+    """
+    since = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
+    games: Dict[str, dict] = {}
+    daily: Dict[str, int] = {}
+    
+    def add(game_type: str, day: str, sessions: int, players: int, wagered: int, won: int, jackpots: int):
+        game = games.setdefault(game_type, {'sessions': 0, 'player_days': 0, 'days': set(), 'wagered': 0, 'won': 0, 'jackpots': 0})
+        game['sessions'] += sessions
+        game['player_days'] += players
+        game['days'].add(day)
+        game['wagered'] += wagered
+        game['won'] += won
+        game['jackpots'] += jackpots
+        daily[day] = daily.get(day, 0) + wagered
+    
     try:
-        # Update user balance with net result
-        net_result = win_amount - bet_amount
-        user_updated = await update_balance(user_id, net_result)
-        
-        # Update house balance
-        house_updated = await update_house_balance_on_game(bet_amount, win_amount)
-        
-        return user_updated and house_updated
-        
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                SELECT game_type, date, total_sessions, total_players, total_wagered, total_won, jackpots_hit
+                FROM game_statistics WHERE date >= ?
+            """, (since,))
+            for row in await cursor.fetchall():
+                add(*row)
     except Exception as e:
-        logger.error(f"Error updating balances for game: {e}")
-        return False
+        logger.error(f"Error getting game analytics: {e}")
+    
+    for (game_type, day), rollup in list(_pending_rollups.items()):
+        if day >= since:
+            add(game_type, day, rollup.sessions, 0, rollup.wagered, rollup.won, rollup.jackpots)
+    
+    for game in games.values():
+        game['rtp'] = 100.0 * game['won'] / game['wagered'] if game['wagered'] else 0.0
+        game['avg_players'] = game['player_days'] // len(game.pop('days'))
+    return {'since': since, 'games': games, 'daily': dict(sorted(daily.items()))}
 
-async def deduct_balance_with_house(user_id: int, bet_amount: float) -> bool:
-    """Deduct balance for game bet and update house balance"""
+async def get_top_users(column: str, limit: int = ADMIN_TOP_N) -> List[dict]:
+    """Highest values of an indexed users column"""
+    if column not in {sort[0] for sort in USER_SORTS.values()}:
+        return []
     try:
-        # Deduct from user
-        user_updated = await deduct_balance(user_id, bet_amount)
-        
-        if user_updated:
-            # Update house balance (house gains the bet amount, user wins 0)
-            house_updated = await update_house_balance_on_game(bet_amount, 0.0)
-            return house_updated
-        
-        return False
-        
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT user_id, username, balance, total_wagered FROM users
+                ORDER BY {column} DESC, user_id DESC LIMIT ?
+            """, (limit,))
+            return [dict(row) for row in await cursor.fetchall()]
     except Exception as e:
-        logger.error(f"Error deducting balance with house update: {e}")
-        return False
-
-# --- Deposit/Withdrawal House Balance Integration ---
+        logger.error(f"Error getting top users by {column}: {e}")
+        return []
 
-async def process_deposit_with_house_balance(user_id: int, amount: float) -> bool:
-    """Process a user deposit and update house balance"""
+async def list_users_page(sort: str, after: Optional[Tuple[str, int]] = None,
+                          limit: int = ADMIN_PAGE_SIZE) -> List[dict]:
+    """
+    One page of users ordered by an indexed column, descending.
+    `after` is the (value, user_id) of the last row on the previous page.
+    """
+    column = USER_SORTS[sort][0]
+    query = "SELECT user_id, username, balance, total_wagered, games_played, last_active, is_banned FROM users"
+    params: list = []
+    if after is not None:
+        value = after[0] if column == "last_active" else int(after[0])
+        query += f" WHERE ({column}, user_id) < (?, ?)"
+        params += [value, after[1]]
+    query += f" ORDER BY {column} DESC, user_id DESC LIMIT ?"
+    params.append(limit)
     try:
-        # Update user balance
-        user_updated = await update_balance(user_id, amount)
-        
-        if user_updated:
-            # Update house balance (house gains funds from deposit)
-            house_updated = await update_house_balance_on_deposit(amount)
-            return house_updated
-        
-        return False
-        
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(query, params)
+            return [dict(row) for row in await cursor.fetchall()]
     except Exception as e:
-        logger.error(f"Error processing deposit with house balance: {e}")
-        return False
+        logger.error(f"Error listing users: {e}")
+        return []
 
-async def process_withdrawal_with_house_balance(user_id: int, amount: float) -> bool:
-    """Process a user withdrawal and update house balance"""
+async def get_user_counts() -> dict:
+    """Total users and users active since midnight"""
     try:
-        # Deduct balance from user
-        user_updated = await deduct_balance(user_id, amount)
-        
-        if user_updated:
-            # Update house balance (house loses funds from withdrawal)
-            house_updated = await update_house_balance_on_withdrawal(amount)
-            return house_updated
-        
-        return False
-        
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM users")
+            total = (await cursor.fetchone())[0]
+            cursor = await db.execute("SELECT COUNT(*) FROM users WHERE last_active >= ?",
+                                      (datetime.now().date().isoformat(),))
+            active = (await cursor.fetchone())[0]
+            return {'total': total, 'active_today': active}
     except Exception as e:
-        logger.error(f"Error processing withdrawal with house balance: {e}")
-        return False
-
-# --- House Balance Display Helper ---
+        logger.error(f"Error counting users: {e}")
+        return {'total': 0, 'active_today': 0}
 
-async def get_house_balance_display() -> str:
-    """Get formatted house balance information for owner panel"""
+async def list_transactions_page(kind: str = "all", before: Optional[int] = None,
+                                 limit: int = ADMIN_PAGE_SIZE) -> List[dict]:
+    """
+    One page of ledger transactions with their user leg, newest first.
+    `before` is the txn_id of the last row on the previous page.
+    """
+    where, params = [], []
+    if before is not None:
+        where.append("t.txn_id < ?")
+        params.append(before)
+    if kind == "all":
+        where.append("t.kind != 'opening_balance'")
+    else:
+        where.append("t.kind = ?")
+        params.append(kind)
+    params.append(limit)
     try:
-        house_stats = await get_house_profit_loss()
-        
-        balance_str = await format_usd(house_stats['current_balance'])
-        deposits_str = await format_usd(house_stats['total_deposits'])
-        withdrawals_str = await format_usd(house_stats['total_withdrawals'])
-        player_losses_str = await format_usd(house_stats['total_player_losses'])
-        player_wins_str = await format_usd(house_stats['total_player_wins'])
-        net_profit_str = await format_usd(house_stats['net_profit'])
-        house_edge = house_stats['house_edge_percent']
-        
-        profit_emoji = "📈" if house_stats['net_profit'] >= 0 else "📉"
-        
-        return f"""
-🏦 <b>HOUSE BALANCE</b> 🏦
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT t.txn_id, t.kind, t.reference, t.created_at, e.user_id, e.amount, e.balance_after
+                FROM ledger_transactions t
+                JOIN ledger_entries e ON e.txn_id = t.txn_id AND e.account = 'user'
+                WHERE {' AND '.join(where)}
+                ORDER BY t.txn_id DESC LIMIT ?
+            """, params)
+            return [dict(row) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error listing transactions: {e}")
+        return []
 
-💰 <b>Current Balance:</b> {balance_str}
-{profit_emoji} <b>Net Profit:</b> {net_profit_str}
-🎯 <b>House Edge:</b> {house_edge:.2f}%
+# --- Leaderboards ---
+# Boards are kept in memory as sorted (-score, user_id) lists, so the top entries are a slice
+# and a player's rank is a bisect instead of ORDER BY / COUNT(*) over users or game_sessions.
+# Daily and weekly boards start over when their period changes. Their scores are snapshotted
+# to leaderboard_scores periodically and reloaded for the current periods at startup; the
+# all-time referrer board is loaded from users.referral_earnings.
+
+LEADERBOARD_SNAPSHOT_SECONDS = int(os.environ.get("LEADERBOARD_SNAPSHOT_SECONDS", "60"))
+LEADERBOARD_SIZE = 10  # entries shown per board
+LEADERBOARD_RETENTION_DAYS = 35  # snapshots of older periods are pruned
+
+def leaderboard_period(window: Optional[str], now: Optional[datetime] = None) -> str:
+    """Period key for a board window: ISO date, ISO week or 'all'"""
+    now = now or datetime.now()
+    if window == "day":
+        return now.date().isoformat()
+    if window == "week":
+        year, week, _ = now.isocalendar()
+        return f"{year}-W{week:02d}"
+    return "all"
+
+class Leaderboard:
+    """Per-user scores with rank and top-K answered from a sorted list"""
+    
+    def __init__(self, name: str, title: str, window: Optional[str], mode: str):
+        self.name = name
+        self.title = title
+        self.window = window
+        self.mode = mode  # "sum" adds each value, "max" keeps the best single value
+        self.period = leaderboard_period(window)
+        self.scores: Dict[int, int] = {}
+        self.ranked: List[Tuple[int, int]] = []
+        self.dirty: set = set()
+    
+    def load(self, period: str, rows: List[Tuple[int, int]]) -> None:
+        self.period = period
+        self.scores = dict(rows)
+        self.ranked = sorted((-score, user_id) for user_id, score in self.scores.items())
+        self.dirty.clear()
+    
+    def record(self, user_id: int, value: int) -> None:
+        old = self.scores.get(user_id)
+        if self.mode == "max":
+            if old is not None and value <= old:
+                return
+            score = value
+        else:
+            score = (old or 0) + value
+        if old is not None:
+            del self.ranked[bisect.bisect_left(self.ranked, (-old, user_id))]
+        self.scores[user_id] = score
+        bisect.insort(self.ranked, (-score, user_id))
+        self.dirty.add(user_id)
+    
+    def rank(self, user_id: int) -> Optional[int]:
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.ranked, (-score, user_id)) + 1
+    
+    def top(self, limit: int = LEADERBOARD_SIZE) -> List[Tuple[int, int]]:
+        return [(user_id, -score) for score, user_id in self.ranked[:limit]]
+    
+    def take_dirty(self) -> List[tuple]:
+        """Snapshot rows for scores changed since the last call"""
+        rows = [(self.name, self.period, user_id, self.scores[user_id]) for user_id in self.dirty]
+        self.dirty.clear()
+        return rows
+
+LEADERBOARDS: Dict[str, Leaderboard] = {
+    board.name: board for board in (
+        Leaderboard("wagered_day", "Most Wagered Today", "day", "sum"),
+        Leaderboard("wagered_week", "Most Wagered This Week", "week", "sum"),
+        Leaderboard("win_day", "Biggest Win Today", "day", "max"),
+        Leaderboard("win_week", "Biggest Win This Week", "week", "max"),
+        Leaderboard("referrers", "Top Referrers", None, "sum"),
+    )
+}
 
-💳 <b>Deposits:</b> {deposits_str}
-🏦 <b>Withdrawals:</b> {withdrawals_str}
-📉 <b>Paid to Players:</b> {player_wins_str}
-📈 <b>From Players:</b> {player_losses_str}
+_leaderboard_rows: List[tuple] = []  # snapshot rows of finished periods awaiting a write
+_leaderboard_task: Optional[asyncio.Task] = None
 
-<i>Real-time casino financial tracking</i>
-"""
-        
+def roll_leaderboards() -> None:
+    """Start windowed boards over when their period has ended"""
+    now = datetime.now()
+    for board in LEADERBOARDS.values():
+        if board.window and board.period != leaderboard_period(board.window, now):
+            _leaderboard_rows.extend(board.take_dirty())
+            board.load(leaderboard_period(board.window, now), [])
+
+def record_leaderboards(user_id: int, bet_amount: int, win_amount: int) -> None:
+    """Add a settled bet to the wagered and biggest-win boards"""
+    roll_leaderboards()
+    LEADERBOARDS["wagered_day"].record(user_id, bet_amount)
+    LEADERBOARDS["wagered_week"].record(user_id, bet_amount)
+    if win_amount > bet_amount:  # same rule as users.biggest_win
+        LEADERBOARDS["win_day"].record(user_id, win_amount)
+        LEADERBOARDS["win_week"].record(user_id, win_amount)
+
+async def load_leaderboards() -> None:
+    """Fill the boards from the current periods' snapshots and referral earnings"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            for board in LEADERBOARDS.values():
+                period = leaderboard_period(board.window)
+                if board.window:
+                    cursor = await db.execute("""
+                        SELECT user_id, score FROM leaderboard_scores WHERE board = ? AND period = ?
+                    """, (board.name, period))
+                else:
+                    cursor = await db.execute("SELECT user_id, referral_earnings FROM users WHERE referral_earnings > 0")
+                board.load(period, await cursor.fetchall())
+        logger.info("Leaderboards loaded: " + ", ".join(f"{name}={len(board.scores)}" for name, board in LEADERBOARDS.items()))
     except Exception as e:
-        logger.error(f"Error getting house balance display: {e}")
-        return "❌ <b>House Balance:</b> Unable to load data"
+        logger.error(f"Error loading leaderboards: {e}")
+
+async def snapshot_leaderboards() -> int:
+    """Write changed windowed scores to leaderboard_scores; returns the number of rows written"""
+    roll_leaderboards()
+    rows = _leaderboard_rows[:]
+    _leaderboard_rows.clear()
+    for board in LEADERBOARDS.values():
+        if board.window:
+            rows.extend(board.take_dirty())
+        else:
+            board.dirty.clear()  # referral_earnings is the durable copy
+    if not rows:
+        return 0
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany("""
+                INSERT INTO leaderboard_scores (board, period, user_id, score) VALUES (?, ?, ?, ?)
+                ON CONFLICT(board, period, user_id) DO UPDATE SET score = excluded.score
+            """, rows)
+            cutoff = datetime.now() - timedelta(days=LEADERBOARD_RETENTION_DAYS)
+            for board in LEADERBOARDS.values():
+                if board.window:
+                    await db.execute("DELETE FROM leaderboard_scores WHERE board = ? AND period < ?",
+                                     (board.name, leaderboard_period(board.window, cutoff)))
+            await commit_timed(db, "snapshot_leaderboards")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error saving leaderboard snapshot: {e}")
+        _leaderboard_rows.extend(rows)  # retried with the next snapshot
+        return 0
 
-# --- Weekly Bonus Helpers ---
-WEEKLY_BONUS_AMOUNT = float(os.environ.get("WEEKLY_BONUS_AMOUNT", "5.0"))
-WEEKLY_BONUS_INTERVAL = 7  # days
+async def leaderboard_snapshot_loop():
+    """Snapshot leaderboards every LEADERBOARD_SNAPSHOT_SECONDS"""
+    while True:
+        await asyncio.sleep(LEADERBOARD_SNAPSHOT_SECONDS)
+        await snapshot_leaderboards()
+
+def start_leaderboards() -> None:
+    """Launch the background leaderboard snapshotter"""
+    global _leaderboard_task
+    if _leaderboard_task is None:
+        _leaderboard_task = asyncio.create_task(leaderboard_snapshot_loop())
+
+async def format_leaderboard(board_name: str, user_id: int) -> str:
+    """Leaderboard message with the top entries and the viewer's own rank"""
+    roll_leaderboards()
+    board = LEADERBOARDS[board_name]
+    top = board.top()
+    names: Dict[int, str] = {}
+    if top:
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                cursor = await db.execute(
+                    f"SELECT user_id, username FROM users WHERE user_id IN ({', '.join('?' * len(top))})",
+                    [entry_user for entry_user, _ in top])
+                names = dict(await cursor.fetchall())
+        except Exception as e:
+            logger.error(f"Error loading leaderboard names: {e}")
+    
+    text = f"🏆 <b>{board.title.upper()}</b>\n\n"
+    if top:
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        for rank, (entry_user, score) in enumerate(top, 1):
+            name = html.escape(names.get(entry_user) or "Player")
+            you = " ← you" if entry_user == user_id else ""
+            text += f"{medals.get(rank, f'{rank}.')} {name} - {format_money(score)}{you}\n"
+    else:
+        text += "No entries yet. Be the first!\n"
+    
+    rank = board.rank(user_id)
+    if rank is None:
+        text += "\nYou are not on this board yet."
+    elif rank > len(top):
+        text += f"\nYour rank: <b>#{rank:,}</b> of {len(board.scores):,} ({format_money(board.scores[user_id])})"
+    return text
+
+# --- Achievements ---
+# Rules subscribe to bet_settled, deposit_completed and referral_joined. Events carry the
+# running totals returned by the write that produced them (total_wagered, win_streak, ...), so
+# a rule is one comparison and an event only visits the rules registered for its type.
+# Unlocked ids are cached per user; new unlocks are queued and written in batches.
+
+ACHIEVEMENT_FLUSH_SECONDS = int(os.environ.get("ACHIEVEMENT_FLUSH_SECONDS", "5"))
+
+@dataclass(frozen=True)
+class AchievementRule:
+    achievement_id: str
+    name: str
+    description: str
+    event: str
+    progress: Callable[[dict], int]  # value the event reports towards the target
+    target: int = 1
+    progress_column: Optional[str] = None  # users column showing progress between events
+
+ACHIEVEMENT_RULES = [
+    AchievementRule("first_deposit", "First Deposit", "Make your first deposit", "deposit_completed",
+                    lambda event: 1),
+    AchievementRule("slots_jackpot", "Jackpot!", f"Hit a {JACKPOT_MULTIPLIER}x win in slots", "bet_settled",
+                    lambda event: int(event['game_type'] == "slots" and event['bet_amount'] > 0
+                                      and event['win_amount'] >= event['bet_amount'] * JACKPOT_MULTIPLIER)),
+    AchievementRule("win_streak_10", "On Fire", "Win 10 bets in a row", "bet_settled",
+                    lambda event: event['win_streak'], 10, "max_win_streak"),
+    AchievementRule("wagered_1000", "High Roller", "Wager $1,000 in total", "bet_settled",
+                    lambda event: event['total_wagered'], to_micros(1000), "total_wagered"),
+    AchievementRule("referrals_5", "Networker", "Refer 5 friends", "referral_joined",
+                    lambda event: event['referral_count'], 5, "referral_count"),
+]
+ACHIEVEMENTS = {rule.achievement_id: rule for rule in ACHIEVEMENT_RULES}
+
+_unlocked_achievements: Dict[int, set] = {}
+_pending_unlocks: List[tuple] = []
+_achievement_task: Optional[asyncio.Task] = None
+
+def _achievement_subscriber(event: str, rules: List[AchievementRule]) -> Callable:
+    def evaluate_achievements(user_id: int, **payload) -> None:
+        unlocked = _unlocked_achievements.get(user_id, ())
+        payload['user_id'] = user_id
+        for rule in rules:
+            if rule.achievement_id not in unlocked and rule.progress(payload) >= rule.target:
+                unlock_achievement(user_id, rule)
+    return evaluate_achievements
+
+for _event in {rule.event for rule in ACHIEVEMENT_RULES}:
+    subscribe(_event, _achievement_subscriber(_event, [rule for rule in ACHIEVEMENT_RULES if rule.event == _event]))
+
+def unlock_achievement(user_id: int, rule: AchievementRule) -> None:
+    """Mark an achievement unlocked now and queue its row"""
+    _unlocked_achievements.setdefault(user_id, set()).add(rule.achievement_id)
+    _pending_unlocks.append((user_id, rule.achievement_id, rule.name, rule.description, datetime.now().isoformat()))
+    emit("achievement_unlocked", user_id=user_id, achievement_id=rule.achievement_id)
+
+async def notify_achievement(user_id: int, achievement_id: str) -> None:
+    """achievement_unlocked subscriber: congratulate the player"""
+    rule = ACHIEVEMENTS[achievement_id]
+    await notify_user(user_id, f"🏅 <b>Achievement unlocked: {rule.name}</b>\n\n{rule.description}")
+
+subscribe("achievement_unlocked", notify_achievement)
+
+async def load_achievements() -> int:
+    """Cache every unlocked achievement; returns the number loaded"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("SELECT user_id, achievement_id FROM user_achievements")
+            rows = await cursor.fetchall()
+        _unlocked_achievements.clear()
+        for user_id, achievement_id in rows:
+            _unlocked_achievements.setdefault(user_id, set()).add(achievement_id)
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error loading achievements: {e}")
+        return 0
 
-# --- Referral System Configuration ---
-REFERRAL_COMMISSION_PERCENT = float(os.environ.get("REFERRAL_COMMISSION_PERCENT", "0.20"))  # 20% commission on referee losses
-REFERRAL_BONUS_REFEREE = float(os.environ.get("REFERRAL_BONUS_REFEREE", "5.0"))    # Welcome bonus for new user
-MAX_REFERRALS_PER_USER = int(os.environ.get("MAX_REFERRALS_PER_USER", "1000"))       # Max referrals per user
+async def flush_achievements() -> int:
+    """Write queued unlocks in one statement; returns the number written"""
+    if not _pending_unlocks:
+        return 0
+    rows = _pending_unlocks[:]
+    _pending_unlocks.clear()
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany("""
+                INSERT OR IGNORE INTO user_achievements (user_id, achievement_id, achievement_name, description, unlocked_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            await commit_timed(db, "flush_achievements")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error saving achievements: {e}")
+        _pending_unlocks[:0] = rows  # retried with the next flush
+        return 0
 
-async def ensure_weekly_bonus_column():
-    """Ensure weekly bonus column exists in users table"""
+async def achievement_flush_loop():
+    """Flush achievement unlocks every ACHIEVEMENT_FLUSH_SECONDS"""
+    while True:
+        await asyncio.sleep(ACHIEVEMENT_FLUSH_SECONDS)
+        await flush_achievements()
+
+def start_achievements() -> None:
+    """Launch the background achievement writer"""
+    global _achievement_task
+    if _achievement_task is None:
+        _achievement_task = asyncio.create_task(achievement_flush_loop())
+
+def format_achievements(user: dict) -> str:
+    """Achievement list with progress for the stats screen"""
+    unlocked = _unlocked_achievements.get(user['user_id'], ())
+    lines = []
+    for rule in ACHIEVEMENT_RULES:
+        if rule.achievement_id in unlocked:
+            lines.append(f"✅ <b>{rule.name}</b> - {rule.description}")
+            continue
+        progress = ""
+        if rule.progress_column:
+            current = min(user.get(rule.progress_column) or 0, rule.target)
+            if rule.progress_column == "total_wagered":
+                progress = f" ({format_money(current)} / {format_money(rule.target)})"
+            else:
+                progress = f" ({current} / {rule.target})"
+        lines.append(f"🔒 {rule.name} - {rule.description}{progress}")
+    return "\n".join(lines)
+
+# --- Bonus Campaigns ---
+# Live campaigns are cached and indexed by (type, game) so settlement and deposits only look at
+# campaigns that can apply. Each granted bonus is a user_bonus_claims row whose wagered_amount
+# and remaining_amount are advanced inside the settlement transaction; players with no active
+# claims skip it entirely. Cashback is staged in cashback_accruals by the same transaction and
+# paid, with the expiry sweep and a campaign reload, by a scheduled job. Active claims hold back withdrawals until wagered.
+
+BONUS_TYPES = ("deposit_bonus", "cashback", "free_spins")
+BONUS_SWEEP_SECONDS = int(os.environ.get("BONUS_SWEEP_SECONDS", "60"))
+BONUS_CLAIM_DAYS = int(os.environ.get("BONUS_CLAIM_DAYS", "7"))  # time to meet the wagering requirement
+
+@dataclass(frozen=True)
+class BonusCampaign:
+    campaign_id: int
+    name: str
+    type: str
+    amount: int  # free_spins: stake per spin
+    percentage: float  # deposit_bonus match / cashback share of net losses
+    min_deposit: int
+    max_bonus: int  # 0 = uncapped
+    wagering: float  # requirement as a multiple of the bonus
+    games: Optional[frozenset]  # None = every game
+    starts_at: str
+    ends_at: Optional[str]
+    usage_limit: Optional[int]
+    spins: int
+
+    def is_live(self, now: str) -> bool:
+        return self.starts_at <= now and (self.ends_at is None or now < self.ends_at)
+
+    def bonus_for(self, amount: int) -> int:
+        bonus = apply_bps(amount, round(self.percentage * 100))
+        return min(bonus, self.max_bonus) if self.max_bonus else bonus
+
+@dataclass
+class BonusClaim:
+    claim_id: int
+    campaign_id: int
+    games: Optional[frozenset]
+
+_campaigns: Dict[int, BonusCampaign] = {}
+_campaign_index: Dict[Tuple[str, Optional[str]], List[BonusCampaign]] = {}
+_active_claims: Dict[int, List[BonusClaim]] = {}
+_bonus_task: Optional[asyncio.Task] = None
+
+def live_campaigns(type: str, game_type: Optional[str] = None) -> List[BonusCampaign]:
+    """Campaigns of a type running now that cover game_type (or every campaign of the type)"""
+    now = datetime.now().isoformat()
+    if game_type is None:
+        candidates = [c for c in _campaigns.values() if c.type == type]
+    else:
+        candidates = _campaign_index.get((type, game_type), []) + _campaign_index.get((type, None), [])
+    return [c for c in candidates if c.is_live(now)]
+
+async def load_bonus_campaigns() -> int:
+    """Cache active campaigns that have not ended; returns the number loaded"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("ALTER TABLE users ADD COLUMN last_weekly_bonus TEXT DEFAULT NULL")
-            await db.commit()
-    except Exception:
-        pass  # Column already exists
+            cursor = await db.execute("""
+                SELECT id, name, type, amount, percentage, min_deposit, max_bonus, wagering_requirement,
+                       valid_games, start_date, end_date, usage_limit, spins
+                FROM bonus_campaigns
+                WHERE is_active AND (end_date IS NULL OR end_date > ?)
+                  AND (usage_limit IS NULL OR usage_count < usage_limit)
+            """, (datetime.now().isoformat(),))
+            rows = await cursor.fetchall()
+        campaigns = {}
+        index: Dict[Tuple[str, Optional[str]], List[BonusCampaign]] = {}
+        for row in rows:
+            games = frozenset(json.loads(row[8])) if row[8] else None
+            campaign = BonusCampaign(row[0], row[1], row[2], row[3], row[4] or 0.0, row[5] or 0, row[6] or 0,
+                                     row[7] or 0.0, games, row[9] or "", row[10], row[11], row[12] or 0)
+            campaigns[campaign.campaign_id] = campaign
+            for game_type in games or (None,):
+                index.setdefault((campaign.type, game_type), []).append(campaign)
+        _campaigns.clear()
+        _campaigns.update(campaigns)
+        _campaign_index.clear()
+        _campaign_index.update(index)
+        return len(campaigns)
+    except Exception as e:
+        logger.error(f"Error loading bonus campaigns: {e}")
+        return 0
 
-async def ensure_referral_columns():
-    """Ensure referral system columns exist"""
+async def load_bonus_claims() -> int:
+    """Cache every active claim; returns the number loaded"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Add referral columns to users table
-            await db.execute("ALTER TABLE users ADD COLUMN referral_code TEXT DEFAULT NULL")
-            await db.execute("ALTER TABLE users ADD COLUMN referred_by TEXT DEFAULT NULL")
-            await db.execute("ALTER TABLE users ADD COLUMN referral_earnings REAL DEFAULT 0.0")
-            await db.execute("ALTER TABLE users ADD COLUMN referral_count INTEGER DEFAULT 0")
-            
-            # Create referrals table if it doesn't exist
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS referrals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    referrer_id INTEGER NOT NULL,
-                    referee_id INTEGER NOT NULL,
-                    referral_code TEXT NOT NULL,
-                    bonus_paid REAL DEFAULT 0.0,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    activated_at TIMESTAMP DEFAULT NULL,
-                    FOREIGN KEY (referrer_id) REFERENCES users (user_id),
-                    FOREIGN KEY (referee_id) REFERENCES users (user_id)
-                )
+            cursor = await db.execute("""
+                SELECT c.id, c.user_id, c.campaign_id, b.valid_games
+                FROM user_bonus_claims c JOIN bonus_campaigns b ON b.id = c.campaign_id
+                WHERE c.status = 'active'
             """)
-            await db.commit()
+            rows = await cursor.fetchall()
+        _active_claims.clear()
+        for claim_id, user_id, campaign_id, valid_games in rows:
+            games = frozenset(json.loads(valid_games)) if valid_games else None
+            _active_claims.setdefault(user_id, []).append(BonusClaim(claim_id, campaign_id, games))
+        return len(rows)
     except Exception as e:
-        logger.error(f"Error ensuring referral columns: {e}")
+        logger.error(f"Error loading bonus claims: {e}")
+        return 0
 
-async def can_claim_weekly_bonus(user_id: int) -> Tuple[bool, Optional[int]]:
-    """Check if user can claim weekly bonus. Returns (can_claim, seconds_remaining)."""
-    user = await get_user(user_id)
-    if not user:
-        return False, None
-    
-    last_claim = user.get('last_weekly_bonus')
-    if not last_claim:
-        return True, None
+async def use_campaign(db, campaign_id: int) -> None:
+    """Count one use of a campaign in the caller's transaction; raises LookupError when used up"""
+    cursor = await db.execute("""
+        UPDATE bonus_campaigns SET usage_count = usage_count + 1
+        WHERE id = ? AND (usage_limit IS NULL OR usage_count < usage_limit)
+        RETURNING usage_count
+    """, (campaign_id,))
+    if not await cursor.fetchall():
+        raise LookupError(f"campaign {campaign_id} is used up")
+
+async def grant_bonus(db, campaign: BonusCampaign, user_id: int, amount: int) -> Optional[BonusClaim]:
+    """Credit a campaign bonus and open its claim inside the caller's transaction.
+    
+    Returns the claim while it still has wagering left, otherwise None. Raises LookupError
+    when the campaign is used up or the credit fails; the caller rolls back.
+    """
+    await use_campaign(db, campaign.campaign_id)
+    if await post_ledger(db, user_id, amount, "bonus", f"campaign:{campaign.campaign_id}") is None:
+        raise LookupError(f"user {user_id} not found")
     
-    last_dt = datetime.fromisoformat(last_claim)
     now = datetime.now()
-    delta = now - last_dt
-    if delta.days >= WEEKLY_BONUS_INTERVAL:
-        return True, None
-    
-    seconds_remaining = (WEEKLY_BONUS_INTERVAL * 86400) - int(delta.total_seconds())
-    return False, seconds_remaining
-
-async def claim_weekly_bonus(user_id: int) -> bool:
-    """Grant the weekly bonus and update last_weekly_bonus."""
-    try:
-        success = await update_balance(user_id, WEEKLY_BONUS_AMOUNT)
-        if success:
+    requirement = int(amount * campaign.wagering)
+    cursor = await db.execute("""
+        INSERT INTO user_bonus_claims (user_id, campaign_id, amount, remaining_amount, wagering_requirement,
+                                       status, claimed_at, completed_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, campaign.campaign_id, amount, amount, requirement, "active" if requirement else "completed",
+          now.isoformat(), None if requirement else now.isoformat(),
+          (now + timedelta(days=BONUS_CLAIM_DAYS)).isoformat()))
+    return BonusClaim(cursor.lastrowid, campaign.campaign_id, campaign.games) if requirement else None
+
+def open_claim(user_id: int, claim: Optional[BonusClaim]) -> None:
+    """Track a committed claim until it is wagered or expires"""
+    if claim:
+        _active_claims.setdefault(user_id, []).append(claim)
+
+async def has_claimed_campaign(db, user_id: int, campaign_id: int) -> bool:
+    cursor = await db.execute("""
+        SELECT 1 FROM user_bonus_claims WHERE user_id = ? AND campaign_id = ? LIMIT 1
+    """, (user_id, campaign_id))
+    return await cursor.fetchone() is not None
+
+async def take_bonus_losses(db, claim_ids: List[int], loss: int) -> None:
+    """Charge a settled loss to the remaining bonus of active claims, oldest claim first"""
+    cursor = await db.execute(f"""
+        SELECT id, COALESCE(remaining_amount, amount) FROM user_bonus_claims
+        WHERE id IN ({",".join(map(str, claim_ids))}) AND status = 'active'
+        ORDER BY id
+    """)
+    updates = []
+    for claim_id, remaining in await cursor.fetchall():
+        if loss <= 0:
+            break
+        taken = min(remaining, loss)
+        if taken > 0:
+            updates.append((remaining - taken, claim_id))
+            loss -= taken
+    if updates:
+        await db.executemany("UPDATE user_bonus_claims SET remaining_amount = ? WHERE id = ?", updates)
+
+async def advance_bonus_wagering(db, user_id: int, game_type: str, bet_amount: int, win_amount: int) -> List[int]:
+    """Add a settled bet to the player's claims; returns ids of claims it completed.
+    
+    Losses on any game use up the bonus before the player's own funds, so an expiring claim
+    only forfeits what is left of it. Only eligible games count towards wagering.
+    """
+    claims = _active_claims.get(user_id)
+    if not claims:
+        return []
+    if win_amount < bet_amount:
+        await take_bonus_losses(db, [c.claim_id for c in claims], bet_amount - win_amount)
+    eligible = [c.claim_id for c in claims if c.games is None or game_type in c.games]
+    if not eligible:
+        return []
+    cursor = await db.execute(f"""
+        UPDATE user_bonus_claims
+        SET wagered_amount = MIN(wagering_requirement, wagered_amount + :bet),
+            status = CASE WHEN wagered_amount + :bet >= wagering_requirement THEN 'completed' ELSE status END,
+            completed_at = CASE WHEN wagered_amount + :bet >= wagering_requirement THEN :now ELSE completed_at END
+        WHERE id IN ({",".join(map(str, eligible))}) AND status = 'active'
+        RETURNING id, status
+    """, {'bet': bet_amount, 'now': datetime.now().isoformat()})
+    return [claim_id for claim_id, status in await cursor.fetchall() if status == "completed"]
+
+def close_claims(user_id: int, claim_ids) -> None:
+    """Stop tracking claims that completed or expired"""
+    claims = [c for c in _active_claims.get(user_id, ()) if c.claim_id not in claim_ids]
+    if claims:
+        _active_claims[user_id] = claims
+    else:
+        _active_claims.pop(user_id, None)
+
+async def accrue_cashback(db, user_id: int, game_type: str, loss_amount: int) -> None:
+    """Stage cashback on a settled loss for running cashback campaigns, in the caller's transaction"""
+    now = datetime.now().isoformat()
+    rows = [(campaign.campaign_id, user_id, campaign.bonus_for(loss_amount), now)
+            for campaign in live_campaigns("cashback", game_type)]
+    rows = [row for row in rows if row[2] > 0]
+    if rows:
+        await db.executemany("""
+            INSERT INTO cashback_accruals (campaign_id, user_id, amount, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(campaign_id, user_id) DO UPDATE SET
+                amount = amount + excluded.amount,
+                updated_at = excluded.updated_at
+        """, rows)
+
+async def pay_cashback() -> int:
+    """Credit staged cashback as bonus claims; returns the number of payouts"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("SELECT campaign_id, user_id FROM cashback_accruals")
+            staged = await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error reading staged cashback: {e}")
+        return 0
+    paid = 0
+    for campaign_id, user_id in staged:
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                # Taking the row and granting it commit together, so concurrent runs cannot pay twice
+                await db.execute("BEGIN IMMEDIATE")
+                cursor = await db.execute("""
+                    DELETE FROM cashback_accruals WHERE campaign_id = ? AND user_id = ? RETURNING amount
+                """, (campaign_id, user_id))
+                row = await cursor.fetchone()
+                await cursor.close()
+                campaign = _campaigns.get(campaign_id)
+                amount = row[0] if row else 0
+                claim = None
+                if campaign and amount > 0:  # cashback of ended campaigns is forfeited
+                    await db.execute("SAVEPOINT grant_cashback")
+                    try:
+                        claim = await grant_bonus(db, campaign, user_id, amount)
+                    except LookupError as e:
+                        await db.execute("ROLLBACK TO grant_cashback")
+                        logger.warning(f"Cashback for user {user_id} not paid: {e}")
+                        campaign = None
+                await commit_timed(db, "pay_cashback")
+            if campaign and amount > 0:
+                open_claim(user_id, claim)
+                paid += 1
+                emit("bonus_granted", user_id=user_id, campaign_id=campaign_id, amount=amount)
+        except Exception as e:
+            logger.error(f"Error paying cashback to user {user_id}: {e}")  # stays staged for the next run
+    return paid
+
+async def apply_deposit_bonuses(user_id: int, amount: int, **_) -> None:
+    """deposit_completed subscriber: match the deposit for campaigns the player has not used"""
+    for campaign in live_campaigns("deposit_bonus"):
+        bonus = campaign.bonus_for(amount)
+        if amount < campaign.min_deposit or bonus <= 0:
+            continue
+        try:
             async with aiosqlite.connect(DB_PATH) as db:
+                await db.execute("BEGIN IMMEDIATE")
+                if await has_claimed_campaign(db, user_id, campaign.campaign_id):
+                    continue
+                claim = await grant_bonus(db, campaign, user_id, bonus)
+                await commit_timed(db, "apply_deposit_bonuses")
+            open_claim(user_id, claim)
+            emit("bonus_granted", user_id=user_id, campaign_id=campaign.campaign_id, amount=bonus)
+        except LookupError as e:
+            logger.warning(f"Deposit bonus for user {user_id} not granted: {e}")
+        except Exception as e:
+            logger.error(f"Error granting deposit bonus to user {user_id}: {e}")
+
+subscribe("deposit_completed", apply_deposit_bonuses)
+
+async def claim_free_spins(user_id: int, campaign_id: int) -> Optional[Tuple[List[List[str]], int]]:
+    """Play a free spins campaign for the player; returns (reels per spin, winnings) or None"""
+    campaign = _campaigns.get(campaign_id)
+    if not campaign or campaign.type != "free_spins" or not campaign.is_live(datetime.now().isoformat()):
+        return None
+    spins = [generate_slot_reels() for _ in range(campaign.spins)]
+    winnings = sum(calculate_slots_win(reels, campaign.amount)[0] for reels in spins)
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            if await has_claimed_campaign(db, user_id, campaign_id):
+                return None
+            claim = None
+            if winnings:
+                claim = await grant_bonus(db, campaign, user_id, winnings)
+            else:
+                # Nothing won: still a use of the campaign, and the claim stops the spins being replayed
+                await use_campaign(db, campaign_id)
                 await db.execute("""
-                    UPDATE users SET last_weekly_bonus = ? WHERE user_id = ?
-                """, (datetime.now().isoformat(), user_id))
-                await db.commit()
-        return success
+                    INSERT INTO user_bonus_claims (user_id, campaign_id, amount, status, claimed_at, completed_at)
+                    VALUES (?, ?, 0, 'completed', ?, ?)
+                """, (user_id, campaign_id, datetime.now().isoformat(), datetime.now().isoformat()))
+            await commit_timed(db, "claim_free_spins")
+        open_claim(user_id, claim)
+        return spins, winnings
+    except LookupError as e:
+        logger.warning(f"Free spins for user {user_id} not granted: {e}")
+        return None
     except Exception as e:
-        logger.error(f"Error claiming weekly bonus: {e}")
-        return False
+        logger.error(f"Error claiming free spins for user {user_id}: {e}")
+        return None
 
-# --- Referral System Helpers ---
+async def expire_bonus_claims() -> int:
+    """Expire claims past their deadline and forfeit what is left of the bonus; returns the count"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("""
+                UPDATE user_bonus_claims SET status = 'expired'
+                WHERE status = 'active' AND expires_at <= ?
+                RETURNING id, user_id, COALESCE(remaining_amount, amount)
+            """, (datetime.now().isoformat(),))
+            expired = await cursor.fetchall()
+            for claim_id, user_id, remaining in expired:
+                cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
+                row = await cursor.fetchone()
+                forfeit = min(remaining, row[0]) if row else 0
+                if forfeit > 0:
+                    await post_ledger(db, user_id, -forfeit, "bonus", f"forfeit:{claim_id}")
+            await commit_timed(db, "expire_bonus_claims")
+        for claim_id, user_id, _ in expired:
+            close_claims(user_id, {claim_id})
+        return len(expired)
+    except Exception as e:
+        logger.error(f"Error expiring bonus claims: {e}")
+        return 0
 
-def generate_referral_code(user_id: int) -> str:
-    """Generate a unique referral code for a user."""
-    import time
-    import random
-    import hashlib
-    
-    # Create a base from user_id and current timestamp
-    base = f"{user_id}_{int(time.time())}_{random.randint(1000, 9999)}"
-    hash_obj = hashlib.md5(base.encode())
-    
-    # Take first 8 characters and make it alphanumeric
-    code = hash_obj.hexdigest()[:6].upper()
-    return f"REF{code}"
+async def bonus_loop():
+    """Reload campaigns, pay cashback and expire claims every BONUS_SWEEP_SECONDS"""
+    while True:
+        await asyncio.sleep(BONUS_SWEEP_SECONDS)
+        await load_bonus_campaigns()
+        await pay_cashback()
+        await expire_bonus_claims()
+
+def start_bonus_campaigns() -> None:
+    """Launch the background bonus job"""
+    global _bonus_task
+    if _bonus_task is None:
+        _bonus_task = asyncio.create_task(bonus_loop())
+
+async def notify_bonus_granted(user_id: int, campaign_id: int, amount: int) -> None:
+    """bonus_granted subscriber: tell the player about the credit and its wagering"""
+    campaign = _campaigns.get(campaign_id)
+    if not campaign:
+        return
+    text = f"🎁 <b>{html.escape(campaign.name)}</b>\n\n{format_money(amount)} bonus added to your balance."
+    if campaign.wagering:
+        text += f"\n🎯 Wager {format_money(int(amount * campaign.wagering))} within {BONUS_CLAIM_DAYS} days to unlock withdrawals."
+    await notify_user(user_id, text)
+
+subscribe("bonus_granted", notify_bonus_granted)
+
+async def notify_bonus_completed(user_id: int, claim_ids: List[int]) -> None:
+    """bonus_completed subscriber: wagering done, the bonus is now withdrawable"""
+    await notify_user(user_id, "✅ <b>Bonus wagering complete!</b>\n\nYour bonus funds are now free to withdraw.")
+
+subscribe("bonus_completed", notify_bonus_completed)
+
+def describe_campaign(campaign: BonusCampaign) -> str:
+    """One-line player-facing summary of a campaign"""
+    if campaign.type == "deposit_bonus":
+        text = f"{campaign.percentage:g}% deposit match"
+        if campaign.max_bonus:
+            text += f" up to {format_money(campaign.max_bonus)}"
+        if campaign.min_deposit:
+            text += f", min deposit {format_money(campaign.min_deposit)}"
+    elif campaign.type == "cashback":
+        text = f"{campaign.percentage:g}% cashback on losses"
+    else:
+        text = f"{campaign.spins} free slots spins at {format_money(campaign.amount)}"
+    if campaign.games:
+        text += f" ({', '.join(sorted(campaign.games))})"
+    if campaign.wagering:
+        text += f" • {campaign.wagering:g}x wagering"
+    if campaign.ends_at:
+        text += f" • ends {campaign.ends_at[:10]}"
+    return text
+
+async def get_active_claims(user_id: int) -> List[dict]:
+    """Active claims with campaign names and wagering progress"""
+    if user_id not in _active_claims:
+        return []
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT c.id, b.name, c.amount, c.wagering_requirement, c.wagered_amount, c.expires_at
+                FROM user_bonus_claims c JOIN bonus_campaigns b ON b.id = c.campaign_id
+                WHERE c.user_id = ? AND c.status = 'active'
+                ORDER BY c.expires_at
+            """, (user_id,))
+            return [dict(row) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting bonus claims for user {user_id}: {e}")
+        return []
 
-async def get_or_create_referral_code(user_id: int) -> str:
-    """Get existing referral code or create a new one."""
+async def create_bonus_campaign(type: str, name: str, options: Dict[str, str]) -> Optional[str]:
+    """Insert a campaign from /campaign add options and reload the cache; returns an error or None"""
+    if type not in BONUS_TYPES:
+        return f"Type must be one of: {', '.join(BONUS_TYPES)}"
+    try:
+        days = float(options.get("days", 0))
+        games = [game for game in options.get("games", "").split(",") if game]
+        now = datetime.now()
+        values = (
+            name, type, to_micros(options.get("amount", 0)), float(options.get("percentage", 0)),
+            to_micros(options.get("min_deposit", 0)), to_micros(options.get("max_bonus", 0)),
+            float(options.get("wagering", 0)), json.dumps(games) if games else None, now.isoformat(),
+            (now + timedelta(days=days)).isoformat() if days else None,
+            int(options["limit"]) if "limit" in options else None, int(options.get("spins", 0)),
+        )
+    except (ValueError, ArithmeticError) as e:
+        return f"Invalid option: {e}"
+    if type == "free_spins" and (values[2] <= 0 or values[11] <= 0):
+        return "free_spins needs amount= and spins="
+    if type != "free_spins" and values[3] <= 0:
+        return f"{type} needs percentage="
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT referral_code FROM users WHERE user_id = ?", (user_id,))
-            row = await cursor.fetchone()
-            if row and row[0]:
-                return row[0]
-            
-            # Create new code
-            code = generate_referral_code(user_id)
-            await db.execute("UPDATE users SET referral_code = ? WHERE user_id = ?", (code, user_id))
+            await db.execute("""
+                INSERT INTO bonus_campaigns (name, type, amount, percentage, min_deposit, max_bonus,
+                    wagering_requirement, valid_games, start_date, end_date, usage_limit, spins)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, values)
             await db.commit()
-            return code
+        await load_bonus_campaigns()
+        return None
     except Exception as e:
-        logger.error(f"Error getting/creating referral code: {e}")
-        return generate_referral_code(user_id)
+        logger.error(f"Error creating bonus campaign: {e}")
+        return "Could not save the campaign"
 
-async def get_referral_stats(user_id: int) -> dict:
-    """Get referral statistics for a user."""
+async def end_bonus_campaign(campaign_id: int) -> bool:
+    """Deactivate a campaign; claims already granted keep running"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Get user's referral data
-            cursor = await db.execute("""
-                SELECT referral_earnings, referral_count FROM users WHERE user_id = ?
-            """, (user_id,))
-            row = await cursor.fetchone()
-            earnings = row[0] if row else 0.0
-            count = row[1] if row else 0
-            
-            # Get recent referrals
+            cursor = await db.execute("UPDATE bonus_campaigns SET is_active = 0 WHERE id = ?", (campaign_id,))
+            await db.commit()
+        await load_bonus_campaigns()
+        return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error ending bonus campaign {campaign_id}: {e}")
+        return False
+
+async def campaign_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /campaign [add <type> <name> key=value ... | end <id>] (admin only)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    args = context.args
+    if len(args) >= 3 and args[0] == "add":
+        options = dict(arg.split("=", 1) for arg in args[3:] if "=" in arg)
+        error = await create_bonus_campaign(args[1], args[2].replace("_", " "), options)
+        await update.message.reply_text(f"❌ {error}" if error else "✅ Campaign created.")
+        return
+    if len(args) == 2 and args[0] == "end" and args[1].isdigit():
+        ended = await end_bonus_campaign(int(args[1]))
+        await update.message.reply_text("✅ Campaign ended." if ended else "❌ Campaign not found.")
+        return
+    
+    lines = [f"#{c.campaign_id} {c.type} <b>{html.escape(c.name)}</b>\n    {describe_campaign(c)}" for c in _campaigns.values()]
+    await update.message.reply_text(
+        "<b>Bonus campaigns</b>\n\n" + ("\n".join(lines) or "No active campaigns.") + "\n\n"
+        "Usage:\n/campaign add &lt;type&gt; &lt;name&gt; percentage= amount= min_deposit= max_bonus= "
+        "wagering= games=slots,dice days= limit= spins=\n/campaign end &lt;id&gt;",
+        parse_mode=ParseMode.HTML
+    )
+
+# --- House Balance System ---
+
+async def get_house_balance() -> dict:
+    """Get current house balance data"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
-                SELECT r.referee_id, u.username, r.created_at, r.bonus_paid
-                FROM referrals r
-                JOIN users u ON r.referee_id = u.user_id
-                WHERE r.referrer_id = ?
-                ORDER BY r.created_at DESC
-                LIMIT 10
-            """, (user_id,))
-            recent_refs = await cursor.fetchall()
+                SELECT * FROM house_balance WHERE id = 1
+            """)
+            result = await cursor.fetchone()
             
-            return {
-                'earnings': earnings,
-                'count': count,
-                'recent': [{'user_id': r[0], 'username': r[1], 'date': r[2], 'bonus': r[3]} for r in recent_refs]
-            }
+            if result:
+                return dict(result)
+            else:
+                # Initialize if not exists
+                await db.execute("""
+                    INSERT INTO house_balance (id, balance) VALUES (1, ?)
+                """, (HOUSE_OPENING_BALANCE,))
+                await db.commit()
+                return {
+                    'id': 1,
+                    'balance': HOUSE_OPENING_BALANCE,
+                    'total_player_losses': 0,
+                    'total_player_wins': 0,
+                    'total_deposits': 0,
+                    'total_withdrawals': 0,
+                    'last_updated': datetime.now().isoformat()
+                }
+                
     except Exception as e:
-        logger.error(f"Error getting referral stats: {e}")
-        return {'earnings': 0.0, 'count': 0, 'recent': []}
+        logger.error(f"Error getting house balance: {e}")
+        return {
+            'balance': HOUSE_OPENING_BALANCE,
+            'total_player_losses': 0,
+            'total_player_wins': 0,
+            'total_deposits': 0,
+            'total_withdrawals': 0
+        }
 
-async def process_referral(referee_id: int, referral_code: str) -> bool:
-    """Process a new referral when user registers with a code."""
+@traced()
+@observe_latency(DB_OPERATION_SECONDS, "update_house_balance_on_game")
+async def update_house_balance_on_game(bet_amount: int, win_amount: int) -> bool:
+    """Update house balance based on game outcome"""
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Find referrer by code
-            cursor = await db.execute("SELECT user_id FROM users WHERE referral_code = ?", (referral_code,))
-            row = await cursor.fetchone()
-            if not row:
-                return False
-            
-            referrer_id = row[0]
-            if referrer_id == referee_id:
-                return False  # Can't refer yourself
+            # Calculate house profit/loss
+            house_change = bet_amount - win_amount  # Positive = house wins, Negative = house loses
             
-            # Check if referee was already referred
-            cursor = await db.execute("SELECT referred_by FROM users WHERE user_id = ?", (referee_id,))
-            row = await cursor.fetchone()
-            if row and row[0]:
-                return False  # Already referred
+            await db.execute("""
+                UPDATE house_balance 
+                SET balance = balance + ?,
+                    total_player_losses = total_player_losses + ?,
+                    total_player_wins = total_player_wins + ?,
+                    last_updated = ?
+                WHERE id = 1
+            """, (house_change, bet_amount, win_amount, datetime.now().isoformat()))
             
-            # Update referee with referrer info
-            await db.execute("UPDATE users SET referred_by = ? WHERE user_id = ?", (referral_code, referee_id))
+            await commit_timed(db, "update_house_balance_on_game")
+            logger.debug("House balance updated: %+d micros (bet: %s, win: %s)", house_change, bet_amount, win_amount)
+            return True
             
-            # Create referral record
+    except Exception as e:
+        logger.error(f"Error updating house balance on game: {e}")
+        return False
+
+async def update_house_balance_on_deposit(amount: int) -> bool:
+    """Update house balance when user deposits (house gains funds)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
             await db.execute("""
-                INSERT INTO referrals (referrer_id, referee_id, referral_code, status)
-                VALUES (?, ?, ?, 'active')
-            """, (referrer_id, referee_id, referral_code))
+                UPDATE house_balance 
+                SET balance = balance + ?,
+                    total_deposits = total_deposits + ?,
+                    last_updated = ?
+                WHERE id = 1
+            """, (amount, amount, datetime.now().isoformat()))
             
-            # Update referrer stats
+            await db.commit()
+            logger.debug("House balance increased by deposit: +%d micros", amount)
+            return True
+            
+    except Exception as e:
+        logger.error(f"Error updating house balance on deposit: {e}")
+        return False
+
+async def update_house_balance_on_withdrawal(amount: int) -> bool:
+    """Update house balance when user withdraws (house loses funds)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
             await db.execute("""
-                UPDATE users 
-                SET referral_count = referral_count + 1
-                WHERE user_id = ?
-            """, (referrer_id,))
+                UPDATE house_balance 
+                SET balance = balance - ?,
+                    total_withdrawals = total_withdrawals + ?,
+                    last_updated = ?
+                WHERE id = 1
+            """, (amount, amount, datetime.now().isoformat()))
             
             await db.commit()
-            logger.info(f"Referral processed: {referee_id} referred by {referrer_id} using code {referral_code}")
+            logger.debug("House balance decreased by withdrawal: -%d micros", amount)
             return True
+            
     except Exception as e:
-        logger.error(f"Error processing referral: {e}")
+        logger.error(f"Error updating house balance on withdrawal: {e}")
+        return False
+
+async def get_house_profit_loss() -> dict:
+    """Calculate house profit/loss statistics"""
+    try:
+        house_data = await get_house_balance()
+        
+        total_in = house_data.get('total_deposits', 0)
+        total_out = house_data.get('total_withdrawals', 0) + house_data.get('total_player_wins', 0)
+        total_received = house_data.get('total_player_losses', 0)
+        
+        net_profit = total_received + total_in - total_out
+        house_edge = (total_received / (total_received + house_data.get('total_player_wins', 0))) * 100 if (total_received + house_data.get('total_player_wins', 0)) > 0 else 0
+        
+        return {
+            'current_balance': house_data.get('balance', 0),
+            'total_deposits': total_in,
+            'total_withdrawals': house_data.get('total_withdrawals', 0),
+            'total_player_losses': total_received,
+            'total_player_wins': house_data.get('total_player_wins', 0),
+            'net_profit': net_profit,
+            'house_edge_percent': house_edge
+        }
+        
+    except Exception as e:
+        logger.error(f"Error calculating house profit/loss: {e}")
+        return {
+            'current_balance': 0,
+            'total_deposits': 0,
+            'total_withdrawals': 0,
+            'total_player_losses': 0,
+            'total_player_wins': 0,
+            'net_profit': 0,
+            'house_edge_percent': 0.0
+        }
+
+async def update_balance_with_house(user_id: int, bet_amount: int, win_amount: int) -> bool:
+    """Update user balance and house balance for game outcomes"""
+    try:
+        # Update user balance with net result
+        net_result = win_amount - bet_amount
+        user_updated = await update_balance(user_id, net_result, "game")
+        
+        # Update house balance
+        house_updated = await update_house_balance_on_game(bet_amount, win_amount)
+        
+        return user_updated and house_updated
+        
+    except Exception as e:
+        logger.error(f"Error updating balances for game: {e}")
+        return False
+
+async def deduct_balance_with_house(user_id: int, bet_amount: int) -> bool:
+    """Deduct balance for game bet and update house balance"""
+    try:
+        # Deduct from user
+        user_updated = await deduct_balance(user_id, bet_amount, "bet")
+        
+        if user_updated:
+            # Update house balance (house gains the bet amount, user wins 0)
+            house_updated = await update_house_balance_on_game(bet_amount, 0)
+            return house_updated
+        
+        return False
+        
+    except Exception as e:
+        logger.error(f"Error deducting balance with house update: {e}")
         return False
 
-async def process_referral_commission(referee_id: int, loss_amount: float) -> bool:
-    """Give referrer 20% commission on referee's loss."""
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            # Check if user was referred
-            cursor = await db.execute("SELECT referred_by FROM users WHERE user_id = ?", (referee_id,))
-            row = await cursor.fetchone()
-            if not row or not row[0]:
-                return False  # Not referred by anyone
-            
-            referral_code = row[0]
-            
-            # Find referrer
-            cursor = await db.execute("SELECT user_id FROM users WHERE referral_code = ?", (referral_code,))
-            row = await cursor.fetchone()
-            if not row:
-                return False
-            
-            referrer_id = row[0]
-            
-            # Calculate commission (20% of loss)
-            commission = loss_amount * REFERRAL_COMMISSION_PERCENT
-            
-            if commission <= 0:
-                return False
-            
-            # Give commission to referrer
-            await update_balance(referrer_id, commission)
-            
-            # Update referrer's total earnings
-            await db.execute("""
-                UPDATE users 
-                SET referral_earnings = referral_earnings + ?
-                WHERE user_id = ?
-            """, (commission, referrer_id))
-            
-            # Update referral record
-            await db.execute("""
-                UPDATE referrals 
-                SET bonus_paid = bonus_paid + ?,
-                    total_referee_wagered = total_referee_wagered + ?
-                WHERE referee_id = ?
-            """, (commission, loss_amount, referee_id))
-            
-            await db.commit()
-            logger.info(f"Referral commission: ${commission:.2f} to user {referrer_id} from referee {referee_id}'s loss of ${loss_amount:.2f}")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Error processing referral commission: {e}")
-        return False
+# --- Deposit/Withdrawal House Balance Integration ---
+
+async def process_deposit_with_house_balance(user_id: int, amount: int) -> bool:
+    """Process a user deposit and update house balance"""
+    try:
+        # Update user balance
+        user_updated = await update_balance(user_id, amount, "deposit")
+        
+        if user_updated:
+            # Update house balance (house gains funds from deposit)
+            house_updated = await update_house_balance_on_deposit(amount)
+            return house_updated
+        
+        return False
+        
+    except Exception as e:
+        logger.error(f"Error processing deposit with house balance: {e}")
+        return False
+
+async def process_withdrawal_with_house_balance(user_id: int, amount: int) -> bool:
+    """Process a user withdrawal and update house balance"""
+    try:
+        # Deduct balance from user
+        user_updated = await deduct_balance(user_id, amount, "withdrawal")
+        
+        if user_updated:
+            # Update house balance (house loses funds from withdrawal)
+            house_updated = await update_house_balance_on_withdrawal(amount)
+            return house_updated
+        
+        return False
+        
+    except Exception as e:
+        logger.error(f"Error processing withdrawal with house balance: {e}")
+        return False
+
+# --- House Balance Display Helper ---
+
+async def get_house_balance_display() -> str:
+    """Get formatted house balance information for owner panel"""
+    try:
+        house_stats = await get_house_profit_loss()
+        
+        balance_str = format_usd(house_stats['current_balance'])
+        deposits_str = format_usd(house_stats['total_deposits'])
+        withdrawals_str = format_usd(house_stats['total_withdrawals'])
+        player_losses_str = format_usd(house_stats['total_player_losses'])
+        player_wins_str = format_usd(house_stats['total_player_wins'])
+        net_profit_str = format_usd(house_stats['net_profit'])
+        house_edge = house_stats['house_edge_percent']
+        
+        profit_emoji = "📈" if house_stats['net_profit'] >= 0 else "📉"
+        
+        return f"""
+🏦 <b>HOUSE BALANCE</b> 🏦
+
+💰 <b>Current Balance:</b> {balance_str}
+{profit_emoji} <b>Net Profit:</b> {net_profit_str}
+🎯 <b>House Edge:</b> {house_edge:.2f}%
+
+💳 <b>Deposits:</b> {deposits_str}
+🏦 <b>Withdrawals:</b> {withdrawals_str}
+📉 <b>Paid to Players:</b> {player_wins_str}
+📈 <b>From Players:</b> {player_losses_str}
+
+<i>Real-time casino financial tracking</i>
+"""
+        
+    except Exception as e:
+        logger.error(f"Error getting house balance display: {e}")
+        return "❌ <b>House Balance:</b> Unable to load data"
+
+# --- Weekly Bonus Helpers ---
+# A claim is one conditional UPDATE that credits and stamps last_weekly_bonus together, so
+# concurrent taps cannot both succeed. Next-eligible times are cached per player (recent
+# claimers are loaded at startup) and the bonus screen renders from the cache.
+WEEKLY_BONUS_AMOUNT = to_micros(os.environ.get("WEEKLY_BONUS_AMOUNT", "5.0"))
+WEEKLY_BONUS_INTERVAL = 7  # days
+
+_weekly_bonus_next: Dict[int, datetime] = {}  # user_id -> when the next claim opens
+
+# --- Referral System Configuration ---
+REFERRAL_COMMISSION_BPS = round(float(os.environ.get("REFERRAL_COMMISSION_PERCENT", "0.20")) * BPS)  # 20% commission on referee losses
+REFERRAL_BONUS_REFEREE = to_micros(os.environ.get("REFERRAL_BONUS_REFEREE", "5.0"))    # Welcome bonus for new user
+MAX_REFERRALS_PER_USER = int(os.environ.get("MAX_REFERRALS_PER_USER", "1000"))       # Max referrals per user
+REFERRAL_PAYOUT_MODE = os.environ.get("REFERRAL_PAYOUT_MODE", "batched").lower()        # "instant" credits every commission as it is earned
+REFERRAL_PAYOUT_INTERVAL_SECONDS = int(os.environ.get("REFERRAL_PAYOUT_INTERVAL_SECONDS", "3600"))  # batched mode settlement period
+
+async def ensure_weekly_bonus_column():
+    """Ensure weekly bonus column exists in users table"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("ALTER TABLE users ADD COLUMN last_weekly_bonus TEXT DEFAULT NULL")
+            await db.commit()
+    except Exception:
+        pass  # Column already exists
+
+async def ensure_referral_columns():
+    """Ensure referral system columns exist"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            # Add referral columns to users table
+            await db.execute("ALTER TABLE users ADD COLUMN referral_code TEXT DEFAULT NULL")
+            await db.execute("ALTER TABLE users ADD COLUMN referred_by TEXT DEFAULT NULL")
+            await db.execute("ALTER TABLE users ADD COLUMN referral_earnings INTEGER DEFAULT 0")
+            await db.execute("ALTER TABLE users ADD COLUMN referral_count INTEGER DEFAULT 0")
+            
+            # Create referrals table if it doesn't exist
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS referrals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    referrer_id INTEGER NOT NULL,
+                    referee_id INTEGER NOT NULL,
+                    referral_code TEXT NOT NULL,
+                    commission_earned INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    activated_at TIMESTAMP DEFAULT NULL,
+                    FOREIGN KEY (referrer_id) REFERENCES users (user_id),
+                    FOREIGN KEY (referee_id) REFERENCES users (user_id)
+                )
+            """)
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error ensuring referral columns: {e}")
+
+async def load_weekly_bonus_claims() -> int:
+    """Cache next-eligible times for players who claimed within the interval; returns the count"""
+    try:
+        cutoff = (datetime.now() - timedelta(days=WEEKLY_BONUS_INTERVAL)).isoformat()
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                SELECT user_id, last_weekly_bonus FROM users WHERE last_weekly_bonus > ?
+            """, (cutoff,))
+            rows = await cursor.fetchall()
+        _weekly_bonus_next.clear()
+        for user_id, last_claim in rows:
+            _weekly_bonus_next[user_id] = datetime.fromisoformat(last_claim) + timedelta(days=WEEKLY_BONUS_INTERVAL)
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error loading weekly bonus claims: {e}")
+        return 0
+
+def can_claim_weekly_bonus(user_id: int) -> Tuple[bool, Optional[int]]:
+    """Check if user can claim weekly bonus. Returns (can_claim, seconds_remaining)."""
+    next_claim = _weekly_bonus_next.get(user_id)
+    if next_claim is None:
+        return True, None
+    seconds_remaining = int((next_claim - datetime.now()).total_seconds())
+    if seconds_remaining <= 0:
+        del _weekly_bonus_next[user_id]
+        return True, None
+    return False, seconds_remaining
+
+async def claim_weekly_bonus(user_id: int) -> Optional[int]:
+    """Credit the weekly bonus if the interval has passed; returns the new balance or None"""
+    try:
+        now = datetime.now()
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                UPDATE users
+                SET balance = balance + ?, ledger_seq = ledger_seq + 1, last_weekly_bonus = ?
+                WHERE user_id = ? AND (last_weekly_bonus IS NULL OR last_weekly_bonus <= ?)
+                RETURNING balance, ledger_seq
+            """, (WEEKLY_BONUS_AMOUNT, now.isoformat(), user_id,
+                  (now - timedelta(days=WEEKLY_BONUS_INTERVAL)).isoformat()))
+            row = await cursor.fetchone()
+            await cursor.close()
+            if row is None:
+                # Already claimed (or no such user): resync the cached time from the stored stamp
+                cursor = await db.execute("SELECT last_weekly_bonus FROM users WHERE user_id = ?", (user_id,))
+                stamp = await cursor.fetchone()
+                if stamp and stamp[0]:
+                    _weekly_bonus_next[user_id] = datetime.fromisoformat(stamp[0]) + timedelta(days=WEEKLY_BONUS_INTERVAL)
+                return None
+            await append_ledger_legs(db, user_id, WEEKLY_BONUS_AMOUNT, "bonus", "weekly", row[0], row[1], now.isoformat())
+            await commit_timed(db, "claim_weekly_bonus")
+        _weekly_bonus_next[user_id] = now + timedelta(days=WEEKLY_BONUS_INTERVAL)
+        return row[0]
+    except Exception as e:
+        logger.error(f"Error claiming weekly bonus: {e}")
+        return None
+
+# --- Referral System Helpers ---
+# The referee -> referrer graph is cached in memory so bets by players who were not referred
+# cost nothing here; it is loaded at startup and extended by process_referral.
+_referrer_of: Dict[int, int] = {}
+
+async def load_referral_graph() -> int:
+    """Load every referee -> referrer pair; returns the number of referred users"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                SELECT u.user_id, r.user_id FROM users u
+                JOIN users r ON r.referral_code = u.referred_by
+                WHERE u.referred_by IS NOT NULL AND r.user_id != u.user_id
+            """)
+            graph = dict(await cursor.fetchall())
+        _referrer_of.clear()
+        _referrer_of.update(graph)
+        logger.info(f"Referral graph loaded: {len(graph)} referred users")
+        return len(graph)
+    except Exception as e:
+        logger.error(f"Error loading referral graph: {e}")
+        return 0
+
+def generate_referral_code(user_id: int) -> str:
+    """Generate a unique referral code for a user."""
+    import time
+    import random
+    import hashlib
+    
+    # Create a base from user_id and current timestamp
+    base = f"{user_id}_{int(time.time())}_{random.randint(1000, 9999)}"
+    hash_obj = hashlib.md5(base.encode())
+    
+    # Take first 8 characters and make it alphanumeric
+    code = hash_obj.hexdigest()[:6].upper()
+    return f"REF{code}"
+
+@traced()
+async def get_or_create_referral_code(user_id: int) -> str:
+    """Get existing referral code or create a new one."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("SELECT referral_code FROM users WHERE user_id = ?", (user_id,))
+            row = await cursor.fetchone()
+            if row and row[0]:
+                return row[0]
+            
+            # Create new code; the unique index rejects the rare collision, so retry with a fresh one
+            for _ in range(5):
+                code = generate_referral_code(user_id)
+                try:
+                    await db.execute("UPDATE users SET referral_code = ? WHERE user_id = ?", (code, user_id))
+                except sqlite3.IntegrityError:
+                    continue
+                await db.commit()
+                return code
+            raise RuntimeError("could not generate an unused referral code")
+    except Exception as e:
+        logger.error(f"Error getting/creating referral code: {e}")
+        return generate_referral_code(user_id)
+
+async def get_referral_stats(user_id: int) -> dict:
+    """Get referral statistics for a user."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            # Get user's referral data
+            cursor = await db.execute("""
+                SELECT referral_earnings, referral_count FROM users WHERE user_id = ?
+            """, (user_id,))
+            row = await cursor.fetchone()
+            earnings = row[0] if row else 0
+            count = row[1] if row else 0
+            
+            # Commission waiting for the next batched payout
+            cursor = await db.execute("""
+                SELECT COALESCE(SUM(pending), 0) FROM referral_accruals WHERE referrer_id = ?
+            """, (user_id,))
+            pending = (await cursor.fetchone())[0]
+            
+            # Get recent referrals
+            cursor = await db.execute("""
+                SELECT r.referee_id, u.username, r.created_at, r.commission_earned
+                FROM referrals r
+                JOIN users u ON r.referee_id = u.user_id
+                WHERE r.referrer_id = ?
+                ORDER BY r.created_at DESC
+                LIMIT 10
+            """, (user_id,))
+            recent_refs = await cursor.fetchall()
+            
+            return {
+                'earnings': earnings,
+                'pending': pending,
+                'count': count,
+                'recent': [{'user_id': r[0], 'username': r[1], 'date': r[2], 'bonus': r[3]} for r in recent_refs]
+            }
+    except Exception as e:
+        logger.error(f"Error getting referral stats: {e}")
+        return {'earnings': 0, 'pending': 0, 'count': 0, 'recent': []}
+
+async def process_referral(referee_id: int, referral_code: str) -> bool:
+    """Process a new referral when user registers with a code."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            # Find referrer by code
+            cursor = await db.execute("SELECT user_id FROM users WHERE referral_code = ?", (referral_code,))
+            row = await cursor.fetchone()
+            if not row:
+                return False
+            
+            referrer_id = row[0]
+            if referrer_id == referee_id:
+                return False  # Can't refer yourself
+            
+            # Check if referee was already referred
+            cursor = await db.execute("SELECT referred_by FROM users WHERE user_id = ?", (referee_id,))
+            row = await cursor.fetchone()
+            if row and row[0]:
+                return False  # Already referred
+            
+            # Update referee with referrer info
+            await db.execute("UPDATE users SET referred_by = ? WHERE user_id = ?", (referral_code, referee_id))
+            
+            # Create referral record
+            await db.execute("""
+                INSERT INTO referrals (referrer_id, referee_id, referral_code, status)
+                VALUES (?, ?, ?, 'active')
+            """, (referrer_id, referee_id, referral_code))
+            
+            # Update referrer stats
+            cursor = await db.execute("""
+                UPDATE users 
+                SET referral_count = referral_count + 1
+                WHERE user_id = ?
+                RETURNING referral_count
+            """, (referrer_id,))
+            referral_count = (await cursor.fetchone())[0]
+            await cursor.close()
+            
+            await db.commit()
+            _referrer_of[referee_id] = referrer_id
+            emit("referral_joined", user_id=referrer_id, referee_id=referee_id, referral_count=referral_count)
+            logger.info(f"Referral processed: {referee_id} referred by {referrer_id} using code {referral_code}")
+            return True
+    except Exception as e:
+        logger.error(f"Error processing referral: {e}")
+        return False
+
+async def accrue_referral_commission(db, referee_id: int, loss_amount: int) -> Optional[Tuple[int, int]]:
+    """
+    Earn the referrer's commission on a referee's loss inside the caller's transaction.
+    In batched mode it is staged in referral_accruals (a row per referee, so popular referrers
+    see no per-bet writes) until settle_referral_commissions pays it; in instant mode it is
+    credited now. Returns (referrer_id, commission), or None when nothing is owed; the caller
+    commits and then calls record_referral_commission.
+    """
+    referrer_id = _referrer_of.get(referee_id)
+    if referrer_id is None:
+        return None  # Not referred by anyone
+    
+    commission = apply_bps(loss_amount, REFERRAL_COMMISSION_BPS)
+    if commission <= 0:
+        return None
+    
+    if REFERRAL_PAYOUT_MODE != "instant":
+        await db.execute("""
+            INSERT INTO referral_accruals (referee_id, referrer_id, pending, losses, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(referee_id) DO UPDATE SET
+                pending = pending + excluded.pending,
+                losses = losses + excluded.losses,
+                updated_at = excluded.updated_at
+        """, (referee_id, referrer_id, commission, loss_amount, datetime.now().isoformat()))
+        return referrer_id, commission
+    
+    if await post_ledger(db, referrer_id, commission, "referral_commission", str(referee_id)) is None:
+        return None
+    
+    # Update referrer's total earnings
+    await db.execute("""
+        UPDATE users 
+        SET referral_earnings = referral_earnings + ?
+        WHERE user_id = ?
+    """, (commission, referrer_id))
+    
+    # Update referral record
+    await db.execute("""
+        UPDATE referrals 
+        SET commission_earned = commission_earned + ?,
+            total_referee_wagered = total_referee_wagered + ?
+        WHERE referee_id = ?
+    """, (commission, loss_amount, referee_id))
+    return referrer_id, commission
+
+def record_referral_commission(referee_id: int, referrer_id: int, commission: int, loss_amount: int) -> None:
+    """Post-commit bookkeeping for an earned commission"""
+    if REFERRAL_PAYOUT_MODE == "instant":
+        LEADERBOARDS["referrers"].record(referrer_id, commission)
+    referrals_logger.info("Referral commission %s: %s to user %s from referee %s's loss of %s",
+                          "paid" if REFERRAL_PAYOUT_MODE == "instant" else "accrued",
+                          format_money(commission), referrer_id, referee_id, format_money(loss_amount))
+
+_referral_payout_lock = asyncio.Lock()
+_referral_payout_task: Optional[asyncio.Task] = None
+
+async def settle_referral_commissions() -> int:
+    """
+    Pay every staged commission in one transaction: one ledger credit and earnings update per
+    referrer, then the per-referee totals. Returns the number of referrers paid.
+    """
+    async with _referral_payout_lock:
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                cursor = await db.execute("""
+                    SELECT referee_id, referrer_id, pending, losses FROM referral_accruals
+                    WHERE pending > 0 OR losses > 0
+                """)
+                rows = await cursor.fetchall()
+                if not rows:
+                    return 0
+                
+                totals: Dict[int, int] = {}
+                for _, referrer_id, pending, _ in rows:
+                    totals[referrer_id] = totals.get(referrer_id, 0) + pending
+                paid = {}
+                for referrer_id, amount in totals.items():
+                    if amount > 0 and await post_ledger(db, referrer_id, amount, "referral_commission", "payout") is None:
+                        logger.error(f"Referral payout skipped: referrer {referrer_id} not found")
+                        continue
+                    paid[referrer_id] = amount
+                rows = [row for row in rows if row[1] in paid]
+                
+                await db.executemany("UPDATE users SET referral_earnings = referral_earnings + ? WHERE user_id = ?",
+                                     [(amount, referrer_id) for referrer_id, amount in paid.items()])
+                await db.executemany("""
+                    UPDATE referrals 
+                    SET commission_earned = commission_earned + ?,
+                        total_referee_wagered = total_referee_wagered + ?
+                    WHERE referee_id = ?
+                """, [(pending, losses, referee_id) for referee_id, _, pending, losses in rows])
+                # Subtract what was paid; bets settled meanwhile stay staged for the next run
+                await db.executemany("""
+                    UPDATE referral_accruals SET pending = pending - ?, losses = losses - ? WHERE referee_id = ?
+                """, [(pending, losses, referee_id) for referee_id, _, pending, losses in rows])
+                await db.execute("DELETE FROM referral_accruals WHERE pending <= 0 AND losses <= 0")
+                await commit_timed(db, "settle_referral_commissions")
+        except Exception as e:
+            logger.error(f"Error settling referral commissions: {e}")
+            return 0
+    
+    for referrer_id, amount in paid.items():
+        LEADERBOARDS["referrers"].record(referrer_id, amount)
+    referrals_logger.info("Referral payout: %s to %d referrer(s) from %d referee(s)",
+                          format_money(sum(paid.values())), len(paid), len(rows))
+    return len(paid)
+
+async def referral_payout_loop():
+    """Settle staged commissions every REFERRAL_PAYOUT_INTERVAL_SECONDS"""
+    while True:
+        await asyncio.sleep(REFERRAL_PAYOUT_INTERVAL_SECONDS)
+        await settle_referral_commissions()
+
+def start_referral_payouts() -> None:
+    """Launch the batched referral payout job (instant mode needs none)"""
+    global _referral_payout_task
+    if REFERRAL_PAYOUT_MODE != "instant" and _referral_payout_task is None:
+        _referral_payout_task = asyncio.create_task(referral_payout_loop())
+
+def get_referral_link(bot_username: str, referral_code: str) -> str:
+    """Generate referral deep link."""
+    return f"https://t.me/{bot_username}?start={referral_code}"
+
+# --- Broadcast & Notification System ---
+BROADCAST_RATE_PER_SECOND = float(os.environ.get("BROADCAST_RATE_PER_SECOND", "25"))  # Telegram allows ~30 msg/s per bot
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "8"))
+BROADCAST_PAGE_SIZE = int(os.environ.get("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_MAX_RETRIES = 3  # sends retried after flood control, on top of the first attempt
+
+# Set once the Telegram application is built so background jobs can send messages
+bot_application: Optional[Application] = None
+
+class AsyncRateLimiter:
+    """Spaces out acquisitions so that at most `rate` calls start per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every acquisition back for `seconds` (Telegram flood control applies per bot)"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+# Shared by broadcasts and one-off notifications so together they stay under the bot limit
+outbound_limiter = AsyncRateLimiter(BROADCAST_RATE_PER_SECOND)
+
+# Running broadcast jobs keyed by broadcast_id
+_broadcast_tasks: Dict[int, asyncio.Task] = {}
+
+# Queues of background workers, reported by the readiness probe
+background_queues: Dict[str, asyncio.Queue] = {}
+
+async def send_user_message(user_id: int, text: str) -> str:
+    """Send a rate-limited message to a user. Returns 'sent', 'blocked' or 'failed'."""
+    if bot_application is None:
+        logger.warning(f"Bot not running - message to user {user_id} dropped")
+        return "failed"
+    
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        await outbound_limiter.acquire()
+        try:
+            await bot_application.bot.send_message(
+                chat_id=user_id, text=text, parse_mode=ParseMode.HTML, disable_web_page_preview=True
+            )
+            return "sent"
+        except RetryAfter as e:
+            # Flood control: every sender backs off for the requested time, then this one retries
+            outbound_limiter.pause(float(e.retry_after))
+            logger.warning(f"Flood limit hit, pausing sends for {e.retry_after}s "
+                           f"(attempt {attempt + 1}/{BROADCAST_MAX_RETRIES + 1})")
+        except Forbidden:
+            return "blocked"  # User blocked the bot or deactivated the account
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "blocked"
+            logger.error(f"Bad request sending message to {user_id}: {e}")
+            return "failed"
+        except TelegramError as e:
+            logger.error(f"Error sending message to {user_id}: {e}")
+            return "failed"
+    return "failed"
+
+async def notify_user(user_id: int, text: str) -> bool:
+    """Send a single notification (deposit confirmations, alerts) to a user."""
+    return await send_user_message(user_id, text) == "sent"
+
+async def notify_admins(text: str) -> int:
+    """Send an alert to the owner and every admin; returns how many were delivered"""
+    recipients = {OWNER_USER_ID, *ADMIN_USER_IDS} - {0}
+    delivered = 0
+    for admin_id in sorted(recipients):
+        if await notify_user(admin_id, text):
+            delivered += 1
+    return delivered
+
+async def create_broadcast(message: str, admin_id: int) -> int:
+    """Store a new broadcast and return its ID"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                INSERT INTO broadcasts (message, created_by, status, created_at, updated_at)
+                VALUES (?, ?, 'pending', ?, ?)
+            """, (message, admin_id, datetime.now().isoformat(), datetime.now().isoformat()))
+            await db.commit()
+            return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"Error creating broadcast: {e}")
+        return 0
+
+async def get_broadcast(broadcast_id: int) -> Optional[dict]:
+    """Get broadcast progress and delivery statistics"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error getting broadcast {broadcast_id}: {e}")
+        return None
+
+async def _broadcast_worker(queue: asyncio.Queue, message: str, outcomes: Dict[int, str]):
+    """Deliver queued recipients until cancelled, recording each outcome by user_id"""
+    while True:
+        user_id = await queue.get()
+        try:
+            outcomes[user_id] = await send_user_message(user_id, message)
+        except Exception as e:
+            logger.error(f"Broadcast worker error for user {user_id}: {e}")
+            outcomes[user_id] = "failed"
+        finally:
+            queue.task_done()
+
+async def _checkpoint_broadcast(db, broadcast_id: int, page: List[int], outcomes: Dict[int, str],
+                                last_user_id: int) -> int:
+    """Commit the stats of the attempted run at the start of the page; returns the new last_user_id.
+    
+    Workers finish slightly out of order, so only the leading recipients that all have an
+    outcome are checkpointed; the rest are sent again on resume.
+    """
+    stats = {"sent": 0, "failed": 0, "blocked": 0}
+    for user_id in page:
+        if user_id <= last_user_id:
+            continue
+        if user_id not in outcomes:
+            break
+        stats[outcomes.pop(user_id)] += 1
+        last_user_id = user_id
+    await db.execute("""
+        UPDATE broadcasts
+        SET last_user_id = ?, total_sent = total_sent + ?, total_failed = total_failed + ?,
+            total_blocked = total_blocked + ?, updated_at = ?
+        WHERE broadcast_id = ?
+    """, (last_user_id, stats["sent"], stats["failed"], stats["blocked"], datetime.now().isoformat(), broadcast_id))
+    await db.commit()
+    return last_user_id
+
+async def run_broadcast(broadcast_id: int):
+    """
+    Deliver a broadcast to every active user.
+    Recipients are streamed page by page with keyset pagination on user_id, and the
+    checkpoint is committed after each page, so a restart resumes from the last page.
+    A cancelled run checkpoints the recipients it got through before stopping.
+    """
+    broadcast = await get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] in ('completed', 'cancelled'):
+        return
+    
+    message = broadcast['message']
+    last_user_id = broadcast['last_user_id'] or 0
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_WORKERS * 2)
+    outcomes: Dict[int, str] = {}
+    page: List[int] = []
+    workers = [asyncio.create_task(_broadcast_worker(queue, message, outcomes)) for _ in range(BROADCAST_WORKERS)]
+    background_queues[f"broadcast_{broadcast_id}"] = queue
+    
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("""
+                UPDATE broadcasts SET status = 'running', started_at = COALESCE(started_at, ?), updated_at = ?
+                WHERE broadcast_id = ?
+            """, (datetime.now().isoformat(), datetime.now().isoformat(), broadcast_id))
+            await db.commit()
+            logger.info(f"📣 Broadcast {broadcast_id} running from user_id > {last_user_id}")
+            
+            while True:
+                cursor = await db.execute("""
+                    SELECT user_id FROM users
+                    WHERE user_id > ? AND COALESCE(is_banned, 0) = 0
+                    ORDER BY user_id
+                    LIMIT ?
+                """, (last_user_id, BROADCAST_PAGE_SIZE))
+                page = [row[0] for row in await cursor.fetchall()]
+                if not page:
+                    break
+                
+                for user_id in page:
+                    await queue.put(user_id)
+                await queue.join()
+                
+                # Checkpoint: everything up to the end of this page has been attempted
+                last_user_id = await _checkpoint_broadcast(db, broadcast_id, page, outcomes, last_user_id)
+            
+            await db.execute("""
+                UPDATE broadcasts SET status = 'completed', completed_at = ?, updated_at = ?
+                WHERE broadcast_id = ? AND status = 'running'
+            """, (datetime.now().isoformat(), datetime.now().isoformat(), broadcast_id))
+            await db.commit()
+            logger.info(f"✅ Broadcast {broadcast_id} completed")
+            
+    except asyncio.CancelledError:
+        # Stop sending before recording what this page delivered so far
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                last_user_id = await _checkpoint_broadcast(db, broadcast_id, page, outcomes, last_user_id)
+        except Exception as e:
+            logger.error(f"Error checkpointing broadcast {broadcast_id}: {e}")
+        logger.info(f"Broadcast {broadcast_id} paused at user_id {last_user_id}")
+        raise
+    except Exception as e:
+        logger.error(f"Error running broadcast {broadcast_id}: {e}")
+    finally:
+        for worker in workers:
+            worker.cancel()
+        background_queues.pop(f"broadcast_{broadcast_id}", None)
+        _broadcast_tasks.pop(broadcast_id, None)
+
+def start_broadcast(broadcast_id: int) -> None:
+    """Launch a broadcast job in the background"""
+    if broadcast_id in _broadcast_tasks:
+        return
+    _broadcast_tasks[broadcast_id] = asyncio.create_task(run_broadcast(broadcast_id))
+
+async def cancel_broadcast(broadcast_id: int) -> bool:
+    """Stop a broadcast; it will not be resumed on restart"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                UPDATE broadcasts SET status = 'cancelled', updated_at = ?
+                WHERE broadcast_id = ? AND status IN ('pending', 'running')
+            """, (datetime.now().isoformat(), broadcast_id))
+            await db.commit()
+            cancelled = cursor.rowcount > 0
+        task = _broadcast_tasks.pop(broadcast_id, None)
+        if task:
+            task.cancel()
+        return cancelled
+    except Exception as e:
+        logger.error(f"Error cancelling broadcast {broadcast_id}: {e}")
+        return False
+
+async def resume_broadcasts():
+    """Resume broadcasts interrupted by a restart"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("""
+                SELECT broadcast_id FROM broadcasts WHERE status IN ('pending', 'running') ORDER BY broadcast_id
+            """)
+            rows = await cursor.fetchall()
+        for row in rows:
+            logger.info(f"Resuming broadcast {row[0]}")
+            start_broadcast(row[0])
+    except Exception as e:
+        logger.error(f"Error resuming broadcasts: {e}")
+
+async def broadcast_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast <message> (admin only)"""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        return
+    
+    message = update.message.text.partition(" ")[2].strip()
+    if not message:
+        await update.message.reply_text(
+            "Usage: /broadcast <message>\n\nHTML formatting is supported.\n"
+            "Check progress with /broadcast_status <id>, stop with /broadcast_cancel <id>."
+        )
+        return
+    
+    broadcast_id = await create_broadcast(message, user_id)
+    if not broadcast_id:
+        await update.message.reply_text("❌ Error creating broadcast.")
+        return
+    
+    start_broadcast(broadcast_id)
+    await update.message.reply_text(
+        f"📣 Broadcast #{broadcast_id} started at up to {BROADCAST_RATE_PER_SECOND:.0f} msg/s."
+    )
+
+async def broadcast_status_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast_status <id> (admin only)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /broadcast_status <id>")
+        return
+    
+    broadcast = await get_broadcast(int(context.args[0]))
+    if not broadcast:
+        await update.message.reply_text("❌ Broadcast not found.")
+        return
+    
+    await update.message.reply_text(
+        f"📣 <b>Broadcast #{broadcast['broadcast_id']}</b>\n\n"
+        f"Status: {broadcast['status']}\n"
+        f"✅ Sent: {broadcast['total_sent']:,}\n"
+        f"🚫 Blocked: {broadcast['total_blocked']:,}\n"
+        f"❌ Failed: {broadcast['total_failed']:,}\n"
+        f"📍 Checkpoint: user {broadcast['last_user_id']}",
+        parse_mode=ParseMode.HTML
+    )
+
+async def broadcast_cancel_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast_cancel <id> (admin only)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /broadcast_cancel <id>")
+        return
+    
+    if await cancel_broadcast(int(context.args[0])):
+        await update.message.reply_text("🛑 Broadcast cancelled.")
+    else:
+        await update.message.reply_text("❌ Broadcast not found or already finished.")
+
+# --- Reconciliation ---
+# house_balance counters are checked against game_sessions and the ledger, and users.balance
+# against the ledger. Each run only reads rows past the stored watermarks; a full rebuild
+# recomputes everything from the first row and remains available for audits.
+# Bonuses (campaign, cashback, weekly), their forfeits and referral commissions are paid
+# against the house in the ledger but never booked in house_balance; each report states
+# their running total as the gap between house_balance and the house's real position.
+
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get("RECONCILE_INTERVAL_SECONDS", "300"))  # 0 disables the job
+RECONCILE_BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", "5000"))  # rows per read while catching up
+RECONCILE_REPORT_LIMIT = 20  # users / transactions listed per report
+
+_reconcile_lock = asyncio.Lock()
+_reconcile_task: Optional[asyncio.Task] = None
+_full_reconcile_task: Optional[asyncio.Task] = None
+
+# house_balance column -> reconciliation_state column holding its expected value
+HOUSE_EXPECTED_COLUMNS = {
+    "total_player_losses": "player_losses",
+    "total_player_wins": "player_wins",
+    "total_deposits": "deposits",
+    "total_withdrawals": "withdrawals",
+}
+
+# Counters updated in a separate commit from the ledger entry behind them
+HOUSE_SEPARATE_COMMIT_COLUMNS = ("total_deposits", "total_withdrawals")
+
+async def _reconcile_sessions(db, state: dict) -> int:
+    """Fold game sessions past the watermark into the expected house counters"""
+    checked = 0
+    while True:
+        cursor = await db.execute("""
+            SELECT COUNT(*), MAX(session_id), COALESCE(SUM(bet_amount), 0), COALESCE(SUM(win_amount), 0)
+            FROM (SELECT session_id, bet_amount, win_amount FROM game_sessions
+                  WHERE session_id > ? ORDER BY session_id LIMIT ?)
+        """, (state['last_session_id'], RECONCILE_BATCH_SIZE))
+        count, last_id, bets, wins = await cursor.fetchone()
+        if not count:
+            return checked
+        state['last_session_id'] = last_id
+        state['player_losses'] += bets
+        state['player_wins'] += wins
+        checked += count
+
+async def _reconcile_ledger(db, state: dict, unbalanced: list, touched: set) -> int:
+    """Fold ledger transactions past the watermark into the expected counters and check they balance"""
+    checked = 0
+    while True:
+        cursor = await db.execute("""
+            SELECT COUNT(*), MAX(txn_id)
+            FROM (SELECT txn_id FROM ledger_transactions WHERE txn_id > ? ORDER BY txn_id LIMIT ?)
+        """, (state['last_txn_id'], RECONCILE_BATCH_SIZE))
+        count, last_id = await cursor.fetchone()
+        if not count:
+            return checked
+        window = (state['last_txn_id'], last_id)
+        
+        # Demo deposits and withdrawals never touch the house balance
+        cursor = await db.execute("""
+            SELECT t.kind, COALESCE(SUM(e.amount), 0)
+            FROM ledger_transactions t JOIN ledger_entries e ON e.txn_id = t.txn_id AND e.account = 'user'
+            WHERE t.txn_id > ? AND t.txn_id <= ?
+              AND t.kind IN ('deposit', 'withdrawal', 'bonus', 'referral_commission')
+              AND COALESCE(t.reference, '') != 'demo'
+            GROUP BY t.kind
+        """, window)
+        for kind, total in await cursor.fetchall():
+            if kind == 'deposit':
+                state['deposits'] += total
+            elif kind == 'withdrawal':
+                state['withdrawals'] -= total  # user legs of withdrawals are negative
+            else:
+                state['promotions'] += total  # net of bonus forfeits
+        
+        cursor = await db.execute("""
+            SELECT txn_id, SUM(amount) FROM ledger_entries WHERE txn_id > ? AND txn_id <= ?
+            GROUP BY txn_id HAVING SUM(amount) != 0
+        """, window)
+        unbalanced.extend({'txn_id': txn_id, 'amount': total} for txn_id, total in await cursor.fetchall())
+        
+        cursor = await db.execute("""
+            SELECT DISTINCT user_id FROM ledger_entries
+            WHERE txn_id > ? AND txn_id <= ? AND user_id IS NOT NULL
+        """, window)
+        touched.update(row[0] for row in await cursor.fetchall())
+        
+        state['last_txn_id'] = last_id
+        checked += count
+
+async def _reconcile_users(db, touched: Optional[set]) -> Tuple[int, list]:
+    """Compare users.balance with the ledger: touched users via snapshots, or everyone from the full ledger"""
+    mismatched = []
+    if touched is None:
+        cursor = await db.execute("SELECT COUNT(*) FROM users")
+        checked = (await cursor.fetchone())[0]
+        cursor = await db.execute("""
+            SELECT u.user_id, u.balance, COALESCE(SUM(e.amount), 0) AS ledger
+            FROM users u LEFT JOIN ledger_entries e ON e.user_id = u.user_id
+            GROUP BY u.user_id HAVING u.balance != ledger
+            ORDER BY u.user_id
+        """)
+        for user_id, balance, ledger in await cursor.fetchall():
+            mismatched.append({'user_id': user_id, 'balance': balance, 'ledger': ledger})
+        return checked, mismatched
+    
+    for user_id in sorted(touched):
+        cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+        balance = row[0] if row else None
+        ledger = await ledger_balance(db, user_id)
+        if balance != ledger:
+            mismatched.append({'user_id': user_id, 'balance': balance, 'ledger': ledger})
+    return len(touched), mismatched
+
+def _house_drift(house: dict, state: dict) -> Dict[str, int]:
+    """Difference between house_balance and what sessions and the ledger explain; empty when clean.
+    
+    Promotional credits are left out of the expected balance because house_balance never
+    books them; reconcile reports them separately.
+    """
+    drift = {
+        column: house[column] - state[expected]
+        for column, expected in HOUSE_EXPECTED_COLUMNS.items()
+        if house[column] != state[expected]
+    }
+    implied = (HOUSE_OPENING_BALANCE + house['total_player_losses'] - house['total_player_wins']
+               + house['total_deposits'] - house['total_withdrawals'])
+    if house['balance'] != implied:
+        drift['balance'] = house['balance'] - implied
+    return drift
+
+def _lagging_drift(drift: Dict[str, int]) -> Dict[str, int]:
+    """The part of a house drift that can come from a deposit or withdrawal still in flight"""
+    return {column: amount for column, amount in drift.items() if column in HOUSE_SEPARATE_COMMIT_COLUMNS}
+
+async def reconcile(full: bool = False) -> dict:
+    """
+    Check house and user balances against game sessions and the ledger.
+    
+    Incremental runs resume from the watermarks. Bets update the house counters in their own
+    transaction, so bet counter and balance drift is reported at once, as are user and ledger
+    mismatches. Deposits and withdrawals update the house totals in a separate commit from
+    their ledger entry, so drift in those totals is only reported once two runs in a row see
+    the same value.
+    """
+    async with _reconcile_lock:
+        started = time.perf_counter()
+        mode = "full" if full else "incremental"
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                db.row_factory = aiosqlite.Row
+                cursor = await db.execute("SELECT * FROM reconciliation_state WHERE id = 1")
+                state = dict(await cursor.fetchone())
+                db.row_factory = None
+                if full:
+                    state.update(last_session_id=0, last_txn_id=0, player_losses=0, player_wins=0,
+                                 deposits=0, withdrawals=0, promotions=0)
+                
+                unbalanced: list = []
+                touched: set = set()
+                sessions_checked = await _reconcile_sessions(db, state)
+                transactions_checked = await _reconcile_ledger(db, state, unbalanced, touched)
+                users_checked, users = await _reconcile_users(db, None if full else touched)
+                
+                db.row_factory = aiosqlite.Row
+                cursor = await db.execute("SELECT * FROM house_balance WHERE id = 1")
+                house = dict(await cursor.fetchone())
+                drift = _house_drift(house, state)
+                
+                previous = json.loads(state['house_drift'] or '{}')
+                reported = json.loads(state['reported_drift'] or '{}')
+                if full or _lagging_drift(drift) == _lagging_drift(previous):
+                    confirmed = drift
+                else:
+                    confirmed = {**{c: v for c, v in drift.items() if c not in HOUSE_SEPARATE_COMMIT_COLUMNS},
+                                 **_lagging_drift(reported)}
+                new_house_drift = confirmed if confirmed != reported else {}
+                
+                mismatches = {}
+                if drift:
+                    mismatches['house'] = drift
+                if users:
+                    mismatches['users'] = users[:RECONCILE_REPORT_LIMIT]
+                    mismatches['users_total'] = len(users)
+                if unbalanced:
+                    mismatches['unbalanced_transactions'] = unbalanced[:RECONCILE_REPORT_LIMIT]
+                    mismatches['unbalanced_total'] = len(unbalanced)
+                
+                duration_ms = (time.perf_counter() - started) * 1000
+                now = datetime.now().isoformat()
+                await db.execute("""
+                    UPDATE reconciliation_state
+                    SET last_session_id = ?, last_txn_id = ?, player_losses = ?, player_wins = ?,
+                        deposits = ?, withdrawals = ?, promotions = ?, house_drift = ?, reported_drift = ?,
+                        last_full_at = CASE WHEN ? THEN ? ELSE last_full_at END, updated_at = ?
+                    WHERE id = 1
+                """, (state['last_session_id'], state['last_txn_id'], state['player_losses'],
+                      state['player_wins'], state['deposits'], state['withdrawals'], state['promotions'],
+                      json.dumps(drift),
+                      json.dumps(confirmed), full, now, now))
+                await db.execute("""
+                    INSERT INTO reconciliation_reports
+                    (mode, sessions_checked, transactions_checked, users_checked, mismatches, duration_ms, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (mode, sessions_checked, transactions_checked, users_checked, json.dumps(mismatches),
+                      duration_ms, now))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error running {mode} reconciliation: {e}")
+            return {}
+        finally:
+            RECONCILIATION_SECONDS.observe(time.perf_counter() - started, mode)
+    
+    RECONCILIATION_MISMATCHES.set(len(drift), "house")
+    RECONCILIATION_MISMATCHES.set(len(users), "users")
+    RECONCILIATION_MISMATCHES.set(len(unbalanced), "ledger")
+    
+    report = {
+        'mode': mode,
+        'sessions_checked': sessions_checked,
+        'transactions_checked': transactions_checked,
+        'users_checked': users_checked,
+        'mismatches': mismatches,
+        'promotions_unbooked': state['promotions'],
+        'duration_ms': duration_ms,
+        'created_at': now,
+    }
+    alert = {}
+    if new_house_drift or (full and drift):
+        alert['house'] = drift
+    if users:
+        alert['users'] = mismatches['users']
+    if unbalanced:
+        alert['unbalanced_transactions'] = mismatches['unbalanced_transactions']
+    if alert:
+        logger.warning(f"Reconciliation ({mode}) found mismatches: {json.dumps(mismatches)}")
+        await notify_admins(format_reconciliation_alert(mode, alert))
+    else:
+        logger.info(f"Reconciliation ({mode}) clean: {sessions_checked} sessions, "
+                    f"{transactions_checked} transactions, {users_checked} users in {duration_ms:.0f}ms")
+    return report
+
+def format_reconciliation_alert(mode: str, mismatches: dict) -> str:
+    """Admin alert listing the mismatches of one run"""
+    lines = [f"⚠️ <b>RECONCILIATION MISMATCH</b> ({mode})", ""]
+    for column, amount in mismatches.get('house', {}).items():
+        lines.append(f"🏦 House {column}: off by {format_money(amount)} ({amount:+,} micros)")
+    for user in mismatches.get('users', []):
+        if user['balance'] is None:
+            lines.append(f"👤 User <code>{user['user_id']}</code>: missing, ledger {format_money(user['ledger'])}")
+            continue
+        difference = user['balance'] - user['ledger']
+        lines.append(f"👤 User <code>{user['user_id']}</code>: balance {format_money(user['balance'])}, "
+                     f"ledger {format_money(user['ledger'])} ({difference:+,} micros)")
+    for txn in mismatches.get('unbalanced_transactions', []):
+        lines.append(f"📒 Ledger transaction {txn['txn_id']} unbalanced by {txn['amount']:+,} micros")
+    return "\n".join(lines)
+
+async def get_last_reconciliation() -> Optional[dict]:
+    """Latest reconciliation report with the current watermarks"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM reconciliation_reports ORDER BY report_id DESC LIMIT 1")
+            report = await cursor.fetchone()
+            cursor = await db.execute("SELECT * FROM reconciliation_state WHERE id = 1")
+            state = await cursor.fetchone()
+            if not state:
+                return None
+            result = {'state': dict(state), 'report': dict(report) if report else None}
+            if report:
+                result['report']['mismatches'] = json.loads(report['mismatches'] or '{}')
+            return result
+    except Exception as e:
+        logger.error(f"Error reading reconciliation report: {e}")
+        return None
+
+async def reconciliation_loop():
+    """Run incremental reconciliation every RECONCILE_INTERVAL_SECONDS"""
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        await reconcile()
+
+def start_reconciliation() -> None:
+    """Launch the background reconciliation job"""
+    global _reconcile_task
+    if RECONCILE_INTERVAL_SECONDS > 0 and _reconcile_task is None:
+        _reconcile_task = asyncio.create_task(reconciliation_loop())
+
+def start_full_reconciliation(admin_id: int) -> bool:
+    """Run a full rebuild in the background and send its report to the admin; False if one is running"""
+    global _full_reconcile_task
+    if _full_reconcile_task and not _full_reconcile_task.done():
+        return False
+    
+    async def run():
+        report = await reconcile(full=True)
+        if not report:
+            await notify_user(admin_id, "❌ Full reconciliation failed, see logs.")
+        elif not report['mismatches']:
+            await notify_user(admin_id, f"✅ Full reconciliation clean: {report['sessions_checked']} sessions, "
+                                        f"{report['transactions_checked']} transactions, "
+                                        f"{report['users_checked']} users in {report['duration_ms'] / 1000:.1f}s")
+    
+    _full_reconcile_task = asyncio.create_task(run())
+    return True
+
+# --- Rendering ---
+# Screens are split into what changes per render and what does not. Keyboards that never change
+# are built once as shared InlineKeyboardMarkup objects (immutable in PTB 20), fully static pages
+# are module constants, and game menus are prepared templates with only the balance filled in.
+
+BET_AMOUNTS = (1, 5, 10, 25, 50, 100)  # USD, two rows of three on every bet grid
+
+def bet_keyboard(prefix: str) -> InlineKeyboardMarkup:
+    """Bet grid sending `prefix`<amount>, with a way back to the games menu"""
+    buttons = [InlineKeyboardButton(f"${amount}", callback_data=f"{prefix}{amount}") for amount in BET_AMOUNTS]
+    return InlineKeyboardMarkup([
+        buttons[:3],
+        buttons[3:],
+        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
+    ])
+
+START_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Start", callback_data="main_panel")]])
+
+# game -> (template with {balance}, keyboard)
+GAME_MENUS: Dict[str, Tuple[str, InlineKeyboardMarkup]] = {
+    "slots": ("""
+🎰 <b>SLOTS</b>
+
+💰 Balance: {balance}
+
+<b>Payouts:</b>
+🍒🍒🍒 10x • 🍋🍋🍋 20x • 🍊🍊🍊 30x
+🔔🔔🔔 50x • 💎💎💎 100x
+
+Choose bet:
+""", bet_keyboard("slots_bet_")),
+    "blackjack": ("""
+🃏 <b>BLACKJACK</b>
+
+💰 Balance: {balance}
+
+<b>Rules:</b>
+Get to 21 • Beat dealer • Blackjack pays 3:2
+
+<b>Card Values:</b>
+Numbers = face • Face cards = 10 • Ace = 1 or 11
+
+Choose bet:
+""", bet_keyboard("blackjack_bet_")),
+    "dice": ("""
+🎲 <b>DICE</b>
+
+💰 Balance: {balance}
+
+<b>Options:</b>
+HIGH (8-12) = 2x • LOW (2-7) = 2x • Lucky 7 = 5x
+
+Choose bet:
+""", bet_keyboard("dice_bet_")),
+    "basketball": ("""
+🏀 <b>BASKETBALL 1v1</b>
+
+💰 Balance: {balance}
+
+<b>Game Mode:</b>
+First to score wins! You vs Bot
+
+<b>Shot Success Rates:</b>
+🎯 Free Throw: 70% - 2x payout
+⛹️ Jump Shot: 50% - 3x payout
+🔥 3-Pointer: 30% - 5x payout
+💥 Half Court: 5% - 20x payout
+
+Choose bet:
+""", bet_keyboard("basketball_bet_")),
+    "darts": ("""
+🎯 <b>DARTS 1v1</b>
+
+💰 Balance: {balance}
+
+<b>Game Mode:</b>
+Highest score wins! You vs Bot
+
+<b>Target Hit Rates:</b>
+🟢 Outer Bull: 65% - 2x payout (25 pts)
+🔴 Inner Bull: 45% - 3x payout (50 pts)
+💎 Triple 20: 30% - 5x payout (60 pts)
+🏆 Triple Bull: 10% - 15x payout (180 pts)
+
+Choose bet:
+""", bet_keyboard("darts_bet_")),
+    "roulette": ("""
+🎯 <b>ROULETTE</b>
+
+💰 Balance: {balance}
+
+<b>Bet Options:</b>
+• Red/Black: 2x payout
+• Odd/Even: 2x payout  
+• High/Low: 2x payout
+• Single Number: 36x payout
+
+Choose your bet type:
+""", InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🔴 Red", callback_data="roulette_red"),
+            InlineKeyboardButton("⚫ Black", callback_data="roulette_black")
+        ],
+        [
+            InlineKeyboardButton("📈 Odd", callback_data="roulette_odd"),
+            InlineKeyboardButton("📊 Even", callback_data="roulette_even")
+        ],
+        [
+            InlineKeyboardButton("⬇️ Low (1-18)", callback_data="roulette_low"),
+            InlineKeyboardButton("⬆️ High (19-36)", callback_data="roulette_high")
+        ],
+        [InlineKeyboardButton("🎯 Pick Number", callback_data="roulette_number")],
+        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
+    ])),
+}
+
+COMMANDS_MENU_TEXT = """
+⚡ <b>BOT COMMANDS</b> ⚡
+
+<b>🎮 Game Commands:</b>
+• /games - All games menu
+• /slots - Play slots directly
+• /blackjack - Play blackjack directly
+• /dice - Play dice directly
+• /roulette - Play roulette directly
+
+<b>💰 Money Commands:</b>
+• /deposit - Make a deposit
+• /referral - Referral program
+
+<b>ℹ️ Info Commands:</b>
+• /start - Main menu
+• /help - Full help guide
+• /leaderboard - Top players
+
+<b>🚀 Quick Tips:</b>
+• Type any command in chat
+• Commands work anywhere in the bot
+"""
+COMMANDS_MENU_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]])
+
+HELP_MENU_TEXT = """
+<b>HELP & SUPPORT</b>
+
+<b>Getting Started:</b>
+• /start - Access your panel
+• Deposit funds to play
+• Choose games & place bets
+• Withdraw your winnings
+
+<b>Game Commands:</b>
+• /games - Show all games
+• /slots - Play slots directly
+• /blackjack - Play blackjack directly
+• /dice - Play dice directly
+• /roulette - Play roulette directly
+
+<b>Other Commands:</b>
+• /deposit - Make a deposit
+• /referral - View referral program
+• /leaderboard - Top players
+
+<b>Payments:</b>
+• Litecoin (LTC) supported
+• Fast & secure transactions
+
+Need help? Contact support.
+"""
+HELP_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Game Rules", callback_data="game_rules")],
+    [InlineKeyboardButton("Support", url="https://t.me/casino_support")],
+    [InlineKeyboardButton("Back to Menu", callback_data="main_panel")]
+])
+
+HELP_COMMAND_TEXT = """
+<b>🎰 AXIS CASINO - HELP</b>
+
+<b>🚀 Getting Started:</b>
+• /start - Access your main panel
+• Make a deposit to start playing
+• Choose games & place bets
+• Withdraw your winnings anytime
+
+<b>🎮 Game Commands:</b>
+• /games - Show all available games
+• /slots - Play slots directly
+• /blackjack - Play blackjack directly
+• /dice - Play dice directly
+• /roulette - Play roulette directly
+
+<b>💰 Money Commands:</b>
+• /deposit - Make a deposit
+• /referral - View referral program & earn commissions
+
+<b>💳 Payment Info:</b>
+• Litecoin (LTC) supported
+• Minimum deposit: $1.00
+• Minimum withdrawal: $1.00
+• Withdrawal fee: 2% (min $1.00)
+• Fast & secure transactions
+
+<b>🎁 Bonuses:</b>
+• Weekly bonus: $5.00 every 7 days
+• Referral rewards: Earn when your referrals play
+
+<b>📞 Support:</b>
+Need help? Contact our support team!
+
+Good luck at the tables! 🍀
+"""
+HELP_COMMAND_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🎮 Play Games", callback_data="mini_app_centre"),
+        InlineKeyboardButton("💳 Deposit", callback_data="deposit")
+    ],
+    [
+        InlineKeyboardButton("👥 Referrals", callback_data="referral_menu"),
+        InlineKeyboardButton("🏠 Main Menu", callback_data="main_panel")
+    ]
+])
+
+def render_game_menu(game: str, balance: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Text and keyboard of a game's bet screen"""
+    template, keyboard = GAME_MENUS[game]
+    return template.format(balance=format_usd(balance)), keyboard
 
-def get_referral_link(bot_username: str, referral_code: str) -> str:
-    """Generate referral deep link."""
-    return f"https://t.me/{bot_username}?start={referral_code}"
+async def show_game_menu(update: Update, game: str) -> None:
+    """Open a game's bet screen from a button (edits the message) or a command (replies)"""
+    query = update.callback_query
+    if query:
+        await query.answer()
+    user = await get_user(update.effective_user.id)
+    if not user:
+        if query:
+            await query.edit_message_text("❌ User not found. Please restart with /start")
+        else:
+            await update.message.reply_text("❌ User not found. Please use /start to register first.", reply_markup=START_KEYBOARD)
+        return
+    
+    text, keyboard = render_game_menu(game, user['balance'])
+    if query:
+        await query.edit_message_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    else:
+        await update.message.reply_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
 
 # --- Main Bot Handlers ---
 
@@ -1528,7 +5293,7 @@ async def handle_text_input_main(update: Update, context: ContextTypes.DEFAULT_T
         await handle_withdraw_address_input(update, context)
     else:
         # Ignore unexpected text input
-        logger.debug(f"Ignored text input from user {update.effective_user.id}: {update.message.text}")
+        logger.debug("Ignored text input from user %s: %s", update.effective_user.id, update.message.text)
 
 # --- Deposit/Withdrawal Handlers ---
 
@@ -1549,7 +5314,7 @@ async def deposit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return
     
-    balance_str = await format_usd(user['balance'])
+    balance_str = format_usd(user['balance'])
     
     text = f"""
 💳 <b>DEPOSIT</b>
@@ -1612,30 +5377,30 @@ async def handle_deposit_amount_input(update: Update, context: ContextTypes.DEFA
         return
     crypto_type = context.user_data['awaiting_deposit_amount']
     try:
-        amount_usd = float(update.message.text.replace('$', '').replace(',', ''))
-        if amount_usd < 1.0:
-            await update.message.reply_text("❌ Minimum deposit is $1.00 USD.")
+        amount_usd = parse_usd_input(update.message.text)
+        if amount_usd < MIN_DEPOSIT_USD:
+            await update.message.reply_text(f"❌ Minimum deposit is {format_money(MIN_DEPOSIT_USD)} USD.")
             return
-        if amount_usd > 10000.0:
-            await update.message.reply_text("❌ Maximum deposit is $10,000.00 USD per transaction.")
+        if amount_usd > MAX_DEPOSIT_USD:
+            await update.message.reply_text(f"❌ Maximum deposit is {format_money(MAX_DEPOSIT_USD)} USD per transaction.")
             return
         del context.user_data['awaiting_deposit_amount']
         await process_deposit_payment(update, context, crypto_type, amount_usd)
     except ValueError:
         await update.message.reply_text("❌ Invalid amount. Please enter a valid number (e.g., 10 or 25.50)")
 
-async def process_deposit_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, crypto_type: str, amount_usd: float) -> None:
+async def process_deposit_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, crypto_type: str, amount_usd: int) -> None:
     """Process deposit payment and create CryptoBot invoice"""
     user_id = update.effective_user.id
     
     try:
         # In demo mode, just add the balance
         if DEMO_MODE:
-            success = await update_balance(user_id, amount_usd)
+            success = await update_balance(user_id, amount_usd, "deposit", "demo")
             if success:
                 keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]]
                 await update.message.reply_text(
-                    f"✅ Demo deposit successful! Added ${amount_usd:.2f} to your balance.",
+                    f"✅ Demo deposit successful! Added {format_money(amount_usd)} to your balance.",
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
             else:
@@ -1648,7 +5413,7 @@ async def process_deposit_payment(update: Update, context: ContextTypes.DEFAULT_
             await update.message.reply_text("❌ Unable to fetch crypto rate. Please try again later.")
             return
             
-        crypto_amount = amount_usd / rate
+        crypto_amount = usd_to_crypto_units(amount_usd, rate)
         
         # Create CryptoBot invoice
         invoice_data = await create_crypto_invoice(crypto_type, crypto_amount, user_id)
@@ -1664,8 +5429,8 @@ async def process_deposit_payment(update: Update, context: ContextTypes.DEFAULT_
 💰 <b>CRYPTO PAY INVOICE READY</b> 💰
 
 📊 <b>Payment Details:</b>
-• Amount: <b>${amount_usd:.2f} USD</b>
-• Crypto: <b>{crypto_amount:.8f} {crypto_type}</b>
+• Amount: <b>{format_money(amount_usd)} USD</b>
+• Crypto: <b>{format_crypto(crypto_amount)} {crypto_type}</b>
 • Rate: <b>${rate:.4f}</b> per {crypto_type}
 • Invoice ID: <code>{invoice['invoice_id']}</code>
 
@@ -1708,20 +5473,20 @@ async def withdraw_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     balance = user['balance']
     if balance < MIN_WITHDRAWAL_USD:
         await query.edit_message_text(
-            f"❌ Minimum withdrawal is {await format_usd(MIN_WITHDRAWAL_USD)}.",
+            f"❌ Minimum withdrawal is {format_usd(MIN_WITHDRAWAL_USD)}.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]])
         )
         return
-    fee_amount = calculate_withdrawal_fee(balance)
+    fee_amount = calculate_withdrawal_fee(balance, user.get('vip_level', 0))
     max_withdrawal = min(balance - fee_amount, MAX_WITHDRAWAL_USD)
     text = f"""
 🏦 <b>WITHDRAW FUNDS</b>
 
-💰 Balance: {await format_usd(balance)}
-💸 Available: {await format_usd(max_withdrawal)}
+💰 Balance: {format_usd(balance)}
+💸 Available: {format_usd(max_withdrawal)}
 
-• Min: {await format_usd(MIN_WITHDRAWAL_USD)} | Max: {await format_usd(MAX_WITHDRAWAL_USD)}
-• Fee: {WITHDRAWAL_FEE_PERCENT * 100:.1f}% (min ${MIN_WITHDRAWAL_FEE:.2f})
+• Min: {format_usd(MIN_WITHDRAWAL_USD)} | Max: {format_usd(MAX_WITHDRAWAL_USD)}
+• Fee: {vip_tier(user.get('vip_level', 0)).withdrawal_fee_bps / 100:.1f}% (min {format_money(MIN_WITHDRAWAL_FEE)})
 • Processing: 24h
 """
     keyboard = [
@@ -1739,14 +5504,14 @@ async def withdraw_crypto_callback(update: Update, context: ContextTypes.DEFAULT
         await query.edit_message_text("❌ User not found. Please restart with /start")
         return
     
-    balance_str = await format_usd(user['balance'])
+    balance_str = format_usd(user['balance'])
     max_withdrawal = min(user['balance'], MAX_WITHDRAWAL_USD)
     
     text = f"""
 <b>WITHDRAW LITECOIN (LTC)</b>
 
 💰 Balance: {balance_str}
-💸 Available: {await format_usd(max_withdrawal)}
+💸 Available: {format_usd(max_withdrawal)}
 
 Enter withdrawal amount in USD (e.g., "50")
 """
@@ -1766,22 +5531,22 @@ async def handle_withdraw_amount_input(update: Update, context: ContextTypes.DEF
         return
     
     try:
-        amount_usd = float(update.message.text.replace('$', '').replace(',', ''))
+        amount_usd = parse_usd_input(update.message.text)
         
         # Check minimum
         if amount_usd < MIN_WITHDRAWAL_USD:
-            await update.message.reply_text(f"❌ Minimum withdrawal is ${MIN_WITHDRAWAL_USD:.2f} USD.")
+            await update.message.reply_text(f"❌ Minimum withdrawal is {format_money(MIN_WITHDRAWAL_USD)} USD.")
             return
             
         # Check balance
-        user_balance = user.get('balance', 0.0)
+        user_balance = user.get('balance', 0)
         if amount_usd > user_balance:
-            balance_str = await format_usd(user_balance)
+            balance_str = format_usd(user_balance)
             await update.message.reply_text(
                 f"❌ <b>Insufficient Balance</b>\n\n"
                 f"Your balance: {balance_str}\n"
-                f"Withdrawal amount: ${amount_usd:.2f} USD\n\n"
-                f"You need ${amount_usd - user_balance:.2f} more to complete this withdrawal.",
+                f"Withdrawal amount: {format_money(amount_usd)} USD\n\n"
+                f"You need {format_money(amount_usd - user_balance)} more to complete this withdrawal.",
                 parse_mode=ParseMode.HTML
             )
             return
@@ -1793,7 +5558,7 @@ async def handle_withdraw_amount_input(update: Update, context: ContextTypes.DEF
             return
             
         # Calculate fee
-        fee = calculate_withdrawal_fee(amount_usd)
+        fee = calculate_withdrawal_fee(amount_usd, user.get('vip_level', 0))
         net_amount = amount_usd - fee
         
         # Store withdrawal details and ask for address
@@ -1806,12 +5571,12 @@ async def handle_withdraw_amount_input(update: Update, context: ContextTypes.DEF
         del context.user_data['awaiting_withdraw_amount']
         context.user_data['awaiting_withdraw_address'] = crypto_type
         
-        fee_str = await format_usd(fee)
-        net_str = await format_usd(net_amount);
+        fee_str = format_usd(fee)
+        net_str = format_usd(net_amount);
         
         await update.message.reply_text(
             f"<b>Withdrawal Details</b>\n\n"
-            f"Amount: ${amount_usd:.2f} USD\n"
+            f"Amount: {format_money(amount_usd)} USD\n"
             f"Fee: {fee_str}\n"
             f"You'll receive: {net_str}\n\n"
             f"Please enter your {crypto_type} address:",
@@ -1837,7 +5602,7 @@ async def handle_withdraw_address_input(update: Update, context: ContextTypes.DE
     
     # Clear states
     del context.user_data['awaiting_withdraw_address']
-    del context
+    context.user_data.pop('withdraw_details', None)
     
     # Process withdrawal
     user_id = update.message.from_user.id
@@ -1847,14 +5612,14 @@ async def handle_withdraw_address_input(update: Update, context: ContextTypes.DE
     
     if DEMO_MODE:
         # Demo mode - simulate withdrawal
-        success = await deduct_balance(user_id, amount_usd)
+        success = await deduct_balance(user_id, amount_usd, "withdrawal", "demo")
         if success:
             keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]]
             await update.message.reply_text(
                
                 f"✅ Demo withdrawal successful!\n\n"
-                f"Withdrawn: ${amount_usd:.2f} USD\n"
-                f"Fee: ${fee:.2f} USD\n"
+                f"Withdrawn: {format_money(amount_usd)} USD\n"
+                f"Fee: {format_money(fee)} USD\n"
                 f"Address: {address[:10]}...{address[-10:]}\n\n"
                 f"<i>In real mode, this would process to your wallet</i>",
                 reply_markup=InlineKeyboardMarkup(keyboard),
@@ -1869,22 +5634,23 @@ async def handle_withdraw_address_input(update: Update, context: ContextTypes.DE
             await update.message.reply_text("❌ Unable to fetch crypto rate. Please try again later.")
             return
             
-        crypto_amount = amount_usd / rate
-        net_crypto_amount = crypto_amount - (fee / rate)
+        crypto_amount = usd_to_crypto_units(amount_usd, rate)
+        crypto_fee = usd_to_crypto_units(fee, rate)
+        net_crypto_amount = crypto_amount - crypto_fee
         
         # Log withdrawal
-        withdrawal_id = await log_withdrawal(user_id, crypto_type, crypto_amount, address, fee / rate, net_crypto_amount)
+        withdrawal_id = await log_withdrawal(user_id, crypto_type, address, amount_usd, fee, rate)
         
         if withdrawal_id:
             # Deduct balance
-            success = await deduct_balance(user_id, amount_usd)
+            success = await deduct_balance(user_id, amount_usd, "withdrawal", str(withdrawal_id))
             if success:
                 await update.message.reply_text(
                     f"✅ Withdrawal request submitted!\n\n"
-                    f"Amount: ${amount_usd:.2f} USD\n"
-                    f"Crypto: {crypto_amount:.8f} {crypto_type}\n"
-                    f"Fee: {fee / rate:.8f} {crypto_type}\n"
-                    f"Net: {net_crypto_amount:.8f} {crypto_type}\n"
+                    f"Amount: {format_money(amount_usd)} USD\n"
+                    f"Crypto: {format_crypto(crypto_amount)} {crypto_type}\n"
+                    f"Fee: {format_crypto(crypto_fee)} {crypto_type}\n"
+                    f"Net: {format_crypto(net_crypto_amount)} {crypto_type}\n"
                     f"Address: {address}\n\n"
                     f"Your withdrawal will be processed within 24 hours."
                 )
@@ -1898,6 +5664,7 @@ async def handle_withdraw_address_input(update: Update, context: ContextTypes.DE
 
 # --- CryptoBot Webhook and Payment Status ---
 
+@instrument_cryptobot("getInvoices")
 async def check_payment_status(invoice_id: str) -> dict:
     """Check payment status of a CryptoBot invoice"""
     if not CRYPTOBOT_API_TOKEN:
@@ -1910,7 +5677,7 @@ async def check_payment_status(invoice_id: str) -> dict:
         }
         
         async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
-            async with session.get(f'https://pay.crypt.bot/api/getInvoices?invoice_ids={invoice_id}', 
+            async with session.get(f'{CRYPTOBOT_API_URL}/getInvoices?invoice_ids={invoice_id}', 
                                  headers=headers) as response:
                 if response.status == 200:
                     result = await response.json()
@@ -1928,34 +5695,40 @@ async def check_payment_status(invoice_id: str) -> dict:
         logger.error(f"Error checking payment status: {e}")
         return {"ok": False, "error": str(e)}
 
-async def process_successful_deposit(user_id: int, amount_usd: float, crypto_amount: float, asset: str, invoice_id: str) -> bool:
-    """Process a successful deposit and update user balance"""
+async def process_successful_deposit(user_id: int, amount_usd: int, crypto_amount: int, asset: str, invoice_id: str) -> bool:
+    """Process a successful deposit; amount_usd in micro-dollars, crypto_amount in base units"""
     try:
-        # Update user balance
-        success = await update_balance(user_id, amount_usd)
-        
-        if success:
-            # Log the deposit to transactions table
-            async with aiosqlite.connect(DB_PATH) as db:
+        async with aiosqlite.connect(DB_PATH) as db:
+            # Credit the balance and record the deposit in one transaction
+            balance_after = await post_ledger(db, user_id, amount_usd, "deposit", str(invoice_id))
+            success = balance_after is not None
+            
+            if success:
                 await db.execute("""
                     INSERT INTO transactions 
                     (user_id, type, subtype, amount, currency, crypto_asset, crypto_amount, 
-                     reference_id, status, description, created_at)
-                    VALUES (?, 'deposit', 'crypto_deposit', ?, 'USD', ?, ?, ?, 'completed', 
+                     balance_before, balance_after, reference_id, status, description, created_at)
+                    VALUES (?, 'deposit', 'crypto_deposit', ?, 'USD', ?, ?, ?, ?, ?, 'completed', 
                             'CryptoBot deposit', ?)
-                """, (user_id, amount_usd, asset, crypto_amount, invoice_id, datetime.now().isoformat()))
+                """, (user_id, amount_usd, asset, crypto_amount, balance_after - amount_usd, balance_after,
+                      invoice_id, datetime.now().isoformat()))
                 
                 # Update total deposited
-                await db.execute("""
+                cursor = await db.execute("""
                     UPDATE users SET total_deposited = COALESCE(total_deposited, 0) + ? WHERE user_id = ?
+                    RETURNING total_deposited
                 """, (amount_usd, user_id))
+                total_deposited = (await cursor.fetchone())[0]
+                await cursor.close()
                 
                 await db.commit()
-            
+        
+        if success:
             # Update house balance
             await update_house_balance_on_deposit(amount_usd)
+            emit("deposit_completed", user_id=user_id, amount=amount_usd, total_deposited=total_deposited)
             
-            logger.info(f"Deposit processed successfully: User {user_id}, Amount ${amount_usd}, Invoice {invoice_id}")
+            logger.info(f"Deposit processed successfully: User {user_id}, Amount {format_money(amount_usd)}, Invoice {invoice_id}")
             return True
         
         return False
@@ -1990,20 +5763,26 @@ async def handle_cryptobot_webhook(request_data: dict, signature: str) -> bool:
             invoice = payload
             invoice_id = invoice.get('invoice_id')
             user_id = int(invoice.get('hidden_message', 0))
-            amount = float(invoice.get('amount', 0))
+            amount = parse_crypto_amount(invoice.get('amount', 0))
             asset = invoice.get('asset')
             status = invoice.get('status')
             
             if status == 'paid' and user_id > 0:
                 # Calculate USD amount
                 rate = await get_crypto_usd_rate(asset)
-                amount_usd = amount * rate if rate > 0 else 0
+                amount_usd = crypto_units_to_micros(amount, rate) if rate > 0 else 0
                 
                 if amount_usd > 0:
                     success = await process_successful_deposit(user_id, amount_usd, amount, asset, invoice_id)
                     if success:
-                        # Notify user (you could add bot notification here)
-                        logger.info(f"User {user_id} notified of successful deposit: ${amount_usd:.2f}")
+                        await notify_user(
+                            user_id,
+                            f"✅ <b>DEPOSIT CONFIRMED</b>\n\n"
+                            f"💰 Amount: {format_money(amount_usd)} USD\n"
+                            f"🪙 Received: {format_crypto(amount)} {asset}\n\n"
+                            f"Your balance has been updated!"
+                        )
+                        logger.info(f"User {user_id} notified of successful deposit: {format_money(amount_usd)}")
                     return success
         
         return True
@@ -2032,14 +5811,14 @@ async def check_payment_callback(update: Update, context: ContextTypes.DEFAULT_T
         
         invoice = status_data['result']
         status = invoice.get('status')
-        amount = float(invoice.get('amount', 0))
+        amount = parse_crypto_amount(invoice.get('amount', 0))
         asset = invoice.get('asset')
         
         if status == 'paid':
             # Process the payment
             user_id = int(invoice.get('hidden_message', 0))
             rate = await get_crypto_usd_rate(asset)
-            amount_usd = amount * rate if rate > 0 else 0
+            amount_usd = crypto_units_to_micros(amount, rate) if rate > 0 else 0
             
             if amount_usd > 0:
                 success = await process_successful_deposit(user_id, amount_usd, amount, asset, invoice_id)
@@ -2047,8 +5826,8 @@ async def check_payment_callback(update: Update, context: ContextTypes.DEFAULT_T
                     text = f"""
 ✅ <b>PAYMENT CONFIRMED!</b> ✅
 
-💰 <b>Deposit Successful:</b> ${amount_usd:.2f} USD
-🪙 <b>Received:</b> {amount:.8f} {asset}
+💰 <b>Deposit Successful:</b> {format_money(amount_usd)} USD
+🪙 <b>Received:</b> {format_crypto(amount)} {asset}
 📄 <b>Invoice:</b> <code>{invoice_id}</code>
 
 Your balance has been updated!
@@ -2061,7 +5840,7 @@ Your balance has been updated!
                 text = f"""
 ⏳ <b>PAYMENT PENDING</b> ⏳
 
-🪙 <b>Waiting for:</b> {amount:.8f} {asset}
+🪙 <b>Waiting for:</b> {format_crypto(amount)} {asset}
 📄 <b>Invoice:</b> <code>{invoice_id}</code>
 
 Payment is still pending. Please complete the transaction in your wallet.
@@ -2101,6 +5880,110 @@ async def health_check(request):
     """Health check endpoint for deployment platforms"""
     return web.json_response({"status": "ok", "bot": "running"})
 
+# --- Readiness Probes ---
+HEALTH_CACHE_SECONDS = float(os.environ.get("HEALTH_CACHE_SECONDS", "5"))
+HEALTH_DB_TIMEOUT = float(os.environ.get("HEALTH_DB_TIMEOUT", "2"))
+HEALTH_DB_LATENCY_MS = float(os.environ.get("HEALTH_DB_LATENCY_MS", "250"))
+HEALTH_WAL_MAX_MB = float(os.environ.get("HEALTH_WAL_MAX_MB", "64"))
+HEALTH_QUEUE_MAX_DEPTH = int(os.environ.get("HEALTH_QUEUE_MAX_DEPTH", "1000"))
+HEALTH_RATE_MAX_AGE = float(os.environ.get("HEALTH_RATE_MAX_AGE", "900"))
+
+# (checked_at, report) of the last readiness run, and the run in progress if any
+_readiness_cache: Optional[Tuple[float, dict]] = None
+_readiness_task: Optional[asyncio.Task] = None
+
+async def probe_database() -> dict:
+    """Round-trip reads so an unreachable or wedged database fails readiness.
+    
+    Reads never wait on the writer lock, so a long bet or ledger write does not mark a
+    healthy instance unready, and the probe never competes with those writes.
+    """
+    started = time.perf_counter()
+    try:
+        async with aiosqlite.connect(DB_PATH, timeout=HEALTH_DB_TIMEOUT) as db:
+            await (await db.execute("SELECT 1")).fetchone()
+            cursor = await db.execute("PRAGMA journal_mode")
+            journal_mode = (await cursor.fetchone())[0]
+            cursor = await db.execute("PRAGMA busy_timeout")
+            busy_timeout_ms = (await cursor.fetchone())[0]
+    except Exception as e:
+        return {"status": "fail", "error": str(e)}
+    latency_ms = (time.perf_counter() - started) * 1000
+    status = "ok" if latency_ms <= HEALTH_DB_LATENCY_MS else "degraded"
+    return {"status": status, "latency_ms": round(latency_ms, 2), "threshold_ms": HEALTH_DB_LATENCY_MS,
+            "journal_mode": journal_mode, "busy_timeout_ms": busy_timeout_ms}
+
+def probe_wal_size() -> dict:
+    """Report the size of the SQLite write-ahead log"""
+    wal_path = f"{DB_PATH}-wal"
+    size_mb = os.path.getsize(wal_path) / (1024 * 1024) if os.path.exists(wal_path) else 0.0
+    status = "ok" if size_mb <= HEALTH_WAL_MAX_MB else "degraded"
+    return {"status": status, "size_mb": round(size_mb, 2), "threshold_mb": HEALTH_WAL_MAX_MB}
+
+def probe_queues() -> dict:
+    """Report queue depths of background workers"""
+    depths = {name: q.qsize() for name, q in background_queues.items()}
+    if _log_queue is not None:
+        depths["logging"] = _log_queue.qsize()
+    deepest = max(depths.values(), default=0)
+    status = "ok" if deepest <= HEALTH_QUEUE_MAX_DEPTH else "degraded"
+    return {"status": status, "depths": depths, "threshold": HEALTH_QUEUE_MAX_DEPTH}
+
+def probe_rates() -> dict:
+    """Report how long ago each exchange rate was last fetched successfully"""
+    ages = {asset: get_rate_age(asset) for asset in SUPPORTED_CRYPTO_ASSETS}
+    known = [age for age in ages.values() if age is not None]
+    # Rates are fetched lazily, so a missing rate is not a problem on its own
+    status = "ok" if all(age <= HEALTH_RATE_MAX_AGE for age in known) else "degraded"
+    return {
+        "status": status,
+        "age_seconds": {asset: round(age, 1) if age is not None else None for asset, age in ages.items()},
+        "threshold_seconds": HEALTH_RATE_MAX_AGE,
+    }
+
+def probe_telegram() -> dict:
+    """Report whether the Telegram application and updater are running"""
+    if bot_application is None:
+        return {"status": "fail", "error": "application not started"}
+    updater_running = bool(bot_application.updater and bot_application.updater.running)
+    status = "ok" if bot_application.running and updater_running else "fail"
+    return {"status": status, "application_running": bot_application.running, "updater_running": updater_running}
+
+async def run_readiness_checks() -> dict:
+    """Run every dependency probe. Only 'fail' results make the instance unready."""
+    checks = {
+        "database": await probe_database(),
+        "wal": probe_wal_size(),
+        "queues": probe_queues(),
+        "rates": probe_rates(),
+        "telegram": probe_telegram(),
+    }
+    statuses = {check["status"] for check in checks.values()}
+    overall = "fail" if "fail" in statuses else "degraded" if "degraded" in statuses else "ok"
+    return {"status": overall, "checked_at": datetime.now().isoformat(), "checks": checks}
+
+async def get_readiness_report() -> dict:
+    """Return the cached readiness report, running the probes at most once per cache window"""
+    global _readiness_cache, _readiness_task
+    if _readiness_cache and time.monotonic() - _readiness_cache[0] < HEALTH_CACHE_SECONDS:
+        return _readiness_cache[1]
+    
+    # Concurrent health checks share one probe run
+    if _readiness_task is None or _readiness_task.done():
+        _readiness_task = asyncio.create_task(run_readiness_checks())
+    report = await asyncio.shield(_readiness_task)
+    _readiness_cache = (time.monotonic(), report)
+    return report
+
+async def liveness_handler(request):
+    """Liveness: the process and event loop are responsive"""
+    return web.json_response({"status": "ok", "uptime_seconds": round(time.time() - start_time, 1)})
+
+async def readiness_handler(request):
+    """Readiness: dependencies are usable; 503 tells the platform to stop routing traffic here"""
+    report = await get_readiness_report()
+    return web.json_response(report, status=503 if report["status"] == "fail" else 200)
+
 async def cryptobot_webhook_handler(request):
     """Handle CryptoBot webhook notifications"""
     try:
@@ -2108,26 +5991,38 @@ async def cryptobot_webhook_handler(request):
         request_data = await request.json()
         
         if not request_data:
+            WEBHOOK_REQUESTS_TOTAL.inc("400")
             return web.json_response({"error": "Invalid request"}, status=400)
         
         # Handle webhook
         success = await handle_cryptobot_webhook(request_data, signature)
         
         if success:
+            WEBHOOK_REQUESTS_TOTAL.inc("200")
             return web.json_response({"status": "ok"})
         else:
+            WEBHOOK_REQUESTS_TOTAL.inc("500")
             return web.json_response({"error": "Error processing webhook"}, status=500)
             
     except Exception as e:
+        WEBHOOK_REQUESTS_TOTAL.inc("500")
         logger.error(f"Error in CryptoBot webhook: {e}")
         return web.json_response({"error": "Internal error"}, status=500)
 
+async def metrics_handler(request):
+    """Expose metrics in Prometheus text format"""
+    return web.Response(text=metrics.render(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
 async def start_web_server():
     """Start aiohttp web server for health checks"""
     app = web.Application()
     app.router.add_get('/', health_check)
     app.router.add_get('/health', health_check)
     app.router.add_get('/keepalive', health_check)
+    app.router.add_get('/health/live', liveness_handler)
+    app.router.add_get('/health/ready', readiness_handler)
+    app.router.add_get('/metrics', metrics_handler)
     app.router.add_post('/cryptobot_webhook', cryptobot_webhook_handler)
     
     port = int(os.environ.get("PORT", 8000))
@@ -2144,13 +6039,169 @@ async def start_web_server():
     finally:
         await runner.cleanup()
 
-# --- Telegram Bot Runner ---
+# --- Conversation Persistence ---
+# context.user_data holds the multi-step deposit/withdraw flow state; it (with chat_data and
+# bot_data) is kept in bot_persistence as compact JSON so a restart resumes flows in progress.
+# PTB hands over the entries touched since its last run every PERSISTENCE_FLUSH_SECONDS; only
+# those whose encoding changed are written, batched into one transaction. Flow keys untouched
+# for FLOW_STATE_TTL_SECONDS are dropped before the player's next update is handled, and on
+# startup for players who never came back; rows left empty are deleted.
+
+PERSISTENCE_FLUSH_SECONDS = float(os.environ.get("PERSISTENCE_FLUSH_SECONDS", "30"))
+FLOW_STATE_TTL_SECONDS = int(os.environ.get("FLOW_STATE_TTL_SECONDS", "1800"))
+FLOW_STATE_KEYS = ("awaiting_deposit_amount", "awaiting_withdraw_amount", "withdraw_details", "awaiting_withdraw_address")
+
+def encode_state(data) -> Optional[str]:
+    """Compact JSON for a stored value; None for empty data, which deletes the row"""
+    return json.dumps(data, separators=(",", ":")) if data else None
+
+class SQLitePersistence(BasePersistence):
+    """PTB persistence in the casino database (the bot uses no arbitrary callback data)"""
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_SECONDS):
+        super().__init__(PersistenceInput(callback_data=False), update_interval)
+        self._written: Dict[Tuple[str, str], str] = {}  # (kind, key) -> stored encoding
+        self._pending: Dict[Tuple[str, str], Optional[str]] = {}
+        self._changed_at: Dict[int, datetime] = {}  # user_id -> last stored change to user_data
+        self._lock = asyncio.Lock()
+
+    async def _load(self, kind: str) -> List[tuple]:
+        try:
+            async with aiosqlite.connect(DB_PATH) as db:
+                cursor = await db.execute("SELECT key, data, updated_at FROM bot_persistence WHERE kind = ?", (kind,))
+                rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading persisted {kind} data: {e}")
+            return []
+        for key, data, _ in rows:
+            self._written[(kind, key)] = data
+        return rows
 
-async def run_telegram_bot_async():
-    """Run the Telegram bot with proper initialization"""
-    await init_db()  # Ensure DB is ready
+    async def _stage(self, kind: str, key: str, data) -> None:
+        try:
+            encoded = encode_state(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Cannot persist {kind} data for {key}: {e}")
+            return
+        if encoded == self._written.get((kind, key)):
+            return
+        self._pending[(kind, key)] = encoded
+        if kind == "user":
+            self._changed_at[int(key)] = datetime.now()
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write everything staged; PTB's per-entry calls arriving together share one transaction"""
+        async with self._lock:
+            if not self._pending:
+                return
+            try:
+                async with aiosqlite.connect(DB_PATH) as db:
+                    pending, self._pending = self._pending, {}
+                    now = datetime.now().isoformat()
+                    await db.executemany("""
+                        INSERT INTO bot_persistence (kind, key, data, updated_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                    """, [(kind, key, data, now) for (kind, key), data in pending.items() if data is not None])
+                    await db.executemany("""
+                        DELETE FROM bot_persistence WHERE kind = ? AND key = ?
+                    """, [row for row, data in pending.items() if data is None])
+                    await commit_timed(db, "persistence_flush")
+                for row, data in pending.items():
+                    if data is None:
+                        self._written.pop(row, None)
+                    else:
+                        self._written[row] = data
+            except Exception as e:
+                logger.error(f"Error writing persistence: {e}")
+                for row, data in pending.items():
+                    self._pending.setdefault(row, data)  # retried with the next run
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        user_data = {}
+        cutoff = datetime.now() - timedelta(seconds=FLOW_STATE_TTL_SECONDS)
+        for key, data, updated_at in await self._load("user"):
+            data = json.loads(data)
+            changed_at = datetime.fromisoformat(updated_at)
+            if changed_at < cutoff and any(flow_key in data for flow_key in FLOW_STATE_KEYS):
+                for flow_key in FLOW_STATE_KEYS:
+                    data.pop(flow_key, None)
+                self._pending[("user", key)] = encode_state(data)
+            if data:
+                user_data[int(key)] = data
+                self._changed_at[int(key)] = changed_at
+        await self.flush()  # purged state is written (or its row deleted) before polling starts
+        return user_data
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {int(key): json.loads(data) for key, data, _ in await self._load("chat")}
+
+    async def get_bot_data(self) -> dict:
+        rows = await self._load("bot")
+        return json.loads(rows[0][1]) if rows else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {tuple(json.loads(key)): json.loads(data) for key, data, _ in await self._load(f"conversation:{name}")}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._stage("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._stage("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        await self._stage("bot", "", data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
 
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        await self._stage(f"conversation:{name}", encode_state(list(key)), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._changed_at.pop(user_id, None)
+        await self._stage("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._stage("chat", str(chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """Drop flow state abandoned for longer than FLOW_STATE_TTL_SECONDS"""
+        changed_at = self._changed_at.get(user_id)
+        if changed_at is None or (datetime.now() - changed_at).total_seconds() < FLOW_STATE_TTL_SECONDS:
+            return
+        # Stale only if nothing changed since it was stored
+        if encode_state(user_data) == self._written.get(("user", str(user_id))):
+            for key in FLOW_STATE_KEYS:
+                user_data.pop(key, None)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+# --- Telegram Bot Runner ---
+
+def build_application(request: Optional[BaseRequest] = None) -> Application:
+    """
+    Create the bot application with every handler registered.
+    `request` replaces the Bot API transport, e.g. with a recording stub in load tests.
+    """
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .application_class(TracedApplication)
+        .request(request or TracedHTTPXRequest(connection_pool_size=256))
+        .persistence(SQLitePersistence())
+        .build()
+    )
+    
+    # Shed excess taps before any callback handler runs
+    application.add_handler(CallbackQueryHandler(rate_limit_callback), group=-1)
     
     # Register specific deposit/withdrawal handlers first (higher priority)
     application.add_handler(CallbackQueryHandler(deposit_callback, pattern=r"^deposit$"))
@@ -2179,8 +6230,8 @@ async def run_telegram_bot_async():
         # Get user stats
         balance = user.get('balance', 0)
         games_played = user.get('games_played', 0)
-        total_wagered = user.get('total_wagered', 0.0)
-        total_won = user.get('total_won', 0.0)
+        total_wagered = user.get('total_wagered', 0)
+        total_won = user.get('total_won', 0)
         win_streak = user.get('win_streak', 0)
         referral_count = user.get('referral_count', 0)
         
@@ -2188,14 +6239,14 @@ async def run_telegram_bot_async():
         referral_code = await get_or_create_referral_code(user_id)
         
         # Format amounts
-        balance_str = await format_usd(balance)
-        wagered_str = await format_usd(total_wagered)
-        won_str = await format_usd(total_won)
+        balance_str = format_usd(balance)
+        wagered_str = format_usd(total_wagered)
+        won_str = format_usd(total_won)
         
         # Calculate profit/loss
         net_result = total_won - total_wagered
         net_emoji = "📈" if net_result >= 0 else "📉"
-        net_str = await format_usd(abs(net_result))
+        net_str = format_usd(abs(net_result))
         
         welcome_text = f"""
 🎰 <b>AXIS CASINO</b>
@@ -2254,7 +6305,7 @@ Welcome, {username}! 👋
             )
             return
         
-        balance_str = await format_usd(user['balance'])
+        balance_str = format_usd(user['balance'])
         
         text = f"""
 💳 <b>DEPOSIT</b>
@@ -2264,247 +6315,109 @@ Welcome, {username}! 👋
 🪙 Litecoin (LTC) - Fast & secure
 • Min: $1.00 • Instant processing
 """
-        
-        keyboard = [
-            [InlineKeyboardButton("🪙 Deposit Litecoin (LTC)", callback_data="deposit_LTC")],
-            [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]
-        ]
-        
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
-    
-    application.add_handler(CommandHandler("deposit", deposit_command_handler))
-    
-    # Referral command handler
-    async def referral_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /referral command"""
-        user_id = update.effective_user.id
-        referral_code = await get_or_create_referral_code(user_id)
-        stats = await get_referral_stats(user_id)
-        
-        # Get bot username
-        try:
-            bot = await context.bot.get_me()
-            bot_username = bot.username
-        except:
-            bot_username = "AxisCasinoBot"
-        
-        # Generate referral link
-        referral_link = get_referral_link(bot_username, referral_code)
-        
-        earnings_str = await format_usd(stats['earnings'])
-        
-        text = f"""
-👥 <b>REFERRAL PROGRAM</b>
-
-Invite friends and earn rewards!
-
-🔗 <b>Your Referral Link:</b>
-<code>{referral_link}</code>
-
-📊 <b>Your Stats:</b>
-👥 Total Referrals: <b>{stats['count']}</b>
-💰 Total Earned: <b>{earnings_str}</b>
-
-<b>How it works:</b>
-1. Share your link with friends
-2. They sign up using your link
-3. You earn rewards when they play
-
-<i>Start sharing and earning today!</i>
-"""
-        
-        # Add recent referrals if any
-        if stats['recent']:
-            text += "\n\n📋 <b>Recent Referrals:</b>\n"
-            for ref in stats['recent'][:5]:
-                username = ref['username'] or 'User'
-                bonus = ref['bonus']
-                text += f"• {username} - Earned: ${bonus:.2f}\n"
-        
-        keyboard = [
-            [InlineKeyboardButton("� Share Link", url=f"https://t.me/share/url?url={referral_link}&text=Join this amazing casino bot!")],
-            [InlineKeyboardButton("🔄 Refresh Stats", callback_data="referral_menu")],
-            [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]
-        ]
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
-    
-    application.add_handler(CommandHandler("referral", referral_command_handler))
-    
-    # Game command handlers
-    async def slots_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /slots command"""
-        user_id = update.effective_user.id
-        user = await get_user(user_id)
-        
-        if not user:
-            await update.message.reply_text(
-                "❌ User not found. Please use /start to register first.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Start", callback_data="main_panel")]])
-            )
-            return
-        
-        balance_str = await format_usd(user['balance'])
-        
-        text = f"""
-🎰 <b>SLOTS</b>
-
-💰 Balance: {balance_str}
-
-<b>Payouts:</b>
-🍒🍒🍒 10x • 🍋🍋🍋 20x • 🍊🍊🍊 30x
-🔔🔔🔔 50x • 💎💎💎 100x
-
-Choose bet:
-"""
-    
-        keyboard = [
-            [
-                InlineKeyboardButton("$1", callback_data="slots_bet_1"),
-                InlineKeyboardButton("$5", callback_data="slots_bet_5"),
-                InlineKeyboardButton("$10", callback_data="slots_bet_10")
-            ],
-            [
-                InlineKeyboardButton("$25", callback_data="slots_bet_25"),
-                InlineKeyboardButton("$50", callback_data="slots_bet_50"),
-                InlineKeyboardButton("$100", callback_data="slots_bet_100")
-            ],
-            [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-        ]
-        
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
-    
-    async def blackjack_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /blackjack command"""
-        user_id = update.effective_user.id
-        user = await get_user(user_id)
-        
-        if not user:
-            await update.message.reply_text(
-                "❌ User not found. Please use /start to register first.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Start", callback_data="main_panel")]])
-            )
-            return
-        
-        balance_str = await format_usd(user['balance'])
-        
-        text = f"""
-🃏 <b>BLACKJACK</b>
-
-💰 Balance: {balance_str}
-
-<b>Rules:</b>
-Get to 21 • Beat dealer • Blackjack pays 3:2
-
-<b>Card Values:</b>
-Numbers = face • Face cards = 10 • Ace = 1 or 11
-
-Choose bet:
-"""
-    
-        keyboard = [
-            [
-                InlineKeyboardButton("$1", callback_data="blackjack_bet_1"),
-                InlineKeyboardButton("$5", callback_data="blackjack_bet_5"),
-                InlineKeyboardButton("$10", callback_data="blackjack_bet_10")
-            ],
-            [
-                InlineKeyboardButton("$25", callback_data="blackjack_bet_25"),
-                InlineKeyboardButton("$50", callback_data="blackjack_bet_50"),
-                InlineKeyboardButton("$100", callback_data="blackjack_bet_100")
-            ],
-            [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-        ]
-        
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
-
-    async def dice_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /dice command"""
-        user_id = update.effective_user.id
-        user = await get_user(user_id)
-        
-        if not user:
-            await update.message.reply_text(
-                "❌ User not found. Please use /start to register first.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Start", callback_data="main_panel")]])
-            )
-            return
-        
-        balance_str = await format_usd(user['balance'])
-        
-        text = f"""
-🎲 <b>DICE</b>
-
-💰 Balance: {balance_str}
-
-<b>Options:</b>
-HIGH (8-12) = 2x • LOW (2-7) = 2x • Lucky 7 = 5x
-
-Choose bet:
-"""
-    
-        keyboard = [
-            [
-                InlineKeyboardButton("$1", callback_data="dice_bet_1"),
-                InlineKeyboardButton("$5", callback_data="dice_bet_5"),
-                InlineKeyboardButton("$10", callback_data="dice_bet_10")
-            ],
-            [
-                InlineKeyboardButton("$25", callback_data="dice_bet_25"),
-                InlineKeyboardButton("$50", callback_data="dice_bet_50"),
-                InlineKeyboardButton("$100", callback_data="dice_bet_100")
-            ],
-            [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
+        
+        keyboard = [
+            [InlineKeyboardButton("🪙 Deposit Litecoin (LTC)", callback_data="deposit_LTC")],
+            [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]
         ]
         
         await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
-
-    async def roulette_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /roulette command"""
+    
+    application.add_handler(CommandHandler("deposit", deposit_command_handler))
+    
+    # Referral command handler
+    async def referral_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /referral command"""
         user_id = update.effective_user.id
-        user = await get_user(user_id)
+        referral_code = await get_or_create_referral_code(user_id)
+        stats = await get_referral_stats(user_id)
         
-        if not user:
-            await update.message.reply_text(
-                "❌ User not found. Please use /start to register first.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Start", callback_data="main_panel")]])
-            )
-            return
+        # Get bot username
+        try:
+            bot = await context.bot.get_me()
+            bot_username = bot.username
+        except:
+            bot_username = "AxisCasinoBot"
         
-        balance_str = await format_usd(user['balance'])
+        # Generate referral link
+        referral_link = get_referral_link(bot_username, referral_code)
+        
+        earnings_str = format_usd(stats['earnings'])
+        pending_str = format_usd(stats['pending'])
         
         text = f"""
-🎯 <b>ROULETTE</b>
+👥 <b>REFERRAL PROGRAM</b>
 
-💰 Balance: {balance_str}
+Invite friends and earn rewards!
 
-<b>Bet Options:</b>
-• Red/Black: 2x payout
-• Odd/Even: 2x payout  
-• High/Low: 2x payout
-• Single Number: 36x payout
+🔗 <b>Your Referral Link:</b>
+<code>{referral_link}</code>
 
-Choose your bet type:
+📊 <b>Your Stats:</b>
+👥 Total Referrals: <b>{stats['count']}</b>
+💰 Paid Out: <b>{earnings_str}</b>
+⏳ Pending: <b>{pending_str}</b>
+
+<b>How it works:</b>
+1. Share your link with friends
+2. They sign up using your link
+3. You earn rewards when they play
+
+<i>Start sharing and earning today!</i>
 """
-    
+        
+        # Add recent referrals if any
+        if stats['recent']:
+            text += "\n\n📋 <b>Recent Referrals:</b>\n"
+            for ref in stats['recent'][:5]:
+                username = ref['username'] or 'User'
+                bonus = ref['bonus']
+                text += f"• {username} - Earned: {format_money(bonus)}\n"
+        
         keyboard = [
-            [
-                InlineKeyboardButton("🔴 Red", callback_data="roulette_red"),
-                InlineKeyboardButton("⚫ Black", callback_data="roulette_black")
-            ],
-            [
-                InlineKeyboardButton("📈 Odd", callback_data="roulette_odd"),
-                InlineKeyboardButton("📊 Even", callback_data="roulette_even")
-            ],
-            [
-                InlineKeyboardButton("⬇️ Low (1-18)", callback_data="roulette_low"),
-                InlineKeyboardButton("⬆️ High (19-36)", callback_data="roulette_high")
-            ],
-            [InlineKeyboardButton("🎯 Pick Number", callback_data="roulette_number")],
-            [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
+            [InlineKeyboardButton("� Share Link", url=f"https://t.me/share/url?url={referral_link}&text=Join this amazing casino bot!")],
+            [InlineKeyboardButton("🔄 Refresh Stats", callback_data="referral_menu")],
+            [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]
         ]
-        
         await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
     
+    application.add_handler(CommandHandler("referral", referral_command_handler))
+    
+    def leaderboard_keyboard(board_name: str) -> InlineKeyboardMarkup:
+        """Board switcher; the current board is marked"""
+        def button(name: str, label: str) -> InlineKeyboardButton:
+            return InlineKeyboardButton(("• " if name == board_name else "") + label, callback_data=f"leaderboard_{name}")
+        return InlineKeyboardMarkup([
+            [button("wagered_day", "Wagered Today"), button("wagered_week", "Wagered Week")],
+            [button("win_day", "Big Win Today"), button("win_week", "Big Win Week")],
+            [button("referrers", "Top Referrers")],
+            [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]
+        ])
+    
+    async def leaderboard_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /leaderboard command"""
+        text = await format_leaderboard("wagered_day", update.effective_user.id)
+        await update.message.reply_text(text, reply_markup=leaderboard_keyboard("wagered_day"), parse_mode=ParseMode.HTML)
+    
+    application.add_handler(CommandHandler("leaderboard", leaderboard_command_handler))
+    
+    # Game command handlers
+    async def slots_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /slots command"""
+        await show_game_menu(update, "slots")
+    
+    async def blackjack_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /blackjack command"""
+        await show_game_menu(update, "blackjack")
+
+    async def dice_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /dice command"""
+        await show_game_menu(update, "dice")
+
+    async def roulette_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /roulette command"""
+        await show_game_menu(update, "roulette")
+    
     async def games_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /games command - show games menu"""
         user_id = update.effective_user.id
@@ -2518,7 +6431,7 @@ Choose your bet type:
             return
         
         balance = user['balance']
-        balance_str = await format_usd(balance)
+        balance_str = format_usd(balance)
         
         if balance < 1.0:
             text = f"""
@@ -2590,57 +6503,18 @@ Good luck! 🍀
     # Help command handler
     async def help_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
-        text = f"""
-<b>🎰 AXIS CASINO - HELP</b>
-
-<b>🚀 Getting Started:</b>
-• /start - Access your main panel
-• Make a deposit to start playing
-• Choose games & place bets
-• Withdraw your winnings anytime
-
-<b>🎮 Game Commands:</b>
-• /games - Show all available games
-• /slots - Play slots directly
-• /blackjack - Play blackjack directly
-• /dice - Play dice directly
-• /roulette - Play roulette directly
-
-<b>💰 Money Commands:</b>
-• /deposit - Make a deposit
-• /referral - View referral program & earn commissions
-
-<b>💳 Payment Info:</b>
-• Litecoin (LTC) supported
-• Minimum deposit: $1.00
-• Minimum withdrawal: $1.00
-• Withdrawal fee: 2% (min $1.00)
-• Fast & secure transactions
-
-<b>🎁 Bonuses:</b>
-• Weekly bonus: $5.00 every 7 days
-• Referral rewards: Earn when your referrals play
-
-<b>📞 Support:</b>
-Need help? Contact our support team!
-
-Good luck at the tables! 🍀
-"""
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("🎮 Play Games", callback_data="mini_app_centre"),
-                InlineKeyboardButton("💳 Deposit", callback_data="deposit")
-            ],
-            [
-                InlineKeyboardButton("👥 Referrals", callback_data="referral_menu"),
-                InlineKeyboardButton("🏠 Main Menu", callback_data="main_panel")
-            ]
-        ]
-        
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(HELP_COMMAND_TEXT, reply_markup=HELP_COMMAND_KEYBOARD, parse_mode=ParseMode.HTML)
     
     application.add_handler(CommandHandler("help", help_command_handler))
+    
+    # Admin broadcast commands
+    application.add_handler(CommandHandler("broadcast", broadcast_command_handler))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status_command_handler))
+    application.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_command_handler))
+    application.add_handler(CommandHandler("backfill_stats", backfill_stats_command_handler))
+    application.add_handler(CommandHandler("backfill_player_stats", backfill_player_stats_command_handler))
+    application.add_handler(CommandHandler("config", config_command_handler))
+    application.add_handler(CommandHandler("campaign", campaign_command_handler))
 
     # Basic callback handlers for user panel navigation
     async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2671,12 +6545,59 @@ Good luck at the tables! 🍀
             await referral_menu_callback(update, context)
         elif data == "user_stats":
             await user_stats_callback(update, context)
+        elif data == "achievements":
+            await achievements_callback(update, context)
+        elif data == "leaderboard":
+            await leaderboard_callback(update, context)
+        elif data.startswith("leaderboard_") and data[len("leaderboard_"):] in LEADERBOARDS:
+            await leaderboard_callback(update, context, data[len("leaderboard_"):])
         elif data == "commands_menu":
             await commands_menu_callback(update, context)
         elif data == "help_menu":
             await help_menu_callback(update, context)
         elif data == "admin_panel" and (is_admin(user_id) or is_owner(user_id)):
             await admin_panel_callback(update, context)
+        elif data == "admin_performance" and (is_admin(user_id) or is_owner(user_id)):
+            await admin_performance_callback(update, context)
+        elif data == "admin_profiler_toggle" and (is_admin(user_id) or is_owner(user_id)):
+            await admin_profiler_toggle_callback(update, context)
+        elif data == "admin_reconcile" and (is_admin(user_id) or is_owner(user_id)):
+            await admin_reconcile_callback(update, context)
+        elif data == "admin_reconcile_run" and (is_admin(user_id) or is_owner(user_id)):
+            await reconcile()
+            await admin_reconcile_callback(update, context)
+        elif data == "admin_reconcile_full" and (is_admin(user_id) or is_owner(user_id)):
+            started = start_full_reconciliation(user_id)
+            await admin_reconcile_callback(
+                update, context,
+                notice="Full rebuild started; the report will be sent to you." if started else "A full rebuild is already running."
+            )
+        elif data.startswith("admin_analytics") and (is_admin(user_id) or is_owner(user_id)):
+            days = data[len("admin_analytics_"):]
+            await admin_analytics_callback(update, context, int(days) if days.isdigit() and 0 < int(days) <= 365 else 7)
+        elif data == "admin_settings" and (is_admin(user_id) or is_owner(user_id)):
+            await admin_settings_callback(update, context)
+        elif data == "admin_maintenance_toggle" and (is_admin(user_id) or is_owner(user_id)):
+            await set_config_value("maintenance_mode", "false" if config.maintenance_mode else "true", user_id)
+            await admin_settings_callback(update, context)
+        elif data == "admin_transactions" and (is_admin(user_id) or is_owner(user_id)):
+            await admin_transactions_callback(update, context)
+        elif data.startswith("admin_tx_") and (is_admin(user_id) or is_owner(user_id)):
+            kind, _, before = data[len("admin_tx_"):].rpartition("_")
+            if kind in TRANSACTION_FILTERS and before.isdigit():
+                await admin_transactions_callback(update, context, kind, int(before) or None)
+            else:
+                await admin_transactions_callback(update, context)
+        elif data.startswith("admin_users") and (is_admin(user_id) or is_owner(user_id)):
+            # admin_users[_<sort>[_<value>_<user_id>]]
+            sort, _, cursor = data[len("admin_users_"):].partition("_")
+            value, _, after_id = cursor.rpartition("_")
+            if sort not in USER_SORTS:
+                await admin_users_callback(update, context)
+            elif value and after_id.isdigit():
+                await admin_users_callback(update, context, sort, (value, int(after_id)))
+            else:
+                await admin_users_callback(update, context, sort)
         elif data == "bonus_menu":
             await bonus_menu_callback(update, context)
         # Game handlers - only include working games
@@ -2719,6 +6640,10 @@ Good luck at the tables! 🍀
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Back to Games", callback_data="mini_app_centre")]]),
                 parse_mode=ParseMode.HTML
             )
+        elif data == "promotions":
+            await promotions_callback(update, context)
+        elif data.startswith("bonus_claim_") and data[len("bonus_claim_"):].isdigit():
+            await bonus_claim_callback(update, context, int(data[len("bonus_claim_"):]))
         elif data == "weekly_bonus":
             await weekly_bonus_callback(update, context)
         elif data == "claim_weekly_bonus":
@@ -2739,22 +6664,22 @@ Good luck at the tables! 🍀
             user = await create_user(user_id, username)
         
         # Get user stats
-        balance = user.get('balance', 0.0)
+        balance = user.get('balance', 0)
         games_played = user.get('games_played', 0)
-        total_wagered = user.get('total_wagered', 0.0)
-        total_won = user.get('total_won', 0.0)
+        total_wagered = user.get('total_wagered', 0)
+        total_won = user.get('total_won', 0)
         win_streak = user.get('win_streak', 0)
         referral_count = user.get('referral_count', 0)
         
         referral_code = await get_or_create_referral_code(user_id)
         
-        balance_str = await format_usd(balance)
-        wagered_str = await format_usd(total_wagered)
-        won_str = await format_usd(total_won)
+        balance_str = format_usd(balance)
+        wagered_str = format_usd(total_wagered)
+        won_str = format_usd(total_won)
         
         net_result = total_won - total_wagered
         net_emoji = "📈" if net_result >= 0 else "📉"
-        net_str = await format_usd(abs(net_result))
+        net_str = format_usd(abs(net_result))
         
         welcome_text = f"""
 🎰 <b>AXIS CASINO</b>
@@ -2807,7 +6732,7 @@ Welcome, {username}! 👋
             return
         
         balance = user['balance']
-        balance_str = await format_usd(balance)
+        balance_str = format_usd(balance)
         
         # Always show games, but add warning if balance is insufficient
         if balance < 1.0:
@@ -2899,7 +6824,8 @@ Withdraw your winnings securely:
         # Generate referral link
         referral_link = get_referral_link(bot_username, referral_code)
         
-        earnings_str = await format_usd(stats['earnings'])
+        earnings_str = format_usd(stats['earnings'])
+        pending_str = format_usd(stats['pending'])
         
         text = f"""
 👥 <b>REFERRAL PROGRAM</b>
@@ -2911,7 +6837,8 @@ Invite friends and earn rewards!
 
 📊 <b>Your Stats:</b>
 👥 Total Referrals: <b>{stats['count']}</b>
-💰 Total Earned: <b>{earnings_str}</b>
+💰 Paid Out: <b>{earnings_str}</b>
+⏳ Pending: <b>{pending_str}</b>
 
 <b>How it works:</b>
 1. Share your link with friends
@@ -2927,7 +6854,7 @@ Invite friends and earn rewards!
             for ref in stats['recent'][:5]:
                 username = ref['username'] or 'User'
                 bonus = ref['bonus']
-                text += f"• {username} - Earned: ${bonus:.2f}\n"
+                text += f"• {username} - Earned: {format_money(bonus)}\n"
         
         keyboard = [
             [InlineKeyboardButton("� Share Link", url=f"https://t.me/share/url?url={referral_link}&text=Join this amazing casino bot!")],
@@ -2946,12 +6873,17 @@ Invite friends and earn rewards!
             return
         
         # Format all stats
-        balance_str = await format_usd(user.get('balance', 0.0))
-        wagered_str = await format_usd(user.get('total_wagered', 0.0))
-        won_str = await format_usd(user.get('total_won', 0.0))
-        deposited_str = await format_usd(user.get('total_deposited', 0.0))
-        withdrawn_str = await format_usd(user.get('total_withdrawn', 0.0))
-        biggest_win_str = await format_usd(user.get('biggest_win', 0.0))
+        balance_str = format_usd(user.get('balance', 0))
+        wagered_str = format_usd(user.get('total_wagered', 0))
+        won_str = format_usd(user.get('total_won', 0))
+        deposited_str = format_usd(user.get('total_deposited', 0))
+        withdrawn_str = format_usd(user.get('total_withdrawn', 0))
+        biggest_win_str = format_usd(user.get('biggest_win', 0))
+        next_threshold = vip_next_threshold(user.get('vip_level', 0))
+        vip_progress = "" if next_threshold == math.inf else (
+            f" ({format_money(max(next_threshold - user.get('total_wagered', 0), 0))} to "
+            f"{vip_tier(user.get('vip_level', 0) + 1).name})"
+        )
         
         text = f"""
 <b>YOUR STATISTICS</b>
@@ -2966,78 +6898,41 @@ Invite friends and earn rewards!
 <b>Performance:</b>
 🔥 Streak: {user.get('win_streak', 0)} (Max: {user.get('max_win_streak', 0)})
 💎 Biggest Win: {biggest_win_str}
-⭐ VIP Level: {user.get('vip_level', 0)}
+⭐ VIP: {vip_tier(user.get('vip_level', 0)).name}{vip_progress}
 
 Member since: {user.get('created_at', '')[:10] if user.get('created_at') else 'Unknown'}
 """
-        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="main_panel")]]
+        keyboard = [
+            [
+                InlineKeyboardButton("🏆 Leaderboards", callback_data="leaderboard"),
+                InlineKeyboardButton("🏅 Achievements", callback_data="achievements")
+            ],
+            [InlineKeyboardButton("Back to Menu", callback_data="main_panel")]
+        ]
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def achievements_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show unlocked achievements and progress towards the rest"""
+        user = await get_user(update.callback_query.from_user.id)
+        if not user:
+            await update.callback_query.edit_message_text("❌ User not found.")
+            return
+        text = f"🏅 <b>ACHIEVEMENTS</b>\n\n{format_achievements(user)}"
+        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="user_stats")]]
         await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
     
+    async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, board_name: str = "wagered_day"):
+        """Show a leaderboard with the player's own rank"""
+        text = await format_leaderboard(board_name, update.callback_query.from_user.id)
+        await update.callback_query.edit_message_text(text, reply_markup=leaderboard_keyboard(board_name), parse_mode=ParseMode.HTML)
+    
     async def commands_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show commands menu with clickable command buttons"""
-        text = f"""
-⚡ <b>BOT COMMANDS</b> ⚡
-
-<b>🎮 Game Commands:</b>
-• /games - All games menu
-• /slots - Play slots directly
-• /blackjack - Play blackjack directly
-• /dice - Play dice directly
-• /roulette - Play roulette directly
-
-<b>💰 Money Commands:</b>
-• /deposit - Make a deposit
-• /referral - Referral program
-
-<b>ℹ️ Info Commands:</b>
-• /start - Main menu
-• /help - Full help guide
-
-<b>🚀 Quick Tips:</b>
-• Type any command in chat
-• Commands work anywhere in the bot
-"""
-        
-        keyboard = [
-            [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_panel")]
-        ]
-        
-        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+        await update.callback_query.edit_message_text(COMMANDS_MENU_TEXT, reply_markup=COMMANDS_MENU_KEYBOARD, parse_mode=ParseMode.HTML)
     
     async def help_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show help menu"""
-        text = f"""
-<b>HELP & SUPPORT</b>
-
-<b>Getting Started:</b>
-• /start - Access your panel
-• Deposit funds to play
-• Choose games & place bets
-• Withdraw your winnings
-
-<b>Game Commands:</b>
-• /games - Show all games
-• /slots - Play slots directly
-• /blackjack - Play blackjack directly
-• /dice - Play dice directly
-• /roulette - Play roulette directly
-
-<b>Other Commands:</b>
-• /deposit - Make a deposit
-• /referral - View referral program
-
-<b>Payments:</b>
-• Litecoin (LTC) supported
-• Fast & secure transactions
-
-Need help? Contact support.
-"""
-        keyboard = [
-            [InlineKeyboardButton("Game Rules", callback_data="game_rules")],
-            [InlineKeyboardButton("Support", url="https://t.me/casino_support")],
-            [InlineKeyboardButton("Back to Menu", callback_data="main_panel")]
-        ]
-        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+        await update.callback_query.edit_message_text(HELP_MENU_TEXT, reply_markup=HELP_MENU_KEYBOARD, parse_mode=ParseMode.HTML)
     
     async def admin_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show admin panel (admin only)"""
@@ -3064,12 +6959,219 @@ Need help? Contact support.
                 InlineKeyboardButton("Analytics", callback_data="admin_analytics"),
                 InlineKeyboardButton("Settings", callback_data="admin_settings")
             ],
+            [
+                InlineKeyboardButton("Performance", callback_data="admin_performance"),
+                InlineKeyboardButton("Reconciliation", callback_data="admin_reconcile")
+            ],
             [
                 InlineKeyboardButton("Back to Menu", callback_data="main_panel")
             ]
         ]
         await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
     
+    async def admin_performance_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, profiler_report: str = ""):
+        """Show slow update traces and the profiler toggle (admin only)"""
+        if profiler_report:
+            text = f"<b>PROFILER REPORT</b>\n\n<pre>{html.escape(profiler_report[:3500])}</pre>"
+        else:
+            status = "running" if profiler_running() else "stopped"
+            text = f"<b>PERFORMANCE</b>\n\nSlow threshold: {SLOW_UPDATE_MS:.0f}ms\nProfiler: <b>{status}</b>\n\n"
+            if recent_slow_traces:
+                finished_at, lines = recent_slow_traces[-1]
+                text += f"<b>Latest slow update ({finished_at}):</b>\n<pre>{html.escape(chr(10).join(lines[:30]))}</pre>"
+                text += f"\n{len(recent_slow_traces)} slow update(s) recorded."
+            else:
+                text += "No slow updates recorded."
+        keyboard = [
+            [InlineKeyboardButton("Stop Profiler" if profiler_running() else "Start Profiler", callback_data="admin_profiler_toggle")],
+            [InlineKeyboardButton("Refresh", callback_data="admin_performance")],
+            [InlineKeyboardButton("Back to Admin", callback_data="admin_panel")]
+        ]
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def admin_profiler_toggle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Start or stop the cProfile session"""
+        if profiler_running():
+            await admin_performance_callback(update, context, profiler_report=stop_profiler())
+        else:
+            start_profiler()
+            await admin_performance_callback(update, context)
+    
+    async def admin_reconcile_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, notice: str = ""):
+        """Show the latest reconciliation report and watermarks (admin only)"""
+        last = await get_last_reconciliation()
+        text = "<b>RECONCILIATION</b>\n\n"
+        if notice:
+            text += f"<i>{notice}</i>\n\n"
+        if last:
+            state = last['state']
+            text += (f"Watermarks: session #{state['last_session_id']}, ledger txn #{state['last_txn_id']}\n"
+                     f"Last full rebuild: {state['last_full_at'] or 'never'}\n"
+                     f"Bonuses and referral commissions not in house balance: {format_money(state['promotions'])}\n\n")
+            report = last['report']
+            if report:
+                text += (f"<b>Last run</b> ({report['mode']}, {report['created_at']}):\n"
+                         f"{report['sessions_checked']} sessions, {report['transactions_checked']} transactions, "
+                         f"{report['users_checked']} users in {report['duration_ms']:.0f}ms\n\n")
+                if report['mismatches']:
+                    text += format_reconciliation_alert(report['mode'], report['mismatches']).split("\n", 2)[-1]
+                else:
+                    text += "✅ No mismatches."
+            else:
+                text += "No runs yet."
+        keyboard = [
+            [
+                InlineKeyboardButton("Run Now", callback_data="admin_reconcile_run"),
+                InlineKeyboardButton("Full Rebuild", callback_data="admin_reconcile_full")
+            ],
+            [InlineKeyboardButton("Back to Admin", callback_data="admin_panel")]
+        ]
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def admin_analytics_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, days: int = 7):
+        """Show per-game volume and RTP charts from the game statistics rollups (admin only)"""
+        analytics = await get_game_analytics(days)
+        games = sorted(analytics['games'].items(), key=lambda item: item[1]['wagered'], reverse=True)
+        period = "today" if days == 1 else f"last {days} days"
+        text = f"<b>ANALYTICS</b> ({period})\n\n"
+        
+        if games:
+            total_wagered = sum(game['wagered'] for _, game in games)
+            total_won = sum(game['won'] for _, game in games)
+            total_rtp = 100.0 * total_won / total_wagered if total_wagered else 0.0
+            text += (f"Bets: {sum(game['sessions'] for _, game in games):,}\n"
+                     f"Volume: {format_money(total_wagered)}\n"
+                     f"House profit: {format_money(total_wagered - total_won)}\n"
+                     f"RTP: {total_rtp:.1f}%\n\n")
+            
+            rows = [f"{'Game':<11}{'Bets':>7}{'Players/d':>10}{'Jackpots':>9}"]
+            for game_type, game in games:
+                rows.append(f"{game_type[:10]:<11}{game['sessions']:>7,}{game['avg_players']:>10,}{game['jackpots']:>9,}")
+            text += f"<pre>{html.escape(chr(10).join(rows))}</pre>\n"
+            
+            top_volume = games[0][1]['wagered']
+            rows = [f"{game_type[:10]:<11}{text_bar(game['wagered'], top_volume):<{ADMIN_CHART_WIDTH}} {format_money(game['wagered'])}"
+                    for game_type, game in games]
+            text += f"<b>Volume</b>\n<pre>{html.escape(chr(10).join(rows))}</pre>\n"
+            
+            top_rtp = max(max(game['rtp'] for _, game in games), 100.0)
+            rows = [f"{game_type[:10]:<11}{text_bar(game['rtp'], top_rtp):<{ADMIN_CHART_WIDTH}} {game['rtp']:.1f}%"
+                    for game_type, game in games]
+            text += f"<b>RTP</b> (full bar = {top_rtp:.0f}%)\n<pre>{html.escape(chr(10).join(rows))}</pre>\n"
+            
+            if days > 1:
+                top_day = max(analytics['daily'].values())
+                rows = [f"{day[5:]}  {text_bar(volume, top_day):<{ADMIN_CHART_WIDTH}} {format_money(volume)}"
+                        for day, volume in analytics['daily'].items()]
+                text += f"<b>Daily volume</b>\n<pre>{html.escape(chr(10).join(rows))}</pre>\n"
+        else:
+            text += "No bets in this period.\n\n"
+        
+        activity = await get_activity_stats(days)
+        if activity['daily']:
+            dau = [day['users'] for day in activity['daily'].values()]
+            text += (f"<b>Activity</b>\n"
+                     f"DAU: {dau[-1]:,} latest, {sum(dau) // len(dau):,} avg · "
+                     f"Sessions: {sum(day['sessions'] for day in activity['daily'].values()):,}\n")
+            retention = " · ".join(f"D{offset} {value:.0f}%" for offset, value in activity['retention'].items()
+                                   if value is not None)
+            if retention:
+                text += f"Retention: {retention}\n"
+            text += "\n"
+        
+        top_wagerers = await get_top_users("total_wagered")
+        if top_wagerers:
+            text += "<b>Top wagerers</b> (all time)\n"
+            for rank, user in enumerate(top_wagerers, 1):
+                text += f"{rank}. {html.escape(user['username'] or str(user['user_id']))} - {format_money(user['total_wagered'])}\n"
+        
+        keyboard = [
+            [
+                InlineKeyboardButton("Today", callback_data="admin_analytics_1"),
+                InlineKeyboardButton("7 Days", callback_data="admin_analytics_7"),
+                InlineKeyboardButton("30 Days", callback_data="admin_analytics_30")
+            ],
+            [InlineKeyboardButton("Back to Admin", callback_data="admin_panel")]
+        ]
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def admin_transactions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                          kind: str = "all", before: Optional[int] = None):
+        """Show a page of ledger transactions, newest first (admin only)"""
+        page = await list_transactions_page(kind, before)
+        text = f"<b>TRANSACTIONS</b> - {TRANSACTION_FILTERS[kind]}\n\n"
+        if page:
+            for txn in page:
+                reference = f" ({html.escape(txn['reference'])})" if txn['reference'] else ""
+                sign = "+" if txn['amount'] >= 0 else "-"
+                text += (f"#{txn['txn_id']} {str(txn['created_at'])[:16].replace('T', ' ')}\n"
+                         f"  <code>{txn['user_id']}</code> {txn['kind']}{reference} "
+                         f"{sign}{format_money(abs(txn['amount']))} → {format_money(txn['balance_after'])}\n")
+        else:
+            text += "No transactions found."
+        
+        codes = list(TRANSACTION_FILTERS)
+        keyboard = [
+            [InlineKeyboardButton(("• " if code == kind else "") + TRANSACTION_FILTERS[code], callback_data=f"admin_tx_{code}_0")
+             for code in codes[i:i + 4]]
+            for i in range(0, len(codes), 4)
+        ]
+        navigation = []
+        if before is not None:
+            navigation.append(InlineKeyboardButton("« Newest", callback_data=f"admin_tx_{kind}_0"))
+        if len(page) == ADMIN_PAGE_SIZE:
+            navigation.append(InlineKeyboardButton("Older ›", callback_data=f"admin_tx_{kind}_{page[-1]['txn_id']}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("Back to Admin", callback_data="admin_panel")])
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def admin_users_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                   sort: str = "balance", after: Optional[Tuple[str, int]] = None):
+        """Show a page of users ordered by balance, volume or activity (admin only)"""
+        counts = await get_user_counts()
+        page = await list_users_page(sort, after)
+        column = USER_SORTS[sort][0]
+        text = (f"<b>USER MANAGEMENT</b>\n\n"
+                f"Users: {counts['total']:,} ({counts['active_today']:,} active today)\n"
+                f"Sorted by: {USER_SORTS[sort][1]}\n\n")
+        if page:
+            for user in page:
+                banned = " 🚫" if user['is_banned'] else ""
+                text += (f"<code>{user['user_id']}</code> {html.escape(user['username'] or '')}{banned}\n"
+                         f"  Balance {format_money(user['balance'])} · Wagered {format_money(user['total_wagered'])} · "
+                         f"{user['games_played']:,} games · {str(user['last_active'] or '-')[:10]}\n")
+        else:
+            text += "No users found."
+        
+        keyboard = [[
+            InlineKeyboardButton(("• " if code == sort else "") + label, callback_data=f"admin_users_{code}")
+            for code, (_, label) in USER_SORTS.items()
+        ]]
+        navigation = []
+        if after is not None:
+            navigation.append(InlineKeyboardButton("« Top", callback_data=f"admin_users_{sort}"))
+        if len(page) == ADMIN_PAGE_SIZE:
+            last = page[-1]
+            navigation.append(InlineKeyboardButton("Next ›", callback_data=f"admin_users_{sort}_{last[column]}_{last['user_id']}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("Back to Admin", callback_data="admin_panel")])
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def admin_settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show the runtime config snapshot and the maintenance toggle (admin only)"""
+        lines = [f"{key} = {format_config_value(key, getattr(config, key))}" for key in CONFIG_FIELDS]
+        text = (f"<b>SETTINGS</b> (version {config.version})\n\n"
+                f"<pre>{html.escape(chr(10).join(lines))}</pre>\n"
+                "Change a value with /config &lt;key&gt; &lt;value&gt;; it applies without a restart.")
+        keyboard = [
+            [InlineKeyboardButton("End Maintenance" if config.maintenance_mode else "Start Maintenance",
+                                  callback_data="admin_maintenance_toggle")],
+            [InlineKeyboardButton("Back to Admin", callback_data="admin_panel")]
+        ]
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
     async def bonus_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show bonuses menu"""
         text = """
@@ -3085,14 +7187,56 @@ More coming soon!
 """
         keyboard = [
             [InlineKeyboardButton("Claim Weekly Bonus", callback_data="claim_weekly_bonus")],
+            [InlineKeyboardButton("🎟 Promotions", callback_data="promotions")],
             [InlineKeyboardButton("Back to Menu", callback_data="main_panel")]
         ]
         await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
     
+    async def promotions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show running campaigns and the player's wagering progress"""
+        user_id = update.callback_query.from_user.id
+        text = "🎟 <b>PROMOTIONS</b>\n\n"
+        keyboard = []
+        campaigns = [c for type in BONUS_TYPES for c in live_campaigns(type)]
+        for campaign in campaigns:
+            text += f"• <b>{html.escape(campaign.name)}</b>\n  {describe_campaign(campaign)}\n"
+            if campaign.type == "free_spins":
+                keyboard.append([InlineKeyboardButton(f"🎰 {campaign.name}", callback_data=f"bonus_claim_{campaign.campaign_id}")])
+        if not campaigns:
+            text += "No promotions are running right now.\n"
+        
+        claims = await get_active_claims(user_id)
+        if claims:
+            text += "\n<b>Your active bonuses</b>\n"
+            for claim in claims:
+                text += (
+                    f"• {html.escape(claim['name'])}: {format_money(claim['amount'])}\n"
+                    f"  {text_bar(claim['wagered_amount'], claim['wagering_requirement'])} "
+                    f"{format_money(claim['wagered_amount'])} / {format_money(claim['wagering_requirement'])} wagered, "
+                    f"expires {claim['expires_at'][:10]}\n"
+                )
+        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="bonus_menu")])
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
+    async def bonus_claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, campaign_id: int):
+        """Play a free spins campaign"""
+        user_id = update.callback_query.from_user.id
+        result = await claim_free_spins(user_id, campaign_id)
+        if result is None:
+            text = "❌ This promotion is not available - it may have ended or you have already claimed it."
+        else:
+            spins, winnings = result
+            text = "🎰 <b>FREE SPINS</b>\n\n" + "\n".join(" ".join(reels) for reels in spins)
+            text += f"\n\n💰 Won: {format_money(winnings)}"
+            if winnings and _campaigns[campaign_id].wagering:
+                text += f"\n🎯 Wager {format_money(int(winnings * _campaigns[campaign_id].wagering))} to unlock withdrawals."
+        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="promotions")]]
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    
     async def weekly_bonus_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show weekly bonus information"""
         user_id = update.callback_query.from_user.id
-        can_claim, seconds_remaining = await can_claim_weekly_bonus(user_id)
+        can_claim, seconds_remaining = can_claim_weekly_bonus(user_id)
         
         if can_claim:
             text = f"""
@@ -3100,7 +7244,7 @@ More coming soon!
 
 ✅ <b>Available!</b>
 
-💰 Bonus: ${WEEKLY_BONUS_AMOUNT}
+💰 Bonus: {format_money(WEEKLY_BONUS_AMOUNT)}
 🎯 Frequency: Every {WEEKLY_BONUS_INTERVAL} days
 
 Click below to claim!
@@ -3119,7 +7263,7 @@ Click below to claim!
 
 ⏰ <b>Not Available Yet</b>
 
-💰 Bonus: ${WEEKLY_BONUS_AMOUNT}
+💰 Bonus: {format_money(WEEKLY_BONUS_AMOUNT)}
 ⏳ Time left: {hours_remaining}h {minutes_remaining}m
 
 Come back later!
@@ -3133,7 +7277,11 @@ Come back later!
     async def claim_weekly_bonus_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle weekly bonus claim"""
         user_id = update.callback_query.from_user.id
-        can_claim, seconds_remaining = await can_claim_weekly_bonus(user_id)
+        can_claim, seconds_remaining = can_claim_weekly_bonus(user_id)
+        balance = await claim_weekly_bonus(user_id) if can_claim else None
+        if balance is None and can_claim:
+            # Lost a race with another claim, or the cache was stale
+            can_claim, seconds_remaining = can_claim_weekly_bonus(user_id)
         
         if not can_claim:
             hours_remaining = seconds_remaining // 3600
@@ -3150,17 +7298,13 @@ You can claim your next weekly bonus in {hours_remaining}h {minutes_remaining}m.
             await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
             return
         
-        # Claim the bonus
-        success = await claim_weekly_bonus(user_id)
-        
-        if success:
-            user = await get_user(user_id)
-            balance_str = await format_usd(user['balance'])
+        if balance is not None:
+            balance_str = format_usd(balance)
             
             text = f"""
 🎉 <b>BONUS CLAIMED!</b>
 
-💰 Bonus: ${WEEKLY_BONUS_AMOUNT}
+💰 Bonus: {format_money(WEEKLY_BONUS_AMOUNT)}
 💳 Balance: {balance_str}
 
 Enjoy!
@@ -3183,6 +7327,24 @@ Please try again or contact support.
     
     application.add_handler(CallbackQueryHandler(callback_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input_main))
+    return application
+
+async def run_telegram_bot_async():
+    """Run the Telegram bot with proper initialization"""
+    await init_db()  # Ensure DB is ready
+    await refresh_config(force=True)
+    
+    # Load the in-memory state bets and withdrawals consult before any update can arrive
+    await load_leaderboards()
+    await load_referral_graph()
+    await load_achievements()
+    await load_weekly_bonus_claims()
+    await load_bonus_campaigns()
+    await load_bonus_claims()
+
+    global bot_application
+    application = build_application()
+    bot_application = application
 
     # Initialize the application
     logger.info("🤖 Initializing Telegram bot...")
@@ -3193,12 +7355,28 @@ Please try again or contact support.
     logger.info("🤖 Starting bot polling...")
     await application.updater.start_polling(drop_pending_updates=True)
     
+    # Pick up broadcasts interrupted by the previous shutdown
+    await resume_broadcasts()
+    start_reconciliation()
+    start_rollups()
+    start_leaderboards()
+    start_referral_payouts()
+    start_config_refresh()
+    start_achievements()
+    start_bonus_campaigns()
+    start_activity_tracking()
+    
     # Keep the bot running
     try:
         while True:
             await asyncio.sleep(1)
     finally:
         # Cleanup on shutdown
+        await flush_game_rollups()
+        await snapshot_leaderboards()
+        await flush_achievements()
+        await pay_cashback()
+        await flush_activity(close_all=True)
         await application.updater.stop()
         await application.stop()
         await application.shutdown()
@@ -3214,144 +7392,19 @@ async def run_both_services():
     )
 
 
-if __name__ == "__main__":
-    # Run both web server and bot in the same event loop
-    # This works for both deployment and local development
-    print("🚀 Starting Axis Casino Bot...")
-    
-    try:
-        asyncio.run(run_both_services())
-    except KeyboardInterrupt:
-        print("\n👋 Shutting down gracefully...")
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
-        raise
-
 # --- Game Callback Handlers ---
 
 async def game_slots_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show slots game betting interface"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    
-    user = await get_user(user_id)
-    if not user:
-        await query.edit_message_text("❌ User not found. Please restart with /start")
-        return
-    
-    balance_str = await format_usd(user['balance'])
-    
-    text = f"""
-🎰 <b>SLOTS</b>
-
-💰 Balance: {balance_str}
-
-<b>Payouts:</b>
-🍒🍒🍒 10x • 🍋🍋🍋 20x • 🍊🍊🍊 30x
-🔔🔔🔔 50x • 💎💎💎 100x
-
-Choose bet:
-"""
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("$1", callback_data="slots_bet_1"),
-            InlineKeyboardButton("$5", callback_data="slots_bet_5"),
-            InlineKeyboardButton("$10", callback_data="slots_bet_10")
-        ],
-        [
-            InlineKeyboardButton("$25", callback_data="slots_bet_25"),
-            InlineKeyboardButton("$50", callback_data="slots_bet_50"),
-            InlineKeyboardButton("$100", callback_data="slots_bet_100")
-        ],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-    ]
-    
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    await show_game_menu(update, "slots")
 
 async def game_blackjack_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show blackjack game betting interface"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    
-    user = await get_user(user_id)
-    if not user:
-        await query.edit_message_text("❌ User not found. Please restart with /start")
-        return
-    
-    balance_str = await format_usd(user['balance'])
-    
-    text = f"""
-🃏 <b>BLACKJACK</b>
-
-💰 Balance: {balance_str}
-
-<b>Rules:</b>
-Get to 21 • Beat dealer • Blackjack pays 3:2
-
-<b>Card Values:</b>
-Numbers = face • Face cards = 10 • Ace = 1 or 11
-
-Choose bet:
-"""
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("$1", callback_data="blackjack_bet_1"),
-            InlineKeyboardButton("$5", callback_data="blackjack_bet_5"),
-            InlineKeyboardButton("$10", callback_data="blackjack_bet_10")
-        ],
-        [
-            InlineKeyboardButton("$25", callback_data="blackjack_bet_25"),
-            InlineKeyboardButton("$50", callback_data="blackjack_bet_50"),
-            InlineKeyboardButton("$100", callback_data="blackjack_bet_100")
-        ],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-    ]
-    
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    await show_game_menu(update, "blackjack")
 
 async def game_dice_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show dice game betting interface"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    
-    user = await get_user(user_id)
-    if not user:
-        await query.edit_message_text("❌ User not found. Please restart with /start")
-        return
-    
-    balance_str = await format_usd(user['balance'])
-    
-    text = f"""
-🎲 <b>DICE</b>
-
-💰 Balance: {balance_str}
-
-<b>Options:</b>
-HIGH (8-12) = 2x • LOW (2-7) = 2x • Lucky 7 = 5x
-
-Choose bet:
-"""
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("$1", callback_data="dice_bet_1"),
-            InlineKeyboardButton("$5", callback_data="dice_bet_5"),
-            InlineKeyboardButton("$10", callback_data="dice_bet_10")
-        ],
-        [
-            InlineKeyboardButton("$25", callback_data="dice_bet_25"),
-            InlineKeyboardButton("$50", callback_data="dice_bet_50"),
-            InlineKeyboardButton("$100", callback_data="dice_bet_100")
-        ],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-    ]
-    
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    await show_game_menu(update, "dice")
 
 async def game_roulette_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show roulette game interface"""
@@ -3371,95 +7424,11 @@ European wheel with multiple betting options and high payouts.
 
 async def game_basketball_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show basketball game betting interface"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    
-    user = await get_user(user_id)
-    if not user:
-        await query.edit_message_text("❌ User not found. Please restart with /start")
-        return
-    
-    balance_str = await format_usd(user['balance'])
-    
-    text = f"""
-🏀 <b>BASKETBALL 1v1</b>
-
-💰 Balance: {balance_str}
-
-<b>Game Mode:</b>
-First to score wins! You vs Bot
-
-<b>Shot Success Rates:</b>
-🎯 Free Throw: 70% - 2x payout
-⛹️ Jump Shot: 50% - 3x payout
-🔥 3-Pointer: 30% - 5x payout
-💥 Half Court: 5% - 20x payout
-
-Choose bet:
-"""
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("$1", callback_data="basketball_bet_1"),
-            InlineKeyboardButton("$5", callback_data="basketball_bet_5"),
-            InlineKeyboardButton("$10", callback_data="basketball_bet_10")
-        ],
-        [
-            InlineKeyboardButton("$25", callback_data="basketball_bet_25"),
-            InlineKeyboardButton("$50", callback_data="basketball_bet_50"),
-            InlineKeyboardButton("$100", callback_data="basketball_bet_100")
-        ],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-    ]
-    
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    await show_game_menu(update, "basketball")
 
 async def game_darts_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show darts game betting interface"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    
-    user = await get_user(user_id)
-    if not user:
-        await query.edit_message_text("❌ User not found. Please restart with /start")
-        return
-    
-    balance_str = await format_usd(user['balance'])
-    
-    text = f"""
-🎯 <b>DARTS 1v1</b>
-
-💰 Balance: {balance_str}
-
-<b>Game Mode:</b>
-Highest score wins! You vs Bot
-
-<b>Target Hit Rates:</b>
-🟢 Outer Bull: 65% - 2x payout (25 pts)
-🔴 Inner Bull: 45% - 3x payout (50 pts)
-💎 Triple 20: 30% - 5x payout (60 pts)
-🏆 Triple Bull: 10% - 15x payout (180 pts)
-
-Choose bet:
-"""
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("$1", callback_data="darts_bet_1"),
-            InlineKeyboardButton("$5", callback_data="darts_bet_5"),
-            InlineKeyboardButton("$10", callback_data="darts_bet_10")
-        ],
-        [
-            InlineKeyboardButton("$25", callback_data="darts_bet_25"),
-            InlineKeyboardButton("$50", callback_data="darts_bet_50"),
-            InlineKeyboardButton("$100", callback_data="darts_bet_100")
-        ],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
-    ]
-    
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    await show_game_menu(update, "darts")
 
 # --- Game Logic Functions ---
 
@@ -3475,7 +7444,7 @@ def generate_slot_reels() -> List[str]:
     
     return [random.choice(weighted_symbols) for _ in range(3)]
 
-def calculate_slots_win(reels: List[str], bet_amount: float) -> Tuple[float, str]:
+def calculate_slots_win(reels: List[str], bet_amount: int) -> Tuple[int, str]:
     """Calculate slots winnings"""
     payouts = {'🍒': 10, '🍋': 20, '🍊': 30, '🔔': 50, '💎': 100}
     
@@ -3488,10 +7457,10 @@ def calculate_slots_win(reels: List[str], bet_amount: float) -> Tuple[float, str
     
     # Check for two matching symbols (small consolation)
     elif reels[0] == reels[1] or reels[1] == reels[2] or reels[0] == reels[2]:
-        win_amount = bet_amount * 0.5
+        win_amount = bet_amount // 2
         return win_amount, "Two matching symbols - small win!"
     
-    return 0.0, "No match - try again!"
+    return 0, "No match - try again!"
 
 def generate_blackjack_hand() -> List[str]:
     """Generate a blackjack hand"""
@@ -3556,6 +7525,8 @@ def throw_dart(target: str) -> int:
 
 # --- Game Betting Handlers ---
 
+@traced()
+@observe_latency(SETTLEMENT_SECONDS, "slots")
 async def handle_slots_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle slots betting"""
     query = update.callback_query
@@ -3563,7 +7534,12 @@ async def handle_slots_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     # Extract bet amount from callback data
-    bet_amount = float(query.data.split("_")[-1])
+    bet_amount = to_micros(query.data.split("_")[-1])
+    
+    bet_error = check_bet_allowed(bet_amount)
+    if bet_error:
+        await query.edit_message_text(bet_error, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Games", callback_data="mini_app_centre")]]))
+        return
     
     # Check user balance
     user = await get_user(user_id)
@@ -3574,29 +7550,16 @@ async def handle_slots_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Deduct bet amount
-    success = await deduct_balance(user_id, bet_amount)
-    if not success:
-        await query.edit_message_text("❌ Error processing bet. Please try again.")
-        return
-    
     # Play the game
     reels = generate_slot_reels()
     win_amount, result_text = calculate_slots_win(reels, bet_amount)
     
-    # Update balance if won
-    if win_amount > 0:
-        await update_balance(user_id, win_amount)
-    
-    # Log game session
-    await log_game_session(user_id, 'slots', bet_amount, win_amount, result_text)
-    
-    # Update house balance
-    await update_house_balance_on_game(bet_amount, win_amount)
-    
-    # Get updated balance
-    user = await get_user(user_id)
-    balance_str = await format_usd(user['balance'])
+    # Stake, payout and bookkeeping settle together or not at all
+    balance = await place_bet(user_id, 'slots', bet_amount, win_amount, result_text)
+    if balance is None:
+        await query.edit_message_text("❌ Error processing bet. Please try again.")
+        return
+    balance_str = format_usd(balance)
     
     # Create result message
     slots_display = f"{reels[0]} | {reels[1]} | {reels[2]}"
@@ -3609,8 +7572,8 @@ async def handle_slots_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 {result_text}
 
-💰 Bet: ${bet_amount:.2f}
-🏆 Won: ${win_amount:.2f}
+💰 Bet: {format_money(bet_amount)}
+🏆 Won: {format_money(win_amount)}
 📊 Balance: {balance_str}
 """
     else:
@@ -3621,8 +7584,8 @@ async def handle_slots_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 {result_text}
 
-💰 Bet: ${bet_amount:.2f}
-💸 Lost: ${bet_amount:.2f}
+💰 Bet: {format_money(bet_amount)}
+💸 Lost: {format_money(bet_amount)}
 📊 Balance: {balance_str}
 """
     
@@ -3636,6 +7599,8 @@ async def handle_slots_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(result_message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
 
+@traced()
+@observe_latency(SETTLEMENT_SECONDS, "blackjack")
 async def handle_blackjack_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle blackjack betting"""
     query = update.callback_query
@@ -3643,7 +7608,12 @@ async def handle_blackjack_bet(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = query.from_user.id
     
     # Extract bet amount from callback data
-    bet_amount = float(query.data.split("_")[-1])
+    bet_amount = to_micros(query.data.split("_")[-1])
+    
+    bet_error = check_bet_allowed(bet_amount)
+    if bet_error:
+        await query.edit_message_text(bet_error, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Games", callback_data="mini_app_centre")]]))
+        return
     
     # Check user balance
     user = await get_user(user_id)
@@ -3654,12 +7624,6 @@ async def handle_blackjack_bet(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
     
-    # Deduct bet amount
-    success = await deduct_balance(user_id, bet_amount)
-    if not success:
-        await query.edit_message_text("❌ Error processing bet. Please try again.")
-        return
-    
     # Play the game
     player_hand = generate_blackjack_hand()
     dealer_hand = generate_blackjack_hand()
@@ -3668,12 +7632,12 @@ async def handle_blackjack_bet(update: Update, context: ContextTypes.DEFAULT_TYP
     dealer_value = calculate_hand_value(dealer_hand)
     
     # Simple blackjack logic (auto-play)
-    win_amount = 0.0
+    win_amount = 0
     result_text = ""
     
     if player_value == 21:
         # Player blackjack
-        win_amount = bet_amount * 2.5  # 3:2 payout
+        win_amount = bet_amount * 5 // 2  # 3:2 payout
         result_text = "BLACKJACK! You got 21!"
     elif player_value > 21:
         # Player bust
@@ -3694,19 +7658,12 @@ async def handle_blackjack_bet(update: Update, context: ContextTypes.DEFAULT_TYP
         # Dealer wins
         result_text = f"DEALER WINS! {dealer_value} beats {player_value}"
     
-    # Update balance if won
-    if win_amount > 0:
-        await update_balance(user_id, win_amount)
-    
-    # Log game session
-    await log_game_session(user_id, 'blackjack', bet_amount, win_amount, result_text)
-    
-    # Update house balance
-    await update_house_balance_on_game(bet_amount, win_amount)
-    
-    # Get updated balance
-    user = await get_user(user_id)
-    balance_str = await format_usd(user['balance'])
+    # Stake, payout and bookkeeping settle together or not at all
+    balance = await place_bet(user_id, 'blackjack', bet_amount, win_amount, result_text)
+    if balance is None:
+        await query.edit_message_text("❌ Error processing bet. Please try again.")
+        return
+    balance_str = format_usd(balance)
     
     # Create result message
     player_cards = " ".join(player_hand)
@@ -3720,8 +7677,8 @@ async def handle_blackjack_bet(update: Update, context: ContextTypes.DEFAULT_TYP
 
 {result_text}
 
-💰 Bet: ${bet_amount:.2f}
-🏆 Won: ${win_amount:.2f}
+💰 Bet: {format_money(bet_amount)}
+🏆 Won: {format_money(win_amount)}
 📊 Balance: {balance_str}
 """
     
@@ -3742,7 +7699,7 @@ async def handle_dice_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     # Extract bet amount from callback data
-    bet_amount = float(query.data.split("_")[-1])
+    bet_amount = to_micros(query.data.split("_")[-1])
     
     # Check user balance
     user = await get_user(user_id)
@@ -3756,28 +7713,30 @@ async def handle_dice_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Store bet amount in user data for the next step
     context.user_data['dice_bet_amount'] = bet_amount
     
-    balance_str = await format_usd(user['balance'])
+    balance_str = format_usd(user['balance'])
     
     text = f"""
 🎲 <b>DICE</b>
 
 💰 Balance: {balance_str}
-💵 Bet: ${bet_amount:.2f}
+💵 Bet: {format_money(bet_amount)}
 
 Choose your prediction:
 """
     
     keyboard = [
         [
-            InlineKeyboardButton("🔺 HIGH (8-12) - 2x", callback_data=f"dice_play_high_{bet_amount}"),
-            InlineKeyboardButton("🔻 LOW (2-7) - 2x", callback_data=f"dice_play_low_{bet_amount}")
+            InlineKeyboardButton("🔺 HIGH (8-12) - 2x", callback_data=f"dice_play_high_{usd_callback_arg(bet_amount)}"),
+            InlineKeyboardButton("🔻 LOW (2-7) - 2x", callback_data=f"dice_play_low_{usd_callback_arg(bet_amount)}")
         ],
-        [InlineKeyboardButton("🎯 LUCKY 7 - 5x", callback_data=f"dice_play_seven_{bet_amount}")],
+        [InlineKeyboardButton("🎯 LUCKY 7 - 5x", callback_data=f"dice_play_seven_{usd_callback_arg(bet_amount)}")],
         [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
     ]
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
 
+@traced()
+@observe_latency(SETTLEMENT_SECONDS, "dice")
 async def handle_dice_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle dice game play"""
     query = update.callback_query
@@ -3787,12 +7746,11 @@ async def handle_dice_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Parse callback data: dice_play_high_25 or dice_play_low_10 or dice_play_seven_50
     parts = query.data.split("_")
     prediction = parts[2]  # high, low, seven
-    bet_amount = float(parts[3])
+    bet_amount = to_micros(parts[3])
     
-    # Deduct bet amount
-    success = await deduct_balance(user_id, bet_amount)
-    if not success:
-        await query.edit_message_text("❌ Error processing bet. Please try again.")
+    bet_error = check_bet_allowed(bet_amount)
+    if bet_error:
+        await query.edit_message_text(bet_error, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Games", callback_data="mini_app_centre")]]))
         return
     
     # Roll dice
@@ -3805,7 +7763,7 @@ async def handle_dice_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     die2_emoji = dice_emojis[die2]
     
     # Calculate result
-    win_amount = 0.0
+    win_amount = 0
     result_text = ""
     
     if prediction == "high" and total >= 8:
@@ -3825,19 +7783,12 @@ async def handle_dice_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif prediction == "seven":
             result_text = f"You predicted 7 but got {total}"
     
-    # Update balance if won
-    if win_amount > 0:
-        await update_balance(user_id, win_amount)
-    
-    # Log game session
-    await log_game_session(user_id, 'dice', bet_amount, win_amount, result_text)
-    
-    # Update house balance
-    await update_house_balance_on_game(bet_amount, win_amount)
-    
-    # Get updated balance
-    user = await get_user(user_id)
-    balance_str = await format_usd(user['balance'])
+    # Stake, payout and bookkeeping settle together or not at all
+    balance = await place_bet(user_id, 'dice', bet_amount, win_amount, result_text)
+    if balance is None:
+        await query.edit_message_text("❌ Error processing bet. Please try again.")
+        return
+    balance_str = format_usd(balance)
     
     # Create result message
     result_message = f"""
@@ -3847,8 +7798,8 @@ Roll: {die1_emoji} {die2_emoji} = {total}
 
 {result_text}
 
-💰 Bet: ${bet_amount:.2f}
-🏆 Won: ${win_amount:.2f}
+💰 Bet: {format_money(bet_amount)}
+🏆 Won: {format_money(win_amount)}
 📊 Balance: {balance_str}
 """
     
@@ -3869,7 +7820,7 @@ async def handle_basketball_bet(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = query.from_user.id
     
     # Extract bet amount from callback data
-    bet_amount = float(query.data.split("_")[-1])
+    bet_amount = to_micros(query.data.split("_")[-1])
     
     # Check user balance
     user = await get_user(user_id)
@@ -3883,13 +7834,13 @@ async def handle_basketball_bet(update: Update, context: ContextTypes.DEFAULT_TY
     # Store bet amount in user data for the next step
     context.user_data['basketball_bet_amount'] = bet_amount
     
-    balance_str = await format_usd(user['balance'])
+    balance_str = format_usd(user['balance'])
     
     text = f"""
 🏀 <b>BASKETBALL 1v1</b>
 
 💰 Balance: {balance_str}
-💵 Bet: ${bet_amount:.2f}
+💵 Bet: {format_money(bet_amount)}
 
 <b>⚔️ YOU vs BOT</b>
 First to score wins!
@@ -3898,15 +7849,17 @@ Choose your shot type:
 """
     
     keyboard = [
-        [InlineKeyboardButton("🎯 Free Throw - 2x (70%)", callback_data=f"basketball_shoot_free_throw_{bet_amount}")],
-        [InlineKeyboardButton("⛹️ Jump Shot - 3x (50%)", callback_data=f"basketball_shoot_jump_shot_{bet_amount}")],
-        [InlineKeyboardButton("🔥 3-Pointer - 5x (30%)", callback_data=f"basketball_shoot_three_pointer_{bet_amount}")],
-        [InlineKeyboardButton("💥 Half Court - 20x (5%)", callback_data=f"basketball_shoot_half_court_{bet_amount}")],
+        [InlineKeyboardButton("🎯 Free Throw - 2x (70%)", callback_data=f"basketball_shoot_free_throw_{usd_callback_arg(bet_amount)}")],
+        [InlineKeyboardButton("⛹️ Jump Shot - 3x (50%)", callback_data=f"basketball_shoot_jump_shot_{usd_callback_arg(bet_amount)}")],
+        [InlineKeyboardButton("🔥 3-Pointer - 5x (30%)", callback_data=f"basketball_shoot_three_pointer_{usd_callback_arg(bet_amount)}")],
+        [InlineKeyboardButton("💥 Half Court - 20x (5%)", callback_data=f"basketball_shoot_half_court_{usd_callback_arg(bet_amount)}")],
         [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
     ]
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
 
+@traced()
+@observe_latency(SETTLEMENT_SECONDS, "basketball")
 async def handle_basketball_shoot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle basketball 1v1 match"""
     query = update.callback_query
@@ -3916,12 +7869,11 @@ async def handle_basketball_shoot(update: Update, context: ContextTypes.DEFAULT_
     # Parse callback data: basketball_shoot_free_throw_10 or basketball_shoot_three_pointer_25
     parts = query.data.split("_")
     shot_type = "_".join(parts[2:-1])  # free_throw, jump_shot, three_pointer, half_court
-    bet_amount = float(parts[-1])
+    bet_amount = to_micros(parts[-1])
     
-    # Deduct bet amount
-    success = await deduct_balance(user_id, bet_amount)
-    if not success:
-        await query.edit_message_text("❌ Error processing bet. Please try again.")
+    bet_error = check_bet_allowed(bet_amount)
+    if bet_error:
+        await query.edit_message_text(bet_error, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Games", callback_data="mini_app_centre")]]))
         return
     
     # 1v1 Match: Both players shoot
@@ -3929,7 +7881,7 @@ async def handle_basketball_shoot(update: Update, context: ContextTypes.DEFAULT_
     bot_made_shot = shoot_basketball(shot_type)
     
     # Calculate result
-    win_amount = 0.0
+    win_amount = 0
     result_text = ""
     match_result = ""
     multipliers = {
@@ -3973,19 +7925,12 @@ async def handle_basketball_shoot(update: Update, context: ContextTypes.DEFAULT_
         result_text = f"🤝 <b>TIE GAME!</b>"
         match_result = f"{player_emoji} BOTH MISSED {bot_emoji}"
     
-    # Update balance if won
-    if win_amount > 0:
-        await update_balance(user_id, win_amount)
-    
-    # Log game session
-    await log_game_session(user_id, 'basketball', bet_amount, win_amount, f"{result_text} - {match_result}")
-    
-    # Update house balance
-    await update_house_balance_on_game(bet_amount, win_amount)
-    
-    # Get updated balance
-    user = await get_user(user_id)
-    balance_str = await format_usd(user['balance'])
+    # Stake, payout and bookkeeping settle together or not at all
+    balance = await place_bet(user_id, 'basketball', bet_amount, win_amount, f"{result_text} - {match_result}")
+    if balance is None:
+        await query.edit_message_text("❌ Error processing bet. Please try again.")
+        return
+    balance_str = format_usd(balance)
     
     # Create result message
     result_message = f"""
@@ -3997,8 +7942,8 @@ async def handle_basketball_shoot(update: Update, context: ContextTypes.DEFAULT_
 
 {match_result}
 
-💰 Bet: ${bet_amount:.2f}
-🏆 Won: ${win_amount:.2f}
+💰 Bet: {format_money(bet_amount)}
+🏆 Won: {format_money(win_amount)}
 📊 Balance: {balance_str}
 """
     
@@ -4019,7 +7964,7 @@ async def handle_darts_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     # Extract bet amount from callback data
-    bet_amount = float(query.data.split("_")[-1])
+    bet_amount = to_micros(query.data.split("_")[-1])
     
     # Check user balance
     user = await get_user(user_id)
@@ -4033,13 +7978,13 @@ async def handle_darts_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Store bet amount in user data for the next step
     context.user_data['darts_bet_amount'] = bet_amount
     
-    balance_str = await format_usd(user['balance'])
+    balance_str = format_usd(user['balance'])
     
     text = f"""
 🎯 <b>DARTS 1v1</b>
 
 💰 Balance: {balance_str}
-💵 Bet: ${bet_amount:.2f}
+💵 Bet: {format_money(bet_amount)}
 
 <b>⚔️ YOU vs BOT</b>
 Highest score wins!
@@ -4048,15 +7993,17 @@ Choose your target:
 """
     
     keyboard = [
-        [InlineKeyboardButton("🟢 Outer Bull - 2x (65%)", callback_data=f"darts_throw_outer_bull_{bet_amount}")],
-        [InlineKeyboardButton("🔴 Inner Bull - 3x (45%)", callback_data=f"darts_throw_inner_bull_{bet_amount}")],
-        [InlineKeyboardButton("💎 Triple 20 - 5x (30%)", callback_data=f"darts_throw_triple_20_{bet_amount}")],
-        [InlineKeyboardButton("🏆 Triple Bull - 15x (10%)", callback_data=f"darts_throw_triple_bull_{bet_amount}")],
+        [InlineKeyboardButton("🟢 Outer Bull - 2x (65%)", callback_data=f"darts_throw_outer_bull_{usd_callback_arg(bet_amount)}")],
+        [InlineKeyboardButton("🔴 Inner Bull - 3x (45%)", callback_data=f"darts_throw_inner_bull_{usd_callback_arg(bet_amount)}")],
+        [InlineKeyboardButton("💎 Triple 20 - 5x (30%)", callback_data=f"darts_throw_triple_20_{usd_callback_arg(bet_amount)}")],
+        [InlineKeyboardButton("🏆 Triple Bull - 15x (10%)", callback_data=f"darts_throw_triple_bull_{usd_callback_arg(bet_amount)}")],
         [InlineKeyboardButton("🔙 Back to Games", callback_data="mini_app_centre")]
     ]
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
 
+@traced()
+@observe_latency(SETTLEMENT_SECONDS, "darts")
 async def handle_darts_throw(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle darts 1v1 match"""
     query = update.callback_query
@@ -4066,12 +8013,11 @@ async def handle_darts_throw(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Parse callback data: darts_throw_outer_bull_10 or darts_throw_triple_20_25
     parts = query.data.split("_")
     target_type = "_".join(parts[2:-1])  # outer_bull, inner_bull, triple_20, triple_bull
-    bet_amount = float(parts[-1])
+    bet_amount = to_micros(parts[-1])
     
-    # Deduct bet amount
-    success = await deduct_balance(user_id, bet_amount)
-    if not success:
-        await query.edit_message_text("❌ Error processing bet. Please try again.")
+    bet_error = check_bet_allowed(bet_amount)
+    if bet_error:
+        await query.edit_message_text(bet_error, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Games", callback_data="mini_app_centre")]]))
         return
     
     # 1v1 Match: Both players throw
@@ -4079,7 +8025,7 @@ async def handle_darts_throw(update: Update, context: ContextTypes.DEFAULT_TYPE)
     bot_score = throw_dart(target_type)
     
     # Calculate result
-    win_amount = 0.0
+    win_amount = 0
     result_text = ""
     match_result = ""
     multipliers = {
@@ -4115,19 +8061,12 @@ async def handle_darts_throw(update: Update, context: ContextTypes.DEFAULT_TYPE)
         result_text = f"🤝 <b>TIE GAME!</b>"
         match_result = f"📊 BOTH: {player_score} pts"
     
-    # Update balance if won
-    if win_amount > 0:
-        await update_balance(user_id, win_amount)
-    
-    # Log game session
-    await log_game_session(user_id, 'darts', bet_amount, win_amount, f"{result_text} - {match_result}")
-    
-    # Update house balance
-    await update_house_balance_on_game(bet_amount, win_amount)
-    
-    # Get updated balance
-    user = await get_user(user_id)
-    balance_str = await format_usd(user['balance'])
+    # Stake, payout and bookkeeping settle together or not at all
+    balance = await place_bet(user_id, 'darts', bet_amount, win_amount, f"{result_text} - {match_result}")
+    if balance is None:
+        await query.edit_message_text("❌ Error processing bet. Please try again.")
+        return
+    balance_str = format_usd(balance)
     
     # Create result message
     result_message = f"""
@@ -4139,8 +8078,8 @@ async def handle_darts_throw(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 {match_result}
 
-💰 Bet: ${bet_amount:.2f}
-🏆 Won: ${win_amount:.2f}
+💰 Bet: {format_money(bet_amount)}
+🏆 Won: {format_money(win_amount)}
 📊 Balance: {balance_str}
 """
     
@@ -4153,3 +8092,17 @@ async def handle_darts_throw(update: Update, context: ContextTypes.DEFAULT_TYPE)
     ]
     
     await query.edit_message_text(result_message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+
+
+if __name__ == "__main__":
+    # Run both web server and bot in the same event loop
+    # This works for both deployment and local development
+    print("🚀 Starting Axis Casino Bot...")
+    
+    try:
+        asyncio.run(run_both_services())
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down gracefully...")
+    except Exception as e:
+        logger.error(f"Fatal error: {e}")
+        raise
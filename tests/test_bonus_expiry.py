@@ -0,0 +1,76 @@
+"""Expiring a bonus claim forfeits only what is left of the bonus"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("LOG_TO_FILE", "false")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+import aiosqlite
+import pytest
+
+import main
+
+USER_ID = 1001
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DB_PATH", str(tmp_path / "casino.db"))
+    main._active_claims.clear()
+    asyncio.run(main.init_db())
+    asyncio.run(main.create_user(USER_ID, "player"))
+    yield
+    main._active_claims.clear()
+
+
+async def grant_deposit_bonus(bonus_usd: int) -> None:
+    """Run a 100% deposit match with 10x wagering for a deposit of bonus_usd"""
+    assert await main.create_bonus_campaign("deposit_bonus", "Match", {"percentage": "100", "wagering": "10"}) is None
+    await main.update_balance(USER_ID, bonus_usd * main.MICRO, "deposit")
+    await main.apply_deposit_bonuses(USER_ID, bonus_usd * main.MICRO)
+
+
+async def expire_now() -> int:
+    async with aiosqlite.connect(main.DB_PATH) as db:
+        await db.execute("UPDATE user_bonus_claims SET expires_at = ?",
+                         ((datetime.now() - timedelta(seconds=1)).isoformat(),))
+        await db.commit()
+    return await main.expire_bonus_claims()
+
+
+async def balance() -> int:
+    return (await main.get_user(USER_ID))["balance"]
+
+
+def test_expiry_forfeits_unspent_bonus():
+    async def scenario():
+        await grant_deposit_bonus(10)
+        assert await balance() == 20 * main.MICRO
+        assert await expire_now() == 1
+        assert await balance() == 10 * main.MICRO
+
+    asyncio.run(scenario())
+
+
+def test_expiry_spares_deposits_after_the_bonus_was_lost():
+    async def scenario():
+        await grant_deposit_bonus(10)
+        # Lose the deposit and the bonus, then deposit again
+        assert await main.place_bet(USER_ID, "slots", 20 * main.MICRO, 0, "loss") == 0
+        await main.update_balance(USER_ID, 50 * main.MICRO, "deposit")
+        assert await expire_now() == 1
+        assert await balance() == 50 * main.MICRO
+
+    asyncio.run(scenario())
+
+
+def test_expiry_forfeits_only_the_part_of_the_bonus_left():
+    async def scenario():
+        await grant_deposit_bonus(10)
+        assert await main.place_bet(USER_ID, "slots", 4 * main.MICRO, 0, "loss") == 16 * main.MICRO
+        assert await expire_now() == 1
+        assert await balance() == 10 * main.MICRO
+
+    asyncio.run(scenario())